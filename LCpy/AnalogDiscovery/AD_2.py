@@ -9,33 +9,180 @@
        numpy, matplotlib
 """
 
-import dwf
+import hashlib
+import sys
+import threading
 import time
-import matplotlib.pyplot as plt
+from ctypes import cdll, c_int, c_double, POINTER, create_string_buffer
 import numpy as np
-from LCpy.ez_thread import threaded
+try:
+	import dwf
+except ImportError:
+	dwf = None #only simulated backends (LCpy.AnalogDiscovery.sim_dwf) will work
+try:
+	import matplotlib.pyplot as plt
+except ImportError:
+	plt = None
+from LCpy.ez_thread import threaded, cancelled, wait_async
+from LCpy.metrics import registry
+from LCpy.AnalogDiscovery.dwfconstants import trigsrcNone, trigsrcPC
+
+def _load_dwf_lib():
+	# The dwf package hands statusData back as a Python list; going to the
+	# library directly lets samples be read straight into a numpy array.
+	try:
+		if sys.platform.startswith("win"):
+			return cdll.dwf
+		elif sys.platform.startswith("darwin"):
+			return cdll.LoadLibrary("/Library/Frameworks/dwf.framework/dwf")
+		else:
+			return cdll.LoadLibrary("libdwf.so")
+	except OSError:
+		return None
+
+_dwf_lib = _load_dwf_lib()
+
+def _check(lib,ok,call):
+	# The raw calls return 0 on failure; raise with the library's message, as
+	# the dwf package does for the calls it wraps
+	if ok == 0:
+		msg = create_string_buffer(512)
+		lib.FDwfGetLastErrorMsg(msg)
+		raise RuntimeError('%s failed: %s' % (call,msg.value.decode(errors='replace').strip()))
+
+def _status_data_into(lib,dwf_ai,channel,out):
+	"""
+	Reads the next len(out) samples of a channel straight into out, which must
+	be a contiguous float64 array (e.g. a row slice of the record).
+	"""
+	hdwf = getattr(dwf_ai,'hdwf',None)
+	if lib is None or hdwf is None:
+		out[:] = dwf_ai.statusData(channel,len(out))
+		return
+	_check(lib,lib.FDwfAnalogInStatusData(hdwf,c_int(channel),out.ctypes.data_as(POINTER(c_double)),c_int(len(out))),'FDwfAnalogInStatusData')
+
+def _node_data_set(lib,dwf_ao,channel,node,data):
+	"""
+	Hands data, a contiguous float64 array, to FDwfAnalogOutNodeDataSet
+	straight from its buffer.
+	"""
+	hdwf = getattr(dwf_ao,'hdwf',None)
+	if lib is None or hdwf is None:
+		dwf_ao.nodeDataSet(channel,node,data.tolist())
+		return
+	_check(lib,lib.FDwfAnalogOutNodeDataSet(hdwf,c_int(channel),c_int(int(node)),data.ctypes.data_as(POINTER(c_double)),c_int(len(data))),
+		'FDwfAnalogOutNodeDataSet')
+
+def _node_play_data(lib,dwf_ao,channel,node,data):
+	"""
+	Hands data, a contiguous float64 array, to FDwfAnalogOutNodePlayData
+	straight from its buffer.
+	"""
+	hdwf = getattr(dwf_ao,'hdwf',None)
+	if lib is None or hdwf is None:
+		dwf_ao.nodePlayData(channel,node,data.tolist())
+		return
+	_check(lib,lib.FDwfAnalogOutNodePlayData(hdwf,c_int(channel),c_int(int(node)),data.ctypes.data_as(POINTER(c_double)),c_int(len(data))),
+		'FDwfAnalogOutNodePlayData')
+
+# Node parameters Analog_Discovery keeps a shadow of, with their setters, in
+# the order they're sent
+_NODE_SETTERS = (('enable','nodeEnableSet'),('function','nodeFunctionSet'),('frequency','nodeFrequencySet'),
+	('amplitude','nodeAmplitudeSet'),('offset','nodeOffsetSet'))
+
+def _hdwf(lib,dwf_obj):
+	hdwf = getattr(dwf_obj,'hdwf',None)
+	if lib is None or hdwf is None:
+		raise RuntimeError('Hardware triggering needs direct access to the dwf library')
+	return hdwf
 
 class Analog_Discovery:
 	def __init__(self,verbose=False,acq_samp_Hz=10e3,acq_n_samp=1000,
-	waveform=1,out_freq=50,out_amp=1.0,acq_range=15.0):
+	waveform=1,out_freq=50,out_amp=1.0,acq_range=15.0,backend=None):
+		"""
+		:param backend: Stand-in for the dwf package, e.g. sim_dwf.sim_dwf() to
+			run without a device. Its lib attribute, if any, replaces the ctypes
+			dwf library.
+		"""
 		self.verbose = verbose;
-		if self.verbose: print("DWF Version: " + dwf.FDwfGetVersion())
+		if backend is None:
+			if dwf is None:
+				raise ImportError('dwf is not installed; pass backend=sim_dwf() to run without a device')
+			backend = dwf
+			self.lib = _dwf_lib;
+		else:
+			self.lib = getattr(backend,'lib',None);
+		self.dwf = backend;
+		if self.verbose: print("DWF Version: " + self.dwf.FDwfGetVersion())
 		#open device
 		if self.verbose: print("Opening device")
 		self.start_time = 0;
 		self.input_start_time = None;
-		self.dwf_ao = dwf.DwfAnalogOut()
+		self.poll_fill = 0.25; #fraction of the FIFO to let fill between reads
+		self.max_poll_wait = 0.1; #longest sleep between polls (s)
+		self.last_take_stats = {};
+		self.triggered = False;
+		self.trigger_pin = 0;
+		self.armed = threading.Event(); #set once the record is configured and waiting
+		self.metrics = registry('analog_discovery'); #counters/histograms, see LCpy.metrics
+		self.uploaded = {}; #content hash of the custom waveform on each (channel,node)
+		self.player = None; #output_player, created by the first play()
+		self.node_state = {}; #last parameters sent to each output (channel,node)
+		self.output_running = set(); #output channels started and not stopped since
+		self.dwf_ao = self.dwf.DwfAnalogOut()
 		self.output_setup(waveform=waveform,out_freq=out_freq,out_amp=out_amp)
-		self.dwf_ai = dwf.DwfAnalogIn(self.dwf_ao)
+		self.dwf_ai = self.dwf.DwfAnalogIn(self.dwf_ao)
 		self.input_setup(acq_samp_Hz=acq_samp_Hz,acq_n_samp=acq_n_samp,acq_range=acq_range)
 		
 	def output_off(self):
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.CARRIER, False)
+		self._node_set(0, self.dwf_ao.NODE.CARRIER, enable=False)
 		self.dwf_ao.configure(0, False)
+		self.output_running.discard(0)
 		return 
 
-	
-	def output_setup(self,waveform=None,out_freq=None,out_amp=None):
+	def _node_set(self,channel,node,**values):
+		"""
+		Sends the node parameters (enable, function, frequency, amplitude,
+		offset) that differ from those last sent to the node.
+
+		:return: The names of the parameters that changed.
+		:rtype: set
+		"""
+		state = self.node_state.setdefault((channel,int(node)),{})
+		changed = set()
+		for field, setter in _NODE_SETTERS:
+			if not field in values or (field in state and state[field] == values[field]):
+				continue
+			getattr(self.dwf_ao,setter)(channel, node, values[field])
+			state[field] = values[field]
+			changed.add(field)
+		self.metrics.counter('output_node_sets').inc(len(changed))
+		return changed
+
+	def _output_apply(self,channel,changed,restart=False):
+		"""
+		Puts changed node parameters into effect. The output is (re)started if
+		restart is set, if it isn't running, or if a node was switched on or off
+		or to another function; otherwise the changes are applied to the running
+		output (configure(channel,3)), which keeps the waveform going.
+		"""
+		if restart or not channel in self.output_running or 'function' in changed or 'enable' in changed:
+			self.dwf_ao.configure(channel, True)
+			self.output_running.add(channel)
+			self.output_start_time = time.time();
+			self.metrics.counter('output_restarts').inc()
+		elif changed:
+			self.dwf_ao.configure(channel, 3)
+			self.metrics.counter('output_applies').inc()
+
+	def _forget_output(self,channel):
+		# For code that sets the output's nodes itself: the shadow no longer
+		# says what the device holds, so the next setup sends everything
+		for key in [key for key in self.node_state if key[0] == channel]:
+			del self.node_state[key]
+		self.output_running.discard(channel)
+
+	def output_setup(self,waveform=None,out_freq=None,out_amp=None,restart=False):
 		"""
 		If something isn't called, it's left at a default value. 
 		Waveform options are:
@@ -48,20 +195,90 @@ class Analog_Discovery:
 			NOISE: 6
 			CUSTOM: 30
 			PLAY: 31
+		Only the parameters that changed since the last setup are sent, and a
+		running output is updated in place unless the waveform changes (or
+		restart is set); see _output_apply.
 		"""
 		if self.verbose: print("Setting up the output...")
 		if not waveform is None: self.waveform = waveform;
 		if not out_freq is None: self.out_freq = out_freq;
 		if not out_amp is None: self.out_amp = out_amp;
 		
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.CARRIER, True)
-		self.dwf_ao.nodeFunctionSet(0, self.dwf_ao.NODE.CARRIER, self.waveform)
-		self.dwf_ao.nodeFrequencySet(0, self.dwf_ao.NODE.CARRIER, self.out_freq)
-		self.dwf_ao.nodeAmplitudeSet(0, self.dwf_ao.NODE.CARRIER, self.out_amp)
-		self.dwf_ao.configure(0, True)
-		self.output_start_time = time.time();
+		changed = self._node_set(0, self.dwf_ao.NODE.CARRIER, enable=True, function=self.waveform,
+			frequency=self.out_freq, amplitude=self.out_amp)
+		self._output_apply(0, changed, restart)
 		return 
 		
+	def upload_waveform(self,data,frequency=None,sample_rate=None,amplitude=None,offset=0.0,
+	normalize=True,channel=0,node=None,start=True):
+		"""
+		Plays an arbitrary waveform (function CUSTOM, 30) on an output node,
+		repeating it frequency times a second. The samples go to the device
+		straight from the array's buffer. Each node remembers the content hash
+		of the waveform last uploaded to it, so uploading the same samples again
+		(e.g. on every step of a sweep) only resets the node's parameters.
+
+		:param data: 1-D array of samples.
+		:param frequency: Rate (Hz) at which the whole buffer repeats.
+		:param sample_rate: Alternatively, the rate (Hz) of the individual samples.
+		:param amplitude: Output amplitude (V) of a full-scale (+/-1) sample.
+			Defaults to the peak of data when normalizing, so the output is data
+			in volts, and to 1 otherwise.
+		:param offset: Output offset (V).
+		:param normalize: Scale data to a peak of 1, as the device expects;
+			otherwise data must already lie within [-1, 1].
+		:param node: Output node, the carrier by default.
+		:param start: Put the waveform into effect once it is set up. The
+			output restarts only if it wasn't playing the same samples already.
+		:return: The content hash of the uploaded waveform.
+		:rtype: str
+		"""
+		node = self.dwf_ao.NODE.CARRIER if node is None else node
+		data = np.ascontiguousarray(data,dtype=np.float64)
+		if data.ndim != 1 or len(data) == 0:
+			raise ValueError('data must be a non-empty 1-D array')
+		if frequency is None:
+			if sample_rate is None:
+				raise ValueError('Give the frequency the waveform repeats at, or its sample_rate')
+			frequency = sample_rate/len(data)
+		peak = float(np.max(np.abs(data)))
+		if not normalize and peak > 1:
+			raise ValueError('Samples must lie within [-1, 1] unless normalize is set')
+		scale = peak if normalize and peak > 0 else 1.0
+		if amplitude is None:
+			amplitude = scale
+		key = hashlib.blake2b(data.tobytes(),digest_size=16,person=b'norm' if normalize else b'raw').hexdigest()
+		new = self.uploaded.get((channel,int(node))) != key
+		if new:
+			_node_data_set(self.lib,self.dwf_ao,channel,node,data/scale if scale != 1.0 else data)
+			self.uploaded[(channel,int(node))] = key
+			self.metrics.counter('waveform_uploads').inc()
+		else:
+			self.metrics.counter('waveform_upload_hits').inc()
+		changed = self._node_set(channel, node, enable=True, function=30, frequency=frequency,
+			amplitude=amplitude, offset=offset)
+		if channel == 0 and int(node) == int(self.dwf_ao.NODE.CARRIER):
+			self.waveform = 30;
+			self.out_freq = frequency;
+			self.out_amp = amplitude;
+		if start:
+			self._output_apply(channel, changed, restart=new)
+		return key
+
+	def play(self,source,sample_rate,**play_args):
+		"""
+		Streams an arbitrarily long waveform (an array, or a generator of
+		arrays) to the output with the PLAY function; see
+		play.output_player.play for the arguments. Playback runs on a thread of
+		its own, so take_data can record at the same time.
+
+		:return: A future for the playback statistics (underruns, samples lost, ...).
+		"""
+		if self.player is None:
+			from LCpy.AnalogDiscovery.play import output_player
+			self.player = output_player(self)
+		return self.player.play(source,sample_rate,**play_args)
+
 	def input_setup(self,acq_samp_Hz=None,acq_n_samp=None,acq_range=None):
 		#set up acquisition
 		if self.verbose: print("Setting up the input...")
@@ -76,87 +293,228 @@ class Analog_Discovery:
 		self.dwf_ai.acquisitionModeSet(self.dwf_ai.ACQMODE.RECORD)
 		self.dwf_ai.frequencySet(self.acq_samp_Hz)
 		self.dwf_ai.recordLengthSet(self.acq_n_samp / self.acq_samp_Hz)
+		try:
+			self.fifo_samples = int(self.dwf_ai.bufferSizeInfo()[1])
+		except Exception:
+			self.fifo_samples = 8192 #conservative default
 		return
+
+	def configure_trigger(self,pin=0):
+		"""
+		Makes the record wait for a PC trigger, and routes that same trigger out
+		of trigger pin T1 (pin=0) or T2 (pin=1). Wire the pin to the camera's
+		trigger input and one fire_trigger() starts both at the same edge.
+		"""
+		hdwf = _hdwf(self.lib,self.dwf_ai)
+		_check(self.lib,self.lib.FDwfAnalogInTriggerSourceSet(hdwf,trigsrcPC),'FDwfAnalogInTriggerSourceSet')
+		_check(self.lib,self.lib.FDwfDeviceTriggerSet(hdwf,c_int(pin),trigsrcPC),'FDwfDeviceTriggerSet')
+		self.trigger_pin = pin;
+		self.triggered = True;
+
+	def trigger_off(self):
+		hdwf = _hdwf(self.lib,self.dwf_ai)
+		_check(self.lib,self.lib.FDwfAnalogInTriggerSourceSet(hdwf,trigsrcNone),'FDwfAnalogInTriggerSourceSet')
+		_check(self.lib,self.lib.FDwfDeviceTriggerSet(hdwf,c_int(self.trigger_pin),trigsrcNone),'FDwfDeviceTriggerSet')
+		self.triggered = False;
+
+	def fire_trigger(self):
+		"""
+		Fires the PC trigger. The record (and anything on the trigger pin) starts now.
+		"""
+		_check(self.lib,self.lib.FDwfDeviceTriggerPC(_hdwf(self.lib,self.dwf_ai)),'FDwfDeviceTriggerPC')
+		self.input_start_time = time.time();
+
+	def _poll_wait(self,remaining,poll_fill):
+		"""
+		How long to sleep before the next poll: long enough for poll_fill of the
+		FIFO (or the rest of the record) to come in, capped at max_poll_wait.
+		"""
+		n = min(self.fifo_samples*poll_fill,remaining)
+		return min(max(n/self.acq_samp_Hz,0.0005),self.max_poll_wait)
 	
 	@threaded
-	def take_data(self):
+	def take_data(self,stages=None,keep_raw=True,pad_lost=False):
+		"""
+		Records acq_n_samp samples on both channels. Rather than spinning on
+		status(), the loop sleeps between polls for as long as it takes the
+		FIFO to fill to poll_fill of its size at acq_samp_Hz; if samples are
+		ever lost, poll_fill is halved for the rest of the record. How much
+		CPU the loop used is left in last_take_stats.
+
+		Every chunk is handed to the stages (e.g. a lockin.lockin) as soon as
+		it is read, as stage.process(chunk,start) with chunk a (2,n) view that
+		is overwritten afterwards and start its first sample's index in the
+		record. Lost samples are passed on as NaN, so the stages stay aligned
+		in time. Stages with reset()/reserve(n_samples) get those calls first.
+
+		As before, samples lost from the FIFO are left out of the returned
+		record, which is then shorter than acq_n_samp. With pad_lost it keeps
+		its full length instead, with the lost samples NaN, so it stays aligned
+		in time. Either way last_take_stats['gaps'] lists the (start, stop)
+		record indices that are missing.
+
+		Cancelling the returned future (or a timeout) stops the record and sets
+		last_take_stats['cancelled']; the samples not taken count as a gap.
+
+		:param stages: Streaming stages to run on the record as it comes in.
+		:param keep_raw: Keep the whole record; otherwise the samples are only
+			read into a FIFO-sized buffer for the stages and None is returned.
+		:param pad_lost: Return a (2,acq_n_samp) record with NaN for the gaps.
+		:return: A (2,n) array of the samples taken, or with pad_lost (2,acq_n_samp).
+		:rtype: ndarray
+		"""
 		
 		#wait at least 2 seconds for the offset to stabilize
 		if (time.time()-self.output_start_time)<2:
-			time.sleep(2+(time.time()-self.output_start_time))
+			time.sleep(2-(time.time()-self.output_start_time))
 		#wait for start time
-		while time.time()<self.start_time:
+		while time.time()<self.start_time and not cancelled():
 			time.sleep(0.001);
-		#begin acquisition
+		#begin acquisition (or, when triggered, arm it; fire_trigger() sets the start time)
 		self.dwf_ai.configure(False, True)
-		self.input_start_time = time.time();
+		if not self.triggered:
+			self.input_start_time = time.time();
+		self.armed.set()
 		if self.verbose: print("   taking analog data")
-		rgdSamples1 = []
-		rgdSamples2 = []
+		n_samp = int(self.acq_n_samp)
+		samples = np.empty((2,n_samp)) if keep_raw else None
+		chunk_buf = None if keep_raw else np.empty((2,self.fifo_samples))
+		stages = [] if stages is None else list(stages)
+		for stage in stages:
+			if hasattr(stage,'reset'):
+				stage.reset()
+			if hasattr(stage,'reserve'):
+				stage.reserve(n_samp)
 		cSamples = 0
 		fLost = False
 		fCorrupted = False
-		while cSamples < self.acq_n_samp:
+		poll_fill = self.poll_fill
+		stats = {'polls':0,'reads':0,'sleep_s':0.0,'samples_lost':0,'samples_corrupted':0,'cancelled':False,
+			'gaps':[],'padded':bool(pad_lost)}
+		polls, reads = self.metrics.counter('polls'), self.metrics.counter('reads')
+		lost, corrupted = self.metrics.counter('samples_lost'), self.metrics.counter('samples_corrupted')
+		read_time = self.metrics.histogram('read_s')
+		stage_time = self.metrics.histogram('stage_s')
+		self.metrics.counter('records').inc()
+		t_cpu = time.thread_time()
+		t_wall = time.perf_counter()
+		while cSamples < n_samp:
+			if cancelled():
+				# stop the record and leave the rest of it empty
+				self.dwf_ai.configure(False, False)
+				if keep_raw:
+					samples[:,cSamples:] = np.nan
+				stats['gaps'].append((cSamples,n_samp))
+				stats['cancelled'] = True
+				break
 			sts = self.dwf_ai.status(True)
+			stats['polls'] += 1
+			polls.inc()
 			if cSamples == 0 and sts in (self.dwf_ai.STATE.CONFIG,
 										 self.dwf_ai.STATE.PREFILL,
 										 self.dwf_ai.STATE.ARMED):
 				# Acquisition not yet started.
+				time.sleep(0.0005)
+				stats['sleep_s'] += 0.0005
 				continue
 
 			cAvailable, cLost, cCorrupted = self.dwf_ai.statusRecord()
+			if cLost > 0:
+				# Keep the record aligned in time; lost samples are left as NaN
+				cLost = min(cLost,n_samp-cSamples)
+				if keep_raw:
+					samples[:,cSamples:cSamples+cLost] = np.nan
+				stats['gaps'].append((cSamples,cSamples+cLost))
+				for stage in stages:
+					stage.process(np.full((2,cLost),np.nan),cSamples)
+				# and poll more often from here on
+				poll_fill = max(poll_fill/2,1.0/64)
 			cSamples += cLost
+			stats['samples_lost'] += cLost
+			stats['samples_corrupted'] += cCorrupted
+			lost.inc(cLost)
+			corrupted.inc(cCorrupted)
 				
 			if cLost > 0:
 				fLost = True
 			if cCorrupted > 0:
 				fCorrupted = True
 			if cAvailable == 0:
+				wait = self._poll_wait(n_samp-cSamples,poll_fill)
+				time.sleep(wait)
+				stats['sleep_s'] += wait
 				continue
-			if cSamples + cAvailable > self.acq_n_samp:
-				cAvailable = self.acq_n_samp - cSamples
+			if cSamples >= n_samp:
+				break
+			if cSamples + cAvailable > n_samp:
+				cAvailable = n_samp - cSamples
 			
-			# get samples
-			rgdSamples1.extend(self.dwf_ai.statusData(0, cAvailable))
-			rgdSamples2.extend(self.dwf_ai.statusData(1, cAvailable))
+			# get samples, straight into the record (or the chunk buffer)
+			if keep_raw:
+				chunk = samples[:,cSamples:cSamples+cAvailable]
+			else:
+				if cAvailable > chunk_buf.shape[1]:
+					chunk_buf = np.empty((2,cAvailable))
+				chunk = chunk_buf[:,:cAvailable]
+			t_read = time.perf_counter()
+			_status_data_into(self.lib,self.dwf_ai,0,chunk[0])
+			_status_data_into(self.lib,self.dwf_ai,1,chunk[1])
+			read_time.record(time.perf_counter()-t_read)
+			if stages:
+				t_stage = time.perf_counter()
+				for stage in stages:
+					stage.process(chunk,cSamples)
+				stage_time.record(time.perf_counter()-t_stage)
 			cSamples += cAvailable
+			stats['reads'] += 1
+			reads.inc()
+			if cSamples < n_samp:
+				wait = self._poll_wait(n_samp-cSamples,poll_fill)
+				time.sleep(wait)
+				stats['sleep_s'] += wait
 
+		stats['cpu_s'] = time.thread_time()-t_cpu
+		stats['wall_s'] = time.perf_counter()-t_wall
+		stats['cpu_fraction'] = stats['cpu_s']/max(stats['wall_s'],1e-9)
+		if keep_raw and stats['gaps'] and not pad_lost:
+			# Leave the gaps out, as the record always used to
+			keep = np.ones(n_samp,dtype=bool)
+			for start, stop in stats['gaps']:
+				keep[start:stop] = False
+			samples = samples[:,keep]
+		self.last_take_stats = stats
 		if self.verbose: print("Recording finished")
 		if fLost:
 			print("Samples were lost! Reduce frequency")
-		if cCorrupted:
+		if fCorrupted:
 			print("Samples could be corrupted! Reduce frequency")
 
 		#with open("record.csv", "w") as f:
 		#	for v in rgdSamples:
 		#		f.write("%s\n" % v)
-		if self.verbose: 
-			plt.plot(rgdSamples1)
-			plt.plot(rgdSamples2)
+		if self.verbose and not plt is None and keep_raw:
+			plt.plot(samples[0])
+			plt.plot(samples[1])
 			plt.show()
-		return np.stack([np.array(rgdSamples1),np.array(rgdSamples2)])
+		return samples
+
+	async def take_data_async(self,timeout=None,**take_args):
+		"""
+		take_data for asyncio code: await it (e.g. in asyncio.gather) instead
+		of polling the future. Cancelling the task stops the record; with a
+		timeout (seconds) it is stopped after that long and TimeoutError is
+		raised.
+		"""
+		return await wait_async(self.take_data(**take_args),timeout)
 
-class Analog_Discovery_Sweep:
+class Analog_Discovery_Sweep(Analog_Discovery):
 	def __init__(self,verbose=False,acq_samp_Hz=10e3,acq_n_samp=10000,
-	waveform=1,out_freq=50,out_amp=1.0,acq_range=15.0,mod_freq=0.05):
-		self.verbose = verbose;
-		if self.verbose: print("DWF Version: " + dwf.FDwfGetVersion())
-		#open device
-		if self.verbose: print("Opening device")
-		self.start_time = 0;
-		self.input_start_time = None;
-		self.dwf_ao = dwf.DwfAnalogOut()
-		self.output_setup(waveform=waveform,out_freq=out_freq,out_amp=out_amp,mod_freq=mod_freq)
-		self.dwf_ai = dwf.DwfAnalogIn(self.dwf_ao)
-		self.input_setup(acq_samp_Hz=acq_samp_Hz,acq_n_samp=acq_n_samp,acq_range=acq_range)
-		
-	def output_off(self):
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.CARRIER, False)
-		self.dwf_ao.configure(0, False)
-		return 
+	waveform=1,out_freq=50,out_amp=1.0,acq_range=15.0,mod_freq=0.05,backend=None):
+		self.mod_freq = mod_freq;
+		Analog_Discovery.__init__(self,verbose=verbose,acq_samp_Hz=acq_samp_Hz,acq_n_samp=acq_n_samp,
+			waveform=waveform,out_freq=out_freq,out_amp=out_amp,acq_range=acq_range,backend=backend)
 
-	
-	def output_setup(self,waveform=None,out_freq=None,out_amp=None,mod_freq=None):
+	def output_setup(self,waveform=None,out_freq=None,out_amp=None,mod_freq=None,restart=False):
 		"""
 		If something isn't called, it's left at a default value. 
 		Waveform options are:
@@ -169,6 +527,8 @@ class Analog_Discovery_Sweep:
 			NOISE: 6
 			CUSTOM: 30
 			PLAY: 31
+		As for Analog_Discovery.output_setup, only changed parameters are sent,
+		so stepping mod_freq through a sweep updates the running output.
 		"""
 		if self.verbose: print("Setting up the output...")
 		if not waveform is None: self.waveform = waveform;
@@ -176,101 +536,12 @@ class Analog_Discovery_Sweep:
 		if not out_amp is None: self.out_amp = out_amp;
 		if not mod_freq is None: self.mod_freq = mod_freq;
 		
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.CARRIER, True)
-		self.dwf_ao.nodeFrequencySet(0, self.dwf_ao.NODE.CARRIER, self.out_freq)
-		self.dwf_ao.nodeAmplitudeSet(0, self.dwf_ao.NODE.CARRIER, self.out_amp)
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.CARRIER, True)
-		self.dwf_ao.nodeFunctionSet(0, self.dwf_ao.NODE.CARRIER, self.waveform)
-		self.dwf_ao.nodeFrequencySet(0, self.dwf_ao.NODE.CARRIER, self.out_freq)
-		self.dwf_ao.nodeAmplitudeSet(0, self.dwf_ao.NODE.CARRIER, self.out_amp)
-		self.dwf_ao.nodeOffsetSet(0, self.dwf_ao.NODE.CARRIER, 0)
-
-		self.dwf_ao.nodeEnableSet(0, self.dwf_ao.NODE.AM, True)
-		self.dwf_ao.nodeFunctionSet(0, self.dwf_ao.NODE.AM, 4)
-		self.dwf_ao.nodeFrequencySet(0, self.dwf_ao.NODE.AM, mod_freq)
-		self.dwf_ao.nodeAmplitudeSet(0, self.dwf_ao.NODE.AM, 100)
-		self.dwf_ao.nodeOffsetSet(0, self.dwf_ao.NODE.AM, 0)
-		self.dwf_ao.configure(0, True)
-
-
-
-
-		self.output_start_time = time.time();
+		changed = self._node_set(0, self.dwf_ao.NODE.CARRIER, enable=True, function=self.waveform,
+			frequency=self.out_freq, amplitude=self.out_amp, offset=0)
+		changed |= self._node_set(0, self.dwf_ao.NODE.AM, enable=True, function=4,
+			frequency=self.mod_freq, amplitude=100, offset=0)
+		self._output_apply(0, changed, restart)
 		return 
-		
-	def input_setup(self,acq_samp_Hz=None,acq_n_samp=None,acq_range=None):
-		#set up acquisition
-		if self.verbose: print("Setting up the input...")
-		if not acq_samp_Hz is None: self.acq_samp_Hz = acq_samp_Hz;
-		if not acq_n_samp is None: self.acq_n_samp = acq_n_samp;
-		if not acq_range is None: self.acq_range = acq_range;
-		
-		self.dwf_ai.channelEnableSet(0, True)
-		self.dwf_ai.channelRangeSet(0, self.acq_range)
-		self.dwf_ai.channelEnableSet(1, True)
-		self.dwf_ai.channelRangeSet(1, self.acq_range)
-		self.dwf_ai.acquisitionModeSet(self.dwf_ai.ACQMODE.RECORD)
-		self.dwf_ai.frequencySet(self.acq_samp_Hz)
-		self.dwf_ai.recordLengthSet(self.acq_n_samp / self.acq_samp_Hz)
-		return
-	
-	@threaded
-	def take_data(self):
-		
-		#wait at least 2 seconds for the offset to stabilize
-		if (time.time()-self.output_start_time)<2:
-			time.sleep(2+(time.time()-self.output_start_time))
-		#wait for start time
-		while time.time()<self.start_time:
-			time.sleep(0.001);
-		#begin acquisition
-		self.dwf_ai.configure(False, True)
-		self.input_start_time = time.time();
-		if self.verbose: print("   taking analog data")
-		rgdSamples1 = []
-		rgdSamples2 = []
-		cSamples = 0
-		fLost = False
-		fCorrupted = False
-		while cSamples < self.acq_n_samp:
-			sts = self.dwf_ai.status(True)
-			if cSamples == 0 and sts in (self.dwf_ai.STATE.CONFIG,
-										 self.dwf_ai.STATE.PREFILL,
-										 self.dwf_ai.STATE.ARMED):
-				# Acquisition not yet started.
-				continue
-
-			cAvailable, cLost, cCorrupted = self.dwf_ai.statusRecord()
-			cSamples += cLost
-				
-			if cLost > 0:
-				fLost = True
-			if cCorrupted > 0:
-				fCorrupted = True
-			if cAvailable == 0:
-				continue
-			if cSamples + cAvailable > self.acq_n_samp:
-				cAvailable = self.acq_n_samp - cSamples
-			
-			# get samples
-			rgdSamples1.extend(self.dwf_ai.statusData(0, cAvailable))
-			rgdSamples2.extend(self.dwf_ai.statusData(1, cAvailable))
-			cSamples += cAvailable
-
-		if self.verbose: print("Recording finished")
-		if fLost:
-			print("Samples were lost! Reduce frequency")
-		if cCorrupted:
-			print("Samples could be corrupted! Reduce frequency")
-
-		#with open("record.csv", "w") as f:
-		#	for v in rgdSamples:
-		#		f.write("%s\n" % v)
-		if self.verbose: 
-			plt.plot(rgdSamples1)
-			plt.plot(rgdSamples2)
-			plt.show()
-		return np.stack([np.array(rgdSamples1),np.array(rgdSamples2)])
 
 if __name__ == "__main__":
     ad = Analog_Discovery(verbose=False);
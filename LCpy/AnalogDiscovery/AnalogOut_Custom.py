@@ -18,9 +18,9 @@ hdwf = c_int()
 rgdSamples = (c_double*cSamples)()
 channel = c_int(0)
 
-# samples between -1 and +1
-for i in range(0,len(rgdSamples)):
-    rgdSamples[i] = np.sin(1.0*i/1000);
+# samples between -1 and +1, written straight into the ctypes buffer
+# (Analog_Discovery.upload_waveform does all of this for a numpy array)
+np.ctypeslib.as_array(rgdSamples)[:] = np.sin(np.arange(cSamples)/1000.0)
 
 #print(DWF version)
 version = create_string_buffer(16)
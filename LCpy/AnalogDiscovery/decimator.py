@@ -0,0 +1,89 @@
+"""
+Streaming anti-alias decimation of Analog Discovery records.
+
+Sampling fast keeps the inputs from aliasing, but if only a slow envelope is
+analysed the full-rate record is mostly wasted. A decimator stage low-pass
+filters each chunk take_data reads with an FIR filter and keeps every q-th
+output. Only the kept outputs are computed (each one a dot product of the
+filter with the window of samples ending at it, the polyphase form of
+filter-then-downsample), and the last numtaps-1 samples of every chunk are
+carried over into the next, so the result is exactly
+
+	scipy.signal.lfilter(h,1,x)[:,::q]
+
+of the whole record, however it was split into chunks.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin
+
+class decimator:
+	def __init__(self,q,h=None,numtaps=None,channels=(0,1),capacity=1024):
+		"""
+		:param q: Decimation factor; every q-th filtered sample is kept.
+		:param h: FIR filter taps. Defaults to firwin(numtaps,0.8/q), which
+			passes up to 80% of the new Nyquist frequency.
+		:param numtaps: Length of the default filter (default 20*q+1).
+		:param channels: Which rows of each chunk to decimate.
+		:param capacity: Output samples to allocate room for up front; grows as needed.
+		"""
+		self.q = int(q);
+		if self.q < 1:
+			raise ValueError('q must be at least 1')
+		if h is None:
+			h = firwin(20*self.q+1 if numtaps is None else int(numtaps),0.8/self.q) if self.q > 1 else np.ones(1)
+		self.h = np.asarray(h,dtype=np.float64)
+		self._h_rev = self.h[::-1].copy()
+		self.channels = list(channels);
+		self._out = np.zeros((len(self.channels),int(capacity)))
+		self.reset()
+
+	def reset(self):
+		"""
+		Starts a new record, with the filter state zeroed as lfilter's is.
+		"""
+		self.n = 0; #outputs so far
+		self._pos = 0; #samples seen so far
+		self._history = np.zeros((len(self.channels),len(self.h)-1))
+
+	def reserve(self,n_samples):
+		"""
+		Makes room for the output of a record of n_samples.
+		"""
+		n = -(-n_samples//self.q)
+		if n > self._out.shape[1]:
+			out = np.zeros((len(self.channels),n))
+			out[:,:self.n] = self._out[:,:self.n]
+			self._out = out
+
+	def process(self,chunk,start):
+		"""
+		Filters and decimates the next chunk of the record (in order, without gaps).
+		"""
+		x = chunk[self.channels]
+		n = x.shape[1]
+		if n == 0:
+			return
+		buf = np.concatenate((self._history,x),axis=1)
+		# Kept outputs are at record indices 0, q, 2q, ...; the first in this
+		# chunk is at offset `first` into it, which is window `first` of buf
+		first = -self._pos % self.q
+		windows = sliding_window_view(buf,len(self.h),axis=1)[:,first::self.q]
+		k = windows.shape[1]
+		if self.n+k > self._out.shape[1]:
+			self.reserve(2*(self.n+k)*self.q)
+		self._out[:,self.n:self.n+k] = windows @ self._h_rev
+		self.n += k
+		self._pos += n
+		self._history = buf[:,buf.shape[1]-(len(self.h)-1):].copy()
+
+	def result(self,fs=None):
+		"""
+		:param fs: Sample rate of the record, to give the output times in seconds.
+		:return: data, the (n_channels,n_outputs) decimated record, and t, the
+			record index (or, given fs, time from the start) of each output.
+		:rtype: dict
+		"""
+		t = np.arange(self.n)*self.q
+		return {'data':self._out[:,:self.n],'t':t if fs is None else t/fs}
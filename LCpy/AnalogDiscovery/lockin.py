@@ -0,0 +1,116 @@
+"""
+Streaming digital lock-in for the Analog Discovery inputs.
+
+take_data hands every chunk of samples it reads to its stages as soon as the
+chunk comes in. A lockin stage mixes the chunk with a reference at the
+demodulation frequency (carried over from chunk to chunk as a running phase,
+so the reference is continuous over the whole record) and integrates the
+products over blocks of fs/output_rate samples, emitting one in-phase and
+quadrature value per channel per block. With keep_raw=False in take_data only
+these are kept: a 300 s collect at 10 kHz becomes a few thousand numbers per
+channel instead of millions of samples.
+
+Integrate-and-dump is a boxcar filter, so the 2f mixing product cancels
+exactly when a block holds a whole number of reference cycles (e.g. 50 Hz at
+10 kHz and 10 outputs/s: 5 cycles per block). Amplitude modulation slower than
+output_rate/2 (the mod_freq envelope) comes through in the amplitude.
+
+Samples lost from the FIFO arrive as NaN and are left out of their block's
+average; coverage records the fraction of each block that was real data.
+"""
+
+import numpy as np
+
+class lockin:
+	def __init__(self,freq,fs,output_rate=10.0,channels=(0,1),capacity=1024):
+		"""
+		:param freq: Demodulation frequency (Hz), e.g. the output's out_freq
+			(or twice it, for the second harmonic).
+		:param fs: Sample rate of the record (Hz).
+		:param output_rate: Lock-in outputs per second; each is the average
+			over round(fs/output_rate) samples.
+		:param channels: Which rows of each chunk to demodulate.
+		:param capacity: Outputs to allocate room for up front; grows as needed.
+		"""
+		self.freq = float(freq);
+		self.fs = float(fs);
+		self.channels = list(channels);
+		self.block = max(1,int(round(self.fs/output_rate)));
+		self.output_rate = self.fs/self.block;
+		self._z = np.zeros((len(self.channels),int(capacity)),dtype=np.complex128)
+		self._coverage = np.zeros((len(self.channels),int(capacity)))
+		self.reset()
+
+	def reset(self):
+		"""
+		Starts a new record: the reference phase is zero at its first sample.
+		"""
+		self.n = 0; #outputs so far
+		self._phase = 0.0; #reference phase (cycles) at the next sample
+		self._filled = 0; #samples in the block being integrated
+		self._acc_z = np.zeros(len(self.channels),dtype=np.complex128)
+		self._acc_n = np.zeros(len(self.channels))
+
+	def reserve(self,n_samples):
+		"""
+		Makes room for the outputs of a record of n_samples.
+		"""
+		n = n_samples//self.block+1
+		if n > self._z.shape[1]:
+			z = np.zeros((len(self.channels),n),dtype=np.complex128)
+			z[:,:self.n] = self._z[:,:self.n]
+			coverage = np.zeros((len(self.channels),n))
+			coverage[:,:self.n] = self._coverage[:,:self.n]
+			self._z, self._coverage = z, coverage
+
+	def process(self,chunk,start):
+		"""
+		Demodulates the next chunk of the record.
+
+		:param chunk: (n_channels,n) array of samples; lost samples are NaN.
+		:param start: Index of the chunk's first sample in the record (unused;
+			chunks must arrive in order and without gaps).
+		"""
+		x = chunk[self.channels]
+		n = x.shape[1]
+		if n == 0:
+			return
+		ref = np.exp(-2j*np.pi*(self._phase+(self.freq/self.fs)*np.arange(n)))
+		self._phase = (self._phase+self.freq*n/self.fs) % 1.0
+		valid = ~np.isnan(x)
+		mixed = np.where(valid,x,0.0)*ref
+		# Cut the chunk where blocks end; the first piece finishes the block
+		# already under way
+		cuts = np.arange(self.block-self._filled,n,self.block)
+		idx = np.concatenate(([0],cuts))
+		sums = np.add.reduceat(mixed,idx,axis=1)
+		counts = np.add.reduceat(valid,idx,axis=1,dtype=np.float64)
+		sums[:,0] += self._acc_z
+		counts[:,0] += self._acc_n
+		self._filled = (self._filled+n) % self.block
+		done = len(cuts)+(self._filled == 0)
+		if done:
+			if self.n+done > self._z.shape[1]:
+				self.reserve(2*(self.n+done)*self.block)
+			with np.errstate(invalid='ignore',divide='ignore'):
+				self._z[:,self.n:self.n+done] = 2*sums[:,:done]/counts[:,:done]
+			self._coverage[:,self.n:self.n+done] = counts[:,:done]/self.block
+			self.n += done
+		if self._filled:
+			self._acc_z, self._acc_n = sums[:,-1], counts[:,-1]
+		else:
+			self._acc_z, self._acc_n = np.zeros_like(self._acc_z), np.zeros_like(self._acc_n)
+
+	def result(self):
+		"""
+		The lock-in outputs so far, one column per block (a partial last block
+		is left out). I + iQ is the complex amplitude A*exp(i*phase) of the
+		component A*cos(2*pi*freq*t + phase), with t from the first sample.
+
+		:return: t (block centres, s from the start of the record), and I, Q,
+			amplitude, phase (rad) and coverage, each (n_channels,n_outputs).
+		:rtype: dict
+		"""
+		z = self._z[:,:self.n]
+		return {'t':(np.arange(self.n)+0.5)*self.block/self.fs,'I':z.real,'Q':z.imag,
+			'amplitude':np.abs(z),'phase':np.angle(z),'coverage':self._coverage[:,:self.n]}
@@ -0,0 +1,239 @@
+"""
+Streaming playback of long waveforms on the Analog Discovery output.
+
+The built-in functions and a custom buffer (upload_waveform) only go as far as
+the device's memory. With the PLAY function (31) the output instead streams
+samples through its play buffer: it is primed with the first buffer's worth
+before the output starts, and topped up with FDwfAnalogOutNodePlayData as it
+drains. output_player does the topping up on a thread of its own, so the
+Analog Discovery can record (take_data) at the same time.
+
+The source is double-buffered on the host as well: a second thread cuts it into
+chunks, scaled to the device's [-1, 1] range, and keeps the next ones ready
+while the current one is written, so a generator that takes a while to produce
+each chunk (e.g. gen_band_limited_batch) doesn't starve the device. Samples the
+device had to play before they arrived are reported by it as lost; every poll
+that reports some counts as an underrun.
+"""
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+from LCpy.ez_thread import threaded, cancelled
+from LCpy.AnalogDiscovery.AD_2 import _node_data_set, _node_play_data
+
+FUNC_PLAY = 31
+
+class _chunks:
+	def __init__(self,source,scale,chunk_samples,limit=None,depth=2):
+		"""
+		Cuts source (an array, or an iterable of arrays) into float64 chunks of
+		at most chunk_samples divided by scale, on a thread of its own, keeping
+		up to depth of them ready. Samples beyond [-1, 1] are clipped and counted.
+		"""
+		self.source = source;
+		self.scale = float(scale);
+		self.chunk_samples = int(chunk_samples);
+		self.limit = limit;
+		self.clipped = 0;
+		self.done = False;
+		self._queue = queue.Queue(maxsize=depth)
+		self._stop = threading.Event()
+		self._cur = np.zeros(0)
+		self._pos = 0;
+		self._thread = threading.Thread(target=self._fill,name='play-source',daemon=True)
+		self._thread.start()
+
+	def _pieces(self):
+		if isinstance(self.source,np.ndarray):
+			source = [self.source]
+		else:
+			source = self.source
+		n = 0
+		for piece in source:
+			piece = np.asarray(piece,dtype=np.float64).ravel()
+			for i in range(0,len(piece),self.chunk_samples):
+				part = piece[i:i+self.chunk_samples]
+				if not self.limit is None:
+					part = part[:self.limit-n]
+				if len(part):
+					yield part
+				n += len(part)
+				if not self.limit is None and n >= self.limit:
+					return
+
+	def _put(self,item):
+		while not self._stop.is_set():
+			try:
+				self._queue.put(item,timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _fill(self):
+		try:
+			for part in self._pieces():
+				data = part/self.scale
+				over = np.abs(data) > 1
+				if over.any():
+					self.clipped += int(over.sum())
+					np.clip(data,-1,1,out=data)
+				if not self._put(data):
+					return
+			self._put(None)
+		except Exception as ex:
+			self._put(ex)
+
+	def take(self,n,block=False):
+		"""
+		Up to n samples of the current chunk: an empty array if the next chunk
+		isn't ready yet (and block is False), or None once the source is used up.
+		"""
+		if self._pos >= len(self._cur):
+			if self.done:
+				return None
+			try:
+				item = self._queue.get(block)
+			except queue.Empty:
+				return np.zeros(0)
+			if item is None:
+				self.done = True;
+				return None
+			if isinstance(item,Exception):
+				raise item
+			self._cur, self._pos = item, 0
+		piece = self._cur[self._pos:self._pos+n]
+		self._pos += len(piece)
+		return piece
+
+	def close(self):
+		self._stop.set()
+
+class output_player:
+	def __init__(self,ad):
+		"""
+		Streams waveforms to an Analog_Discovery's output; see Analog_Discovery.play.
+		"""
+		self.ad = ad;
+		self.last_play_stats = {};
+
+	@threaded
+	def play(self,source,sample_rate,amplitude=None,offset=0.0,n_samples=None,channel=0,chunk_samples=4096):
+		"""
+		Plays source on an output channel at sample_rate, streaming it through
+		the device's play buffer. Returns once it has all been played (or the
+		output stopped); cancelling the returned future stops the output.
+
+		:param source: A 1-D array, or an iterable (e.g. a generator) of 1-D arrays
+			that are played back to back.
+		:param sample_rate: Samples per second.
+		:param amplitude: Output amplitude (V) of a full-scale (+/-1) sample.
+			For an array it defaults to the array's peak, so the output is the
+			array in volts; an iterable's samples are divided by it (default 1)
+			and clipped to [-1, 1].
+		:param offset: Output offset (V).
+		:param n_samples: Samples to play; defaults to the length of an array,
+			or, for an iterable, until it runs out.
+		:param chunk_samples: Size of the host-side chunks.
+		:return: Statistics: samples_played, samples_lost, underruns (polls
+			that reported lost samples), host_waits (polls where the next chunk
+			wasn't ready), samples_clipped and cancelled.
+		:rtype: dict
+		"""
+		ad = self.ad
+		ao = ad.dwf_ao
+		node = ao.NODE.CARRIER
+		if isinstance(source,np.ndarray):
+			source = np.ascontiguousarray(source,dtype=np.float64).ravel()
+			n_samples = len(source) if n_samples is None else min(int(n_samples),len(source))
+			if amplitude is None:
+				peak = float(np.max(np.abs(source[:n_samples]))) if n_samples else 0.0
+				amplitude = peak if peak > 0 else 1.0
+		elif amplitude is None:
+			amplitude = 1.0
+		chunks = _chunks(source,amplitude,chunk_samples,limit=n_samples)
+		stats = {'samples_played':0,'samples_lost':0,'samples_corrupted':0,'underruns':0,
+			'host_waits':0,'samples_clipped':0,'cancelled':False}
+		m = ad.metrics
+		played, lost_count, underruns = m.counter('play_samples'), m.counter('play_samples_lost'), m.counter('play_underruns')
+		write_time = m.histogram('play_write_s')
+		t_wall = time.perf_counter()
+		try:
+			ao.nodeEnableSet(channel, node, True)
+			ao.nodeFunctionSet(channel, node, FUNC_PLAY)
+			ao.nodeFrequencySet(channel, node, sample_rate)
+			ao.nodeAmplitudeSet(channel, node, amplitude)
+			ao.nodeOffsetSet(channel, node, offset)
+			ao.repeatSet(channel, 1)
+			ao.runSet(channel, 0.0 if n_samples is None else n_samples/sample_rate)
+			buffer = int(ao.nodeDataInfo(channel, node)[1])
+			# Prime the play buffer before starting
+			prime = []
+			n_prime = 0
+			while n_prime < buffer:
+				piece = chunks.take(buffer-n_prime,block=True)
+				if piece is None:
+					break
+				prime.append(piece)
+				n_prime += len(piece)
+			prime = np.concatenate(prime) if prime else np.zeros(1)
+			_node_data_set(ad.lib,ao,channel,node,prime)
+			ad.uploaded.pop((channel,int(node)),None) #the custom buffer is gone
+			ad._forget_output(channel)
+			ao.configure(channel, True)
+			ad.output_start_time = time.time();
+			if channel == 0:
+				ad.waveform = FUNC_PLAY;
+				ad.out_amp = amplitude;
+			stats['samples_played'] += n_prime
+			played.inc(n_prime)
+			poll = min(max(buffer/4/sample_rate,0.0005),ad.max_poll_wait)
+			while True:
+				if cancelled():
+					stats['cancelled'] = True
+					break
+				free, lost, corrupted = ao.nodePlayStatus(channel, node)
+				if chunks.done and n_samples is None and free >= buffer:
+					break #played out; an open-ended output only loses samples past the end now
+				# Counted until the device has finished, so a starved drain still shows
+				if lost:
+					stats['samples_lost'] += lost
+					stats['underruns'] += 1
+					lost_count.inc(lost)
+					underruns.inc()
+				stats['samples_corrupted'] += corrupted
+				if not n_samples is None and ao.status(channel) != ao.STATE.RUNNING:
+					break #its run time is up (before all the data went, if some was lost)
+				if chunks.done:
+					# Nothing left to send; wait for the device to play it out
+					time.sleep(poll)
+					continue
+				t_write = time.perf_counter()
+				while free > 0:
+					piece = chunks.take(free)
+					if piece is None:
+						break
+					if len(piece) == 0:
+						stats['host_waits'] += 1
+						break
+					_node_play_data(ad.lib,ao,channel,node,piece)
+					free -= len(piece)
+					stats['samples_played'] += len(piece)
+					played.inc(len(piece))
+				write_time.record(time.perf_counter()-t_write)
+				if not chunks.done:
+					time.sleep(poll)
+		finally:
+			chunks.close()
+			if stats['cancelled'] or n_samples is None:
+				ao.configure(channel, False)
+		stats['samples_clipped'] = chunks.clipped
+		stats['wall_s'] = time.perf_counter()-t_wall
+		self.last_play_stats = stats
+		if stats['underruns']:
+			print("Output underran %d times (%d samples)! Lower the sample rate" % (stats['underruns'],stats['samples_lost']))
+		return stats
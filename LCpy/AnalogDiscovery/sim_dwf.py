@@ -0,0 +1,426 @@
+"""
+A simulated dwf, for running Analog_Discovery without an Analog Discovery.
+
+sim_dwf stands in for the dwf package (and, through its lib attribute, for
+the ctypes dwf library AD_2 calls directly): pass one as the backend of an
+Analog_Discovery and take_data runs unchanged against a simulated device,
+
+	ad = Analog_Discovery(backend=sim_dwf())
+
+The analog input behaves like the real one in record mode: samples come in at
+the configured rate into a FIFO of fifo_samples, status() takes a snapshot,
+statusRecord() reports what is available, and samples that overflowed the
+FIFO before they were read are reported as lost (and the ones read alongside
+them as possibly corrupted). Channel 1 sees the analog output directly and
+channel 2 a delayed, scaled copy of it, both with a little noise. With
+speed=None the FIFO is always full and never overflows, for measuring the
+throughput of the acquisition code itself.
+
+The analog output plays the standard functions, custom data (function 30)
+and PLAY (function 31), which consumes its play_buffer at the node frequency
+and reports the samples it needed before they were written as lost.
+"""
+
+import time
+
+import numpy as np
+
+class sim_namespace:
+	def __init__(self,**values):
+		self.__dict__.update(values)
+
+def _v(x):
+	# ctypes arguments arrive wrapped
+	return getattr(x,'value',x)
+
+STATE = sim_namespace(READY=0,ARMED=1,DONE=2,TRIGGERED=3,RUNNING=3,CONFIG=4,PREFILL=5,WAIT=7)
+ACQMODE = sim_namespace(SINGLE=0,SCAN_SHIFT=1,SCAN_SCREEN=2,RECORD=3)
+NODE = sim_namespace(CARRIER=0,FM=1,AM=2)
+TRIGSRC_NONE, TRIGSRC_PC = 0, 1
+
+def _wave(function,phase,data=None):
+	"""
+	One of the standard dwf waveforms (or the custom one, from data) at the
+	given phase (in cycles).
+	"""
+	frac = np.mod(phase,1.0)
+	if function == 30 and not data is None: #custom
+		return data[np.minimum((frac*len(data)).astype(np.int64),len(data)-1)]
+	if function == 0: #DC
+		return np.ones_like(frac)
+	if function == 2: #square
+		return np.where(frac < 0.5,1.0,-1.0)
+	if function == 3: #triangle
+		return 1.0-4.0*np.abs(frac-0.5)
+	if function == 4: #ramp up
+		return 2.0*frac-1.0
+	if function == 5: #ramp down
+		return 1.0-2.0*frac
+	return np.sin(2*np.pi*frac)
+
+class sim_play:
+	# The device's play buffer for one channel: written samples go into a ring
+	# and are consumed at the node's frequency from configure() on. Asking for
+	# a sample that hasn't been written yet is an underrun; the device outputs
+	# nothing for it and counts it as lost.
+	def __init__(self,data,rate,t0,run_s,ring=1<<20):
+		self.rate = rate;
+		self.t0 = t0;
+		self.end = t0+run_s if run_s > 0 else float('inf');
+		self.ring = np.zeros(ring)
+		self.written = 0;
+		self.consumed = 0.0;
+		self.lost = 0.0;
+		self.lost_reported = 0;
+		self._last = t0;
+		self.write(data)
+
+	def advance(self,now,speed):
+		now = min(now,self.end)
+		if now <= self._last:
+			return
+		self.consumed += (now-self._last)*self.rate*speed
+		self._last = now
+		if self.consumed > self.written:
+			self.lost += self.consumed-self.written
+			self.consumed = float(self.written)
+
+	def write(self,data):
+		n = len(data)
+		self.ring[(self.written+np.arange(n)) % len(self.ring)] = data
+		self.written += n
+
+	def samples(self,t,speed):
+		idx = np.floor((t-self.t0)*self.rate*speed-self.lost).astype(np.int64)
+		ok = (idx >= 0) & (idx < self.written) & (idx >= self.written-len(self.ring))
+		out = np.zeros(len(idx))
+		out[ok] = self.ring[idx[ok] % len(self.ring)]
+		return out
+
+class sim_analog_out:
+	def __init__(self,device):
+		self.device = device;
+		self.hdwf = device;
+		self.NODE = NODE
+		self.STATE = STATE
+		self.nodes = {}
+		self.running = {}
+		self.run_s = {}
+		self.play = {}
+		self.n_calls = 0;
+
+	def _node(self,channel,node):
+		key = (_v(channel),_v(node))
+		if not key in self.nodes:
+			self.nodes[key] = {'enable':False,'function':1,'frequency':1e3,'amplitude':1.0,'offset':0.0,'symmetry':50.0,'phase':0.0}
+		return self.nodes[key]
+
+	def _set(self,channel,node,field,value):
+		self.n_calls += 1
+		self._node(channel,node)[field] = _v(value)
+
+	def nodeEnableSet(self,channel,node,enable):
+		self._set(channel,node,'enable',bool(_v(enable)))
+
+	def nodeFunctionSet(self,channel,node,function):
+		self._set(channel,node,'function',int(_v(function)))
+
+	def nodeFrequencySet(self,channel,node,frequency):
+		self._set(channel,node,'frequency',float(_v(frequency)))
+
+	def nodeAmplitudeSet(self,channel,node,amplitude):
+		self._set(channel,node,'amplitude',float(_v(amplitude)))
+
+	def nodeOffsetSet(self,channel,node,offset):
+		self._set(channel,node,'offset',float(_v(offset)))
+
+	def nodeSymmetrySet(self,channel,node,symmetry):
+		self._set(channel,node,'symmetry',float(_v(symmetry)))
+
+	def nodePhaseSet(self,channel,node,phase):
+		self._set(channel,node,'phase',float(_v(phase)))
+
+	def nodeDataSet(self,channel,node,data):
+		self._set(channel,node,'data',np.array(data,dtype=np.float64))
+
+	def nodeDataInfo(self,channel,node):
+		return (1,self.device.sim.play_buffer)
+
+	def runSet(self,channel,seconds):
+		self.n_calls += 1
+		self.run_s[_v(channel)] = float(_v(seconds))
+
+	def repeatSet(self,channel,repeat):
+		self.n_calls += 1
+
+	def status(self,channel):
+		channel = _v(channel)
+		if not channel in self.running:
+			return STATE.READY
+		run_s = self.run_s.get(channel,0.0)
+		if run_s > 0 and time.time()-self.running[channel] > run_s:
+			return STATE.DONE
+		return STATE.RUNNING
+
+	def _speed(self):
+		return self.device.sim.speed or 1.0
+
+	def nodePlayStatus(self,channel,node):
+		play = self.play.get(_v(channel))
+		if play is None:
+			return (0,0,0)
+		play.advance(time.time(),self._speed())
+		free = self.device.sim.play_buffer-(play.written-int(play.consumed))
+		lost = int(play.lost)-play.lost_reported
+		play.lost_reported += lost
+		return (free,lost,0)
+
+	def nodePlayData(self,channel,node,data):
+		play = self.play[_v(channel)]
+		play.advance(time.time(),self._speed())
+		play.write(np.asarray(data,dtype=np.float64))
+
+	def configure(self,channel,start):
+		self.n_calls += 1
+		start = _v(start)
+		channel = _v(channel)
+		if start == 3 and channel in self.running:
+			return #apply: the running output picks up the new node parameters
+		if start:
+			self.running[channel] = time.time()
+			carrier = self._node(channel,NODE.CARRIER)
+			if carrier['function'] == 31:
+				self.play[channel] = sim_play(carrier.get('data',np.zeros(0)),carrier['frequency'],
+					self.running[channel],self.run_s.get(channel,0.0))
+		else:
+			self.running.pop(channel,None)
+			self.play.pop(channel,None)
+
+	def reset(self,channel=-1):
+		self.n_calls += 1
+		self.nodes = {}
+		self.running = {}
+		self.run_s = {}
+		self.play = {}
+
+	def output(self,channel,t):
+		"""
+		What channel is putting out at host times t.
+		"""
+		t = np.asarray(t,dtype=float)
+		if not _v(channel) in self.running:
+			return np.zeros_like(t)
+		carrier = self._node(channel,NODE.CARRIER)
+		if not carrier['enable']:
+			return np.zeros_like(t)
+		if carrier['function'] == 31:
+			return carrier['amplitude']*self.play[_v(channel)].samples(t,self._speed())+carrier['offset']
+		t_rel = t-self.running[_v(channel)]
+		out = carrier['amplitude']*_wave(carrier['function'],carrier['frequency']*t_rel+carrier['phase']/360.0,carrier.get('data'))
+		am = self.nodes.get((_v(channel),NODE.AM))
+		if am and am['enable']:
+			out = out*(1.0+am['amplitude']/100.0*_wave(am['function'],am['frequency']*t_rel+am['phase']/360.0,am.get('data')))
+		return out+carrier['offset']
+
+class sim_analog_in:
+	def __init__(self,device):
+		self.device = device;
+		self.hdwf = device;
+		self.STATE = STATE
+		self.ACQMODE = ACQMODE
+		self.channels = {0:{'enable':False,'range':5.0},1:{'enable':False,'range':5.0}}
+		self.mode = ACQMODE.SINGLE;
+		self.fs = 1e4;
+		self.record_s = 0.0;
+		self.trigger_source = TRIGSRC_NONE;
+		self.state = STATE.READY;
+		self.n_calls = 0;
+		self._reset_record()
+
+	def _reset_record(self):
+		self._t0 = None;
+		self._armed_at = None;
+		self._pos = 0; #first sample not yet handed out or lost
+		self._snap = (0,0)
+		self._last = (0,0,0)
+		self.stats = {'samples_lost':0,'samples_corrupted':0,'status_calls':0}
+
+	def channelEnableSet(self,channel,enable):
+		self.channels[_v(channel)]['enable'] = bool(_v(enable))
+
+	def channelRangeSet(self,channel,volts):
+		self.channels[_v(channel)]['range'] = float(_v(volts))
+
+	def acquisitionModeSet(self,mode):
+		self.mode = _v(mode);
+
+	def frequencySet(self,hz):
+		self.fs = float(_v(hz));
+
+	def recordLengthSet(self,seconds):
+		self.record_s = float(_v(seconds));
+
+	def bufferSizeInfo(self):
+		return (16,self.device.sim.fifo_samples)
+
+	@property
+	def n_record(self):
+		return int(round(self.record_s*self.fs))
+
+	def configure(self,reconfigure,start):
+		self.n_calls += 1
+		if not _v(start):
+			self.state = STATE.READY;
+			self._t0 = None;
+			return
+		self._reset_record()
+		self._armed_at = time.time()
+		if self.trigger_source == TRIGSRC_PC:
+			self.state = STATE.ARMED;
+		else:
+			self._t0 = time.time()
+			self.state = STATE.RUNNING;
+
+	def _produced(self,now):
+		speed = self.device.sim.speed
+		if speed is None:
+			return min(self.n_record,self._pos+self.device.sim.fifo_samples)
+		return min(self.n_record,max(int((now-self._t0)*self.fs*speed),0))
+
+	def status(self,read_data):
+		self.n_calls += 1
+		self.stats['status_calls'] += 1
+		now = time.time()
+		if self.state == STATE.ARMED:
+			fired = self.device.pc_fire_time
+			if fired is None or fired < self._armed_at:
+				return self.state
+			self._t0 = fired
+			self.state = STATE.RUNNING;
+		if self.state not in (STATE.RUNNING,STATE.DONE) or not _v(read_data):
+			return self.state
+		pending = self._produced(now)-self._pos
+		lost = max(pending-self.device.sim.fifo_samples,0)
+		available = pending-lost
+		corrupted = available if lost else 0
+		self._pos += lost
+		self._snap = (self._pos,available)
+		self._pos += available
+		self._last = (available,lost,corrupted)
+		self.stats['samples_lost'] += lost
+		self.stats['samples_corrupted'] += corrupted
+		if self._pos >= self.n_record:
+			self.state = STATE.DONE;
+		return self.state
+
+	def statusRecord(self):
+		return self._last
+
+	def _samples(self,channel,n):
+		start, available = self._snap
+		n = min(int(n),available)
+		t = self._t0+(start+np.arange(n))/self.fs/(self.device.sim.speed or 1.0)
+		return self.device.signal(_v(channel),t)
+
+	def statusData(self,channel,n):
+		# The dwf package hands back a list
+		return list(self._samples(channel,n))
+
+	def statusDataInto(self,channel,out):
+		out[:] = self._samples(channel,len(out))
+
+class sim_device:
+	def __init__(self,sim):
+		self.sim = sim;
+		self.ao = sim_analog_out(self)
+		self.ai = sim_analog_in(self)
+		self.pc_fire_time = None;
+		self.trigger_pins = {}
+
+	def signal(self,channel,t):
+		sim = self.sim
+		if channel == 0:
+			x = sim.loop_gain*self.ao.output(0,t)
+		else:
+			x = sim.response_gain*self.ao.output(0,t-sim.response_delay)
+		if sim.noise:
+			x = x + sim.rng.normal(0,sim.noise,len(t))
+		return np.clip(x,-self.ai.channels[channel]['range'],self.ai.channels[channel]['range'])
+
+class sim_dwf_lib:
+	"""
+	The handful of raw library calls AD_2 makes through ctypes. hdwf is the
+	sim_device the dwf objects carry.
+	"""
+	def FDwfGetLastErrorMsg(self,msg):
+		msg.value = b''
+		return 1
+
+	def FDwfAnalogInStatusData(self,hdwf,channel,buffer,n):
+		out = np.ctypeslib.as_array(buffer,shape=(_v(n),))
+		hdwf.ai.statusDataInto(_v(channel),out)
+		return 1
+
+	def FDwfAnalogOutNodeDataSet(self,hdwf,channel,node,buffer,n):
+		hdwf.ao.nodeDataSet(channel,node,np.ctypeslib.as_array(buffer,shape=(_v(n),)))
+		return 1
+
+	def FDwfAnalogOutNodePlayData(self,hdwf,channel,node,buffer,n):
+		hdwf.ao.nodePlayData(channel,node,np.ctypeslib.as_array(buffer,shape=(_v(n),)))
+		return 1
+
+	def FDwfAnalogInTriggerSourceSet(self,hdwf,source):
+		hdwf.ai.trigger_source = _v(source);
+		return 1
+
+	def FDwfDeviceTriggerSet(self,hdwf,pin,source):
+		hdwf.trigger_pins[_v(pin)] = _v(source)
+		return 1
+
+	def FDwfDeviceTriggerPC(self,hdwf):
+		hdwf.pc_fire_time = time.time()
+		for pin, source in hdwf.trigger_pins.items():
+			line = hdwf.sim.trigger_lines.get(pin)
+			if source == TRIGSRC_PC and not line is None:
+				line.fire()
+		return 1
+
+class sim_dwf:
+	def __init__(self,fifo_samples=8192,speed=1.0,loop_gain=1.0,response_gain=0.3,
+	response_delay=0.002,noise=0.01,trigger_lines=None,seed=None,play_buffer=4096):
+		"""
+		:param fifo_samples: Size of the analog-in FIFO (8192 on an Analog Discovery 2).
+		:param play_buffer: Size of the analog-out buffer PLAY streams through.
+		:param speed: Simulated time runs this many times faster than real time,
+			or None for the FIFO to always be full.
+		:param loop_gain: Gain from output 1 to input channel 1.
+		:param response_gain: Gain from output 1 to input channel 2.
+		:param response_delay: Delay (s) from output 1 to input channel 2.
+		:param noise: Standard deviation of the input noise (V).
+		:param trigger_lines: Wires on the trigger pins, {0: sync.sim_trigger_line(), ...}.
+		:param seed: Seed for the noise.
+		"""
+		self.fifo_samples = fifo_samples;
+		self.play_buffer = play_buffer;
+		self.speed = speed;
+		self.loop_gain = loop_gain;
+		self.response_gain = response_gain;
+		self.response_delay = response_delay;
+		self.noise = noise;
+		self.trigger_lines = {} if trigger_lines is None else dict(trigger_lines);
+		self.rng = np.random.default_rng(seed)
+		self.lib = sim_dwf_lib()
+		self.devices = []
+
+	def FDwfGetVersion(self):
+		return 'sim'
+
+	def DwfAnalogOut(self):
+		device = sim_device(self)
+		self.devices.append(device)
+		return device.ao
+
+	def DwfAnalogIn(self,ao=None):
+		if ao is None:
+			return self.DwfAnalogOut().device.ai
+		return ao.device.ai
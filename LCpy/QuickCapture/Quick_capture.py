@@ -31,56 +31,144 @@
 # demonstrate node access and to get started with the API; please see full
 # Spinnaker examples for further or specific knowledge on a topic.
 
-import PySpin
+try:
+	import PySpin
+except ImportError:
+	PySpin = None #only simulated backends (LCpy.QuickCapture.sim_spin) will work
 import numpy as np
+import threading
 import time
 
 NUM_IMAGES = 10  # number of images to grab
 
-from LCpy.ez_thread import threaded
+from LCpy.ez_thread import threaded, cancelled, cancel_event, wait_async
+from LCpy.QuickCapture.frame_pool import frame_pool
+from LCpy.QuickCapture.acquisition_engine import acquisition_engine, memory_stage, SPINNAKER_ERR_TIMEOUT
+from LCpy.QuickCapture.frame_meta import FRAME_META_DTYPE, finish_meta
+from LCpy.QuickCapture.reducers import reductions
+from LCpy.metrics import registry
+
+def pixel_dtype(pixel_format):
+	"""
+	Numpy dtype that holds a frame of the given pixel format without widening
+	it, e.g. 'Mono8' -> uint8, 'Mono12'/'Mono16' -> uint16.
+
+	:param pixel_format: Symbolic name of the pixel format.
+	:type pixel_format: str
+	"""
+	if pixel_format.endswith('8'):
+		return np.dtype(np.uint8)
+	return np.dtype(np.uint16)
+
+# Named regions of interest for use_roi. wh None is the whole (binned) image;
+# offset 'center' centres the ROI.
+ROI_PRESETS = {
+	'full':{'wh':None,'offset':[0,0]},
+	'default':{'wh':[640,480],'offset':[0,0]},
+	'center':{'wh':[640,480],'offset':'center'},
+	'full_bin2':{'wh':None,'offset':[0,0],'binning':2},
+	'center_bin2':{'wh':[320,240],'offset':'center','binning':2},
+}
+
+_systems = {}
+_systems_lock = threading.Lock()
+
+def acquire_system(spin):
+	"""
+	The Spinnaker System for a backend, shared by every camera opened through
+	it. Each call must be matched by a release_system().
+	"""
+	with _systems_lock:
+		entry = _systems.get(id(spin))
+		if entry is None:
+			entry = _systems[id(spin)] = [spin.System.GetInstance(),0]
+		entry[1] += 1
+		return entry[0]
+
+def release_system(spin):
+	"""
+	Drops one reference to the shared System; the last one releases it.
+	"""
+	with _systems_lock:
+		entry = _systems.get(id(spin))
+		if entry is None:
+			return
+		entry[1] -= 1
+		if entry[1] > 0:
+			return
+		del _systems[id(spin)]
+	entry[0].ReleaseInstance()
 
 class blackfly_camera:
-	def __init__(self,verbose=False,cam_num=0,wh=None,offset=None,framerate=None):
+	def __init__(self,verbose=False,cam_num=0,wh=None,offset=None,framerate=None,backend=None,serial=None,
+	binning=1,decimation=1,exposure=None,roi=None,roi_presets=None):
 		"""
 		Example entry point; please see Enumeration_QuickSpin example for more
 		in-depth comments on preparing and cleaning up the system.
 
-		:return: True if successful, False otherwise.
-		:rtype: bool
+		Every blackfly_camera on the same backend shares one System (see
+		acquire_system), so several can be open at once; see multi_camera.
+
+		:param backend: Stand-in for the PySpin module, e.g. sim_spin.sim_spin()
+			to run without a camera.
+		:param serial: Open the camera with this serial number instead of cam_num.
+		:param binning: Sensor binning factor, or (horizontal, vertical); see configure_binning.
+		:param decimation: Sensor decimation factor, or (horizontal, vertical).
+		:param exposure: Fixed exposure time (us), or None to leave ExposureAuto alone.
+		:param roi: Name of an ROI preset to start in, instead of wh/offset/binning/decimation.
+		:param roi_presets: Extra presets, {name: {'wh':..., 'offset':..., 'binning':..., 'decimation':...}},
+			added to ROI_PRESETS; see use_roi.
+		:raises RuntimeError: If the camera can't be found, initialised or
+			configured; the System reference is released first.
 		"""
 		result = True
+		if backend is None:
+			if PySpin is None:
+				raise ImportError('PySpin is not installed; pass backend=sim_spin() to run without a camera')
+			backend = PySpin
+		self.spin = backend;
 		self.verbose = verbose;
 		# TODO: input checks for below
 		self.wh = wh;
 		self.offset = offset;
 		self.framerate = framerate;
+		self.binning = binning;
+		self.decimation = decimation;
+		self.exposure = exposure;
+		self.roi = roi;
+		self.roi_presets = dict(ROI_PRESETS,**(roi_presets or {}));
 		self.start_time = 0;
-		# Retrieve singleton reference to system object
-		self.system = PySpin.System.GetInstance()
+		self.dtype = np.dtype(np.uint8);
+		self.pool = frame_pool();
+		self.metrics = registry('camera'); #counters/histograms, see LCpy.metrics
+		self.last_acquisition = {};
+		self.triggered = False;
+		self.armed = threading.Event(); #set once an acquisition has begun and is waiting for frames
+		self.grab_timeout_ms = 500; #how often a wait for a frame checks for cancellation
+		self.cam = None;
+		# Retrieve (shared) reference to system object
+		self.system = acquire_system(self.spin)
 
 		# Retrieve list of cameras from the system
 		self.cam_list = self.system.GetCameras()
 		
 		num_cameras = self.cam_list.GetSize()
-		if cam_num>num_cameras:
-			print(f'Not enough cameras found! Attempted to use camera {cam_num}, only have {num_cameras}')
-			return False
+		if num_cameras and serial is None and cam_num>=num_cameras:
+			self.close()
+			raise RuntimeError(f'Not enough cameras found! Attempted to use camera {cam_num}, only have {num_cameras}')
 
 		if self.verbose: print(f'Number of cameras detected: {num_cameras}')
 		if self.verbose: print('    Using camera number: %d' % cam_num)
 		
 		# Finish if there are no cameras
 		if num_cameras == 0:
-			# Clear camera list before releasing system
-			self.cam_list.Clear()
-
-			# Release system instance
-			self.system.ReleaseInstance()
-
-			print('No cameras found!')
-			return False
+			self.close()
+			raise RuntimeError('No cameras found!')
 
-		self.cam = self.cam_list[cam_num]
+		if serial is None:
+			self.cam = self.cam_list[cam_num]
+		else:
+			self.cam = self.cam_list.GetBySerial(str(serial))
 		
 		try:
 			# Initialize camera
@@ -91,41 +179,61 @@ class blackfly_camera:
 
 			# Configure exposure
 			if not self._configure_custom_image_settings():
-				print('Failed to set camera parameters!')
-				return False
+				self.close()
+				raise RuntimeError('Failed to set camera parameters!')
 
-		except PySpin.SpinnakerException as ex:
-			print('Error: %s' % ex)
-			return False
+		except self.spin.SpinnakerException as ex:
+			self.close()
+			raise RuntimeError('Error: %s' % ex) from ex
 		if self.verbose: print('Ready for capture!')
 
-	def __del__(self):
+	def close(self):
+		"""
+		Deinitialises the camera and drops this camera's reference to the
+		shared System. Safe to call more than once.
+		"""
 		# Release reference to camera
 		# NOTE: Unlike the C++ examples, we cannot rely on pointer objects being automatically
 		# cleaned up when going out of scope.
 		# The usage of del is preferred to assigning the variable to None
-					# Deinitialize camera
-		
-		self.cam.DeInit()
-		del self.cam
-
-		# Clear camera list before releasing system
+		if getattr(self,'system',None) is None:
+			return
+		if not self.cam is None:
+			# Deinitialize camera (it may not have got that far)
+			try:
+				initialised = self.cam.IsInitialized()
+			except self.spin.SpinnakerException:
+				initialised = False; #e.g. no camera with the requested serial
+			if initialised:
+				if self.cam.IsStreaming():
+					self.cam.EndAcquisition()
+				self.cam.DeInit()
+			del self.cam
+			self.cam = None;
+
+		# Clear this camera's list before releasing system
 		self.cam_list.Clear()
 
-		# Release system instance
-		self.system.ReleaseInstance()	
+		# Release system instance, once no other camera is using it
+		self.system = None;
+		release_system(self.spin)
+
+	def __del__(self):
+		try:
+			self.close()
+		except Exception as ex:
+			print('Error closing camera: %s' % ex)
 
 	def _configure_custom_image_settings(self):
 		"""
-		Configures a number of settings on the camera including offsets X and Y,
-		width, height, and pixel format. These settings must be applied before
-		BeginAcquisition() is called; otherwise, those nodes would be read only.
-		Also, it is important to note that settings are applied immediately.
-		This means if you plan to reduce the width and move the x offset accordingly,
-		you need to apply such changes in the appropriate order.
+		Configures a number of settings on the camera including binning,
+		decimation, offsets X and Y, width, height, pixel format, frame rate and
+		exposure. These settings must be applied before BeginAcquisition() is
+		called; otherwise, those nodes would be read only. Also, it is important
+		to note that settings are applied immediately, and that they limit each
+		other: binning and decimation shrink the image, so they go first, and the
+		largest frame rate depends on the ROI, so it goes after.
 
-		:param cam: Camera to configure settings on.
-		:type cam: CameraPtr
 		:return: True if successful, False otherwise.
 		:rtype: bool
 		"""
@@ -134,98 +242,290 @@ class blackfly_camera:
 		result = True
 		try:
 			if self.wh is None:
-				#wh = [cam.Width.GetMax(),cam.Height.GetMax()]
 				self.wh = [640,480]
 				if self.verbose: print('Default Width/Height')
 			if self.offset is None:
-				self.offset = [0,0];#[976, 732]
-				#offset = [cam.OffsetX.GetMin(),cam.OffsetY.GetMin()]
-			if not self.framerate is None:
-				if self.verbose: print('Seeting framerate may fail! If it does, set through the SpinView program, then rerun.')
-				self.cam.AcquisitionFrameRate.SetValue(self.framerate);
+				self.offset = [0,0];
 			# Apply mono 8 pixel format
 			#
 			# *** NOTES ***
 			# In QuickSpin, enumeration nodes are as easy to set as other node
 			# types. This is because enum values representing each entry node
 			# are added to the API.
-			if self.cam.PixelFormat.GetAccessMode() == PySpin.RW:
-				self.cam.PixelFormat.SetValue(PySpin.PixelFormat_Mono8)
-				if self.verbose: print('Pixel format set to %s...' % self.cam.PixelFormat.GetCurrentEntry().GetSymbolic())
-
+			if self.set_enum('PixelFormat','Mono8'):
+				self.dtype = pixel_dtype(self.cam.PixelFormat.GetCurrentEntry().GetSymbolic())
 			else:
-				print('Pixel format not available...')
 				result = False
-				
-			
-			# Set maximum width
-			#
-			# *** NOTES ***
-			# Other nodes, such as those corresponding to image width and height,
-			# might have an increment other than 1. In these cases, it can be
-			# important to check that the desired value is a multiple of the
-			# increment.
-			#
-			# This is often the case for width and height nodes. However, because
-			# these nodes are being set to their maximums, there is no real reason
-			# to check against the increment.
-			if self.cam.Width.GetAccessMode() == PySpin.RW and self.cam.Width.GetInc() != 0 and self.cam.Width.GetMax != 0:
-				self.cam.Width.SetValue(self.wh[0])
-				if self.verbose: print('Width set to %i...' % self.cam.Width.GetValue())
-
+			if not self.roi is None:
+				# A preset brings its own binning, decimation and ROI, and sets the frame rate and exposure
+				if not self.use_roi(self.roi):
+					result = False
 			else:
-				print('Width not available...')
-				result = False
+				if self.binning != 1 and not self.configure_binning(self.binning):
+					result = False
+				if self.decimation != 1 and not self.configure_decimation(self.decimation):
+					result = False
+				if not self.set_roi(self.wh,self.offset):
+					result = False
+				if not self.framerate is None and self.set_framerate(self.framerate) is None:
+					result = False
+				if not self.exposure is None and self.set_exposure(self.exposure) is None:
+					result = False
 
-			# Set maximum height
-			#
-			# *** NOTES ***
-			# A maximum is retrieved with the method GetMax(). A node's minimum and
-			# maximum should always be a multiple of its increment.
-			if self.cam.Height.GetAccessMode() == PySpin.RW and self.cam.Height.GetInc() != 0 and self.cam.Height.GetMax != 0:
-				self.cam.Height.SetValue(self.wh[1])
-				if self.verbose: print('Height set to %i...' % self.cam.Height.GetValue())
-			else:
-				print('Height not available...')
-				result = False
-			
-			# Apply minimum to offset X
-			#
-			# *** NOTES ***
-			# Numeric nodes have both a minimum and maximum. A minimum is retrieved
-			# with the method GetMin(). Sometimes it can be important to check
-			# minimums to ensure that your desired value is within range.
-			if self.cam.OffsetX.GetAccessMode() == PySpin.RW:
-				self.cam.OffsetX.SetValue(self.offset[0])
-				if self.verbose: print('Offset X set to %d...' % self.cam.OffsetX.GetValue())
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return False
 
-			else:
-				print('Offset X not available...')
-				result = False
+		return result
 
-			# Apply minimum to offset Y
-			#
-			# *** NOTES ***
-			# It is often desirable to check the increment as well. The increment
-			# is a number of which a desired value must be a multiple. Certain
-			# nodes, such as those corresponding to offsets X and Y, have an
-			# increment of 1, which basically means that any value within range
-			# is appropriate. The increment is retrieved with the method GetInc().
-			if self.cam.OffsetY.GetAccessMode() == PySpin.RW:
-				self.cam.OffsetY.SetValue(self.offset[1])
-				if self.verbose: print('Offset Y set to %d...' % self.cam.OffsetY.GetValue())
+	def _writable(self,name):
+		node = getattr(self.cam,name,None)
+		if node is None or node.GetAccessMode() != self.spin.RW:
+			return None
+		return node
 
-			else:
-				print('Offset Y not available...')
-				result = False
+	def set_node(self,name,value):
+		"""
+		Sets a numeric (integer or float) node to the nearest value it accepts:
+		clamped to GetMin()/GetMax() and rounded down onto its increment, so that
+		e.g. a Width of 1000 on a camera with an increment of 16 becomes 992
+		instead of raising. Adjustments are printed.
+
+		:param name: QuickSpin node name, e.g. 'Width' or 'AcquisitionFrameRate'.
+		:return: The value actually set, or None if the node isn't writable.
+		"""
+		node = self._writable(name)
+		if node is None:
+			print('%s not available...' % name)
+			return None
+		lo, hi = node.GetMin(), node.GetMax()
+		target = min(max(value,lo),hi)
+		inc = node.GetInc() if getattr(node,'HasInc',lambda: True)() else 0
+		if isinstance(lo,int):
+			target = int(target)
+			if inc > 0:
+				target = lo+(target-lo)//inc*inc
+		elif inc > 0:
+			target = min(lo+np.floor((target-lo)/inc+1e-9)*inc,hi)
+		node.SetValue(target)
+		actual = node.GetValue()
+		if actual != value:
+			print('%s set to %s (asked for %s, limits [%s, %s], increment %s)' % (name,actual,value,lo,hi,inc))
+		elif self.verbose: print('%s set to %s...' % (name,actual))
+		return actual
+
+	def set_enum(self,name,entry):
+		"""
+		Sets an enumeration node by its entry's name, e.g. set_enum('ExposureAuto','Off').
+
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		node = self._writable(name)
+		value = getattr(self.spin,'%s_%s' % (name,entry),None)
+		if node is None or value is None:
+			print('%s %s not available...' % (name,entry))
+			return False
+		node.SetValue(value)
+		if self.verbose: print('%s set to %s...' % (name,entry))
+		return True
+
+	def configure_binning(self,binning=1,mode='Average',selector='Sensor'):
+		"""
+		Bins pixels on the camera. Sensor binning combines pixels before they're
+		read out, so it cuts both the link bandwidth and the readout time and
+		raises the largest frame rate; binning in the ISP only cuts bandwidth.
+		The image (and the largest Width/Height) shrinks by the binning factor,
+		so set the ROI afterwards.
+
+		:param binning: Factor for both directions, or (horizontal, vertical).
+		:param mode: 'Average' or 'Sum'.
+		:param selector: 'Sensor', falling back to 'All' on cameras without it.
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		bh, bv = (binning,binning) if np.isscalar(binning) else binning
+		try:
+			if not self._writable('BinningSelector') is None and not getattr(self.spin,'BinningSelector_'+selector,None) is None:
+				self.set_enum('BinningSelector',selector)
+			result = not self.set_node('BinningHorizontal',bh) is None
+			result = not self.set_node('BinningVertical',bv) is None and result
+			for name in ('BinningHorizontalMode','BinningVerticalMode'):
+				if not self._writable(name) is None:
+					self.set_enum(name,mode)
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return False
+		self.binning = (self.cam.BinningHorizontal.GetValue(),self.cam.BinningVertical.GetValue());
+		return result
+
+	def configure_decimation(self,decimation=1,selector='Sensor'):
+		"""
+		Reads out only every decimation-th pixel (and row) of the sensor. Like
+		sensor binning this cuts bandwidth and readout time, but it keeps the
+		full-resolution pixels and aliases where binning averages.
+
+		:param decimation: Factor for both directions, or (horizontal, vertical).
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		dh, dv = (decimation,decimation) if np.isscalar(decimation) else decimation
+		try:
+			if not self._writable('DecimationSelector') is None and not getattr(self.spin,'DecimationSelector_'+selector,None) is None:
+				self.set_enum('DecimationSelector',selector)
+			result = not self.set_node('DecimationHorizontal',dh) is None
+			result = not self.set_node('DecimationVertical',dv) is None and result
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return False
+		self.decimation = (self.cam.DecimationHorizontal.GetValue(),self.cam.DecimationVertical.GetValue());
+		return result
 
+	def set_roi(self,wh=None,offset=None):
+		"""
+		Sets the region of the (binned/decimated) image that is read out.
 
-		except PySpin.SpinnakerException as ex:
+		:param wh: [width, height], or None for the whole image.
+		:param offset: [x, y], or 'center' (also the default) to centre the ROI.
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		try:
+			# The offsets limit the largest width/height, so clear them first
+			for name in ('OffsetX','OffsetY'):
+				node = self._writable(name)
+				if not node is None:
+					node.SetValue(node.GetMin())
+			if wh is None:
+				wh = [self.cam.Width.GetMax(),self.cam.Height.GetMax()]
+			w = self.set_node('Width',wh[0])
+			h = self.set_node('Height',wh[1])
+			if w is None or h is None:
+				return False
+			if offset is None or offset == 'center':
+				offset = [(self.cam.OffsetX.GetMax()+self.cam.OffsetX.GetMin())//2,(self.cam.OffsetY.GetMax()+self.cam.OffsetY.GetMin())//2]
+			x = self.set_node('OffsetX',offset[0])
+			y = self.set_node('OffsetY',offset[1])
+		except self.spin.SpinnakerException as ex:
 			print('Error: %s' % ex)
 			return False
+		self.wh = [w,h];
+		self.offset = [x,y];
+		return not (x is None or y is None)
+
+	def use_roi(self,name):
+		"""
+		Switches to one of the ROI presets (see ROI_PRESETS and roi_presets):
+		its binning, decimation and ROI, then the requested frame rate and
+		exposure again, since their limits follow the ROI. Not while acquiring.
 
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		preset = self.roi_presets[name]
+		result = self.configure_binning(preset.get('binning',1))
+		result = self.configure_decimation(preset.get('decimation',1)) and result
+		result = self.set_roi(preset.get('wh'),preset.get('offset','center')) and result
+		if not self.framerate is None:
+			result = not self.set_framerate(self.framerate) is None and result
+		if not self.exposure is None:
+			result = not self.set_exposure(self.exposure) is None and result
+		self.roi = name;
 		return result
 
+	def set_framerate(self,framerate):
+		"""
+		Turns on AcquisitionFrameRateEnable (so the camera keeps to the set
+		rate rather than running flat out) and sets AcquisitionFrameRate, within
+		the largest rate the current ROI, binning and exposure allow.
+
+		:return: The frame rate actually set, or None if it couldn't be.
+		"""
+		try:
+			if not self._writable('AcquisitionFrameRateEnable') is None:
+				self.cam.AcquisitionFrameRateEnable.SetValue(True)
+			rate = self.set_node('AcquisitionFrameRate',float(framerate))
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return None
+		return rate
+
+	def set_exposure(self,exposure_us):
+		"""
+		Turns off ExposureAuto and sets a fixed ExposureTime, in microseconds;
+		it can't be longer than the frame period allows.
+
+		:return: The exposure actually set, or None if it couldn't be.
+		"""
+		try:
+			if not self._writable('ExposureAuto') is None:
+				self.set_enum('ExposureAuto','Off')
+			exposure = self.set_node('ExposureTime',float(exposure_us))
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return None
+		return exposure
+
+	def configure_chunk_data(self,enable=True):
+		"""
+		Turns on (or off) the chunk data the camera attaches to every frame:
+		its timestamp, frame ID and exposure time.
+
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		try:
+			self.cam.ChunkModeActive.SetValue(True)
+			for name in ('Timestamp','FrameID','ExposureTime'):
+				self.cam.ChunkSelector.SetValue(getattr(self.spin,'ChunkSelector_'+name))
+				self.cam.ChunkEnable.SetValue(enable)
+			if not enable:
+				self.cam.ChunkModeActive.SetValue(False)
+		except (self.spin.SpinnakerException,AttributeError) as ex:
+			print('Error: %s' % ex)
+			return False
+		return True
+
+	def configure_trigger(self,source='Line0',selector='AcquisitionStart',activation='RisingEdge'):
+		"""
+		Puts the camera in external trigger mode, so that once acquisition has
+		begun it waits for an edge on the trigger line (e.g. from the Analog
+		Discovery trigger output, see LCpy.sync) before exposing. With the
+		AcquisitionStart selector one edge starts free-running capture; with
+		FrameStart every frame needs its own edge.
+
+		:param source: Trigger input line, e.g. 'Line0' (opto-isolated input) or 'Line3'.
+		:param selector: 'AcquisitionStart' or 'FrameStart'.
+		:param activation: 'RisingEdge' or 'FallingEdge'.
+		:return: True if successful, False otherwise.
+		:rtype: bool
+		"""
+		try:
+			# Trigger mode has to be off while the trigger is reconfigured
+			self.cam.TriggerMode.SetValue(self.spin.TriggerMode_Off)
+			self.cam.TriggerSelector.SetValue(getattr(self.spin,'TriggerSelector_'+selector))
+			self.cam.TriggerSource.SetValue(getattr(self.spin,'TriggerSource_'+source))
+			self.cam.TriggerActivation.SetValue(getattr(self.spin,'TriggerActivation_'+activation))
+			self.cam.TriggerMode.SetValue(self.spin.TriggerMode_On)
+		except (self.spin.SpinnakerException,AttributeError) as ex:
+			print('Error: %s' % ex)
+			return False
+		self.triggered = True;
+		if self.verbose: print('Trigger set to %s on %s' % (selector,source))
+		return True
+
+	def trigger_off(self):
+		"""
+		Goes back to free-running (software started) acquisition.
+		"""
+		try:
+			self.cam.TriggerMode.SetValue(self.spin.TriggerMode_Off)
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			return False
+		self.triggered = False;
+		return True
+
 	def print_device_info(self):
 		"""
 		This function prints the device information of the camera from the transport
@@ -244,19 +544,19 @@ class blackfly_camera:
 			result = True
 			nodemap = self.cam.GetTLDeviceNodeMap()
 
-			node_device_information = PySpin.CCategoryPtr(nodemap.GetNode('DeviceInformation'))
+			node_device_information = self.spin.CCategoryPtr(nodemap.GetNode('DeviceInformation'))
 
-			if PySpin.IsAvailable(node_device_information) and PySpin.IsReadable(node_device_information):
+			if self.spin.IsAvailable(node_device_information) and self.spin.IsReadable(node_device_information):
 				features = node_device_information.GetFeatures()
 				for feature in features:
-					node_feature = PySpin.CValuePtr(feature)
+					node_feature = self.spin.CValuePtr(feature)
 					print('%s: %s' % (node_feature.GetName(),
-									  node_feature.ToString() if PySpin.IsReadable(node_feature) else 'Node not readable'))
+									  node_feature.ToString() if self.spin.IsReadable(node_feature) else 'Node not readable'))
 
 			else:
 				print('Device control information not available.')
 
-		except PySpin.SpinnakerException as ex:
+		except self.spin.SpinnakerException as ex:
 			print('Error: %s' % ex.message)
 			return False
 
@@ -275,29 +575,30 @@ class blackfly_camera:
 		"""
 		if self.verbose: print('\n*** IMAGE ACQUISITION ***\n')
 
-		new_im = np.zeros((1,self.wh[1],self.wh[0]),dtype=int) #yes, it is annoyingly switched
+		new_im = np.zeros((1,self.wh[1],self.wh[0]),dtype=self.dtype) #yes, it is annoyingly switched
 		capture_time = 0.0;
 		try:
 			result = True
 
 			# Set acquisition mode to continuous
-			if self.cam.AcquisitionMode.GetAccessMode() != PySpin.RW:
+			if self.cam.AcquisitionMode.GetAccessMode() != self.spin.RW:
 				print('Unable to set acquisition mode to continuous. Aborting...')
 				return False
 
-			self.cam.AcquisitionMode.SetValue(PySpin.AcquisitionMode_Continuous)
+			self.cam.AcquisitionMode.SetValue(self.spin.AcquisitionMode_Continuous)
 			if self.verbose: print('Acquisition mode set to continuous...')
 
 			# Begin acquiring images
-			while time.time()<self.start_time:
+			while time.time()<self.start_time and not cancelled():
 				time.sleep(0.001);
 			self.cam.BeginAcquisition()
+			self.armed.set()
 
 			if self.verbose: print('Acquiring images...')
 
 			# Get device serial number for filename
 			device_serial_number = ''
-			if self.cam.TLDevice.DeviceSerialNumber is not None and self.cam.TLDevice.DeviceSerialNumber.GetAccessMode() == PySpin.RO:
+			if self.cam.TLDevice.DeviceSerialNumber is not None and self.cam.TLDevice.DeviceSerialNumber.GetAccessMode() == self.spin.RO:
 				device_serial_number = self.cam.TLDevice.DeviceSerialNumber.GetValue()
 
 				if self.verbose: print('Device serial number retrieved as %s...' % device_serial_number)
@@ -306,111 +607,351 @@ class blackfly_camera:
 			# Retrieve, convert, and save images
 			try:
 				# Retrieve next received image and ensure image completion
-				image_result = self.cam.GetNextImage()
-
-				if image_result.IsIncomplete():
-					print('Image incomplete with image status %d...' % image_result.GetImageStatus())
-				
-				new_im[0,:,:] = image_result.GetNDArray()
-			except PySpin.SpinnakerException as ex:
+				image_result = self._next_image()
+				if image_result is None:
+					result = False #cancelled before it came
+				else:
+					if image_result.IsIncomplete():
+						print('Image incomplete with image status %d...' % image_result.GetImageStatus())
+					
+					new_im[0,:,:] = image_result.GetNDArray()
+					image_result.Release()
+			except self.spin.SpinnakerException as ex:
 				print('Error: %s' % ex)
 				result = False
 			# End acquisition
 			self.cam.EndAcquisition()
-		except PySpin.SpinnakerException as ex:
+		except self.spin.SpinnakerException as ex:
 			print('Error: %s' % ex)
 			result = False
 		return new_im
 
 
+	def _next_image(self):
+		"""
+		GetNextImage, waiting as long as it takes but in grab_timeout_ms steps,
+		so a cancelled (or timed out) call isn't stuck on a frame or trigger
+		that never comes.
+
+		:return: The image, or None if the call was cancelled first.
+		"""
+		while not cancelled():
+			try:
+				return self.cam.GetNextImage(self.grab_timeout_ms)
+			except self.spin.SpinnakerException as ex:
+				if getattr(ex,'errorcode',None) != SPINNAKER_ERR_TIMEOUT:
+					raise
+				self.metrics.counter('grab_timeouts').inc()
+		return None
+
 	@threaded
-	def acquire_images(self,num_frames=NUM_IMAGES,save_images=False):
+	def acquire_images(self,num_frames=NUM_IMAGES,save_images=False,sink=None,decimate=1,output_rate=None,chunk_data=False,
+	reducers=None,keep_frames=True):
 		"""
 		This function acquires and saves 10 images from a device; please see
 		Acquisition example for more in-depth comments on the acquisition of images.
 
-		:param cam: Camera to acquire images from.
-		:type cam: CameraPtr
-		:return: True if successful, False otherwise.
-		:rtype: bool
+		Frames are kept in memory unless a sink is given, in which case each frame
+		is handed to sink.write() as soon as it is grabbed and only the capture
+		times are kept. This keeps memory bounded for long collects.
+
+		In memory, frames are stored in the camera's native dtype in a buffer
+		taken from self.pool. Hand it back with release_frames() once it has been
+		saved so the next collect can reuse it; a video that isn't handed back is
+		simply freed when it's dropped.
+
+		Only every decimate-th frame (starting with the first) is copied out and
+		timestamped; the rest are released straight back to the camera. The
+		counts of grabbed, kept and skipped frames are left in
+		self.last_acquisition.
+
+		With chunk_data, every kept frame's camera timestamp, frame ID and
+		exposure are recorded in a FRAME_META_DTYPE array, the camera clock is
+		fitted onto host time (the device_t column), and frames dropped on the
+		camera side are counted from gaps in the frame IDs (frames_dropped and
+		gap_indices in self.last_acquisition).
+
+		Every kept frame is also run through the reducers (see
+		QuickCapture.reducers) while it is still in the camera's buffer; their
+		time series are left in the reducers and in
+		self.last_acquisition['reductions']. With keep_frames=False (and no
+		sink) the frames themselves aren't stored at all and the video returned
+		is None.
+
+		Cancelling the returned future (or a timeout) stops the acquisition
+		cleanly after the current frame; the frames kept so far are returned.
+
+		:param num_frames: Number of frames to grab from the camera.
+		:type num_frames: int
+		:param save_images: Also save every kept frame as a jpg.
+		:type save_images: bool
+		:param sink: Optional frame sink, e.g. frame_sink.chunked_frame_sink.
+		:param decimate: Keep one frame out of every decimate.
+		:type decimate: int
+		:param output_rate: Desired kept frame rate (Hz). Overrides decimate using the camera frame rate.
+		:type output_rate: float
+		:param chunk_data: Also record per-frame chunk data and return it.
+		:type chunk_data: bool
+		:param reducers: Per-frame reductions, e.g. [reducers.mean_reducer(), reducers.roi_reducer(rois)].
+		:type reducers: list
+		:param keep_frames: Store the kept frames; False keeps only the reductions and times.
+		:type keep_frames: bool
+		:return: The kept video (or the sink, once flushed, or None without
+			keep_frames), their capture times and the per-frame metadata (None
+			without chunk_data).
+		:rtype: tuple
 		"""
 		if self.verbose: print('\n*** IMAGE ACQUISITION ***\n')
-		
-		new_vid = np.zeros((num_frames,self.wh[1],self.wh[0]),dtype=int) #yes, it is annoyingly switched
-		capture_times = np.zeros((num_frames));
+
+		num_frames = int(num_frames)
+		if not output_rate is None:
+			decimate = round(self.get_framerate()/output_rate)
+		decimate = max(1,int(decimate))
+		num_kept = -(-num_frames//decimate)
+		self.last_acquisition = {'frames_grabbed':0,'frames_kept':0,'frames_skipped':0,
+			'frames_incomplete':0,'decimate':decimate,'cancelled':False}
+		if not sink is None:
+			new_vid = sink;
+		elif keep_frames:
+			new_vid = self.pool.get((num_kept,self.wh[1],self.wh[0]),self.dtype) #yes, it is annoyingly switched
+		else:
+			new_vid = None;
+		reducers = [] if reducers is None else list(reducers)
+		for reducer in reducers:
+			reducer.reset()
+			reducer.reserve(num_kept)
+		capture_times = np.zeros((num_kept));
+		meta = None
+		if chunk_data:
+			meta = np.zeros(num_kept,dtype=FRAME_META_DTYPE)
+			chunk_data = self.configure_chunk_data()
+		grabbed = self.metrics.counter('frames_grabbed')
+		incomplete = self.metrics.counter('frames_incomplete')
+		grab_errors = self.metrics.counter('grab_errors')
+		grab_wait = self.metrics.histogram('grab_wait_s')
+		copy_time = self.metrics.histogram('copy_s')
+		reduce_time = self.metrics.histogram('reduce_s')
+		self.metrics.counter('acquisitions').inc()
 		try:
 			result = True
 
 			# Set acquisition mode to continuous
-			if self.cam.AcquisitionMode.GetAccessMode() != PySpin.RW:
+			if self.cam.AcquisitionMode.GetAccessMode() != self.spin.RW:
 				print('Unable to set acquisition mode to continuous. Aborting...')
 				return False
 
-			self.cam.AcquisitionMode.SetValue(PySpin.AcquisitionMode_Continuous)
+			self.cam.AcquisitionMode.SetValue(self.spin.AcquisitionMode_Continuous)
 			if self.verbose: print('Acquisition mode set to continuous...')
 
 			# Begin acquiring images
-			while time.time()<self.start_time:
+			while time.time()<self.start_time and not cancelled():
 				time.sleep(0.001);
 			self.cam.BeginAcquisition()
+			self.armed.set()
 
 			if self.verbose: print('Acquiring images...')
 
 			# Get device serial number for filename
 			device_serial_number = ''
-			if self.cam.TLDevice.DeviceSerialNumber is not None and self.cam.TLDevice.DeviceSerialNumber.GetAccessMode() == PySpin.RO:
+			if self.cam.TLDevice.DeviceSerialNumber is not None and self.cam.TLDevice.DeviceSerialNumber.GetAccessMode() == self.spin.RO:
 				device_serial_number = self.cam.TLDevice.DeviceSerialNumber.GetValue()
 
 				if self.verbose: print('Device serial number retrieved as %s...' % device_serial_number)
 
 			if self.verbose: t_start = time.time();
 			# Retrieve, convert, and save images
-			for i in range(num_frames):
-
-				try:
-					# Retrieve next received image and ensure image completion
-					image_result = self.cam.GetNextImage()
-					capture_times[i] = time.time();
-
-					if image_result.IsIncomplete():
-						print('Image incomplete with image status %d...' % image_result.GetImageStatus())
+			try:
+				for i in range(num_frames):
+					if cancelled():
+						# Cancelled or timed out: stop here and keep what we have
+						self.last_acquisition['cancelled'] = True
+						num_kept = -(-i//decimate)
+						break
+					k, skip = divmod(i,decimate)
+					image_result = None
+					try:
+						# Retrieve next received image and ensure image completion
+						t_wait = time.perf_counter()
+						image_result = self._next_image()
+						if image_result is None:
+							# Cancelled while waiting for the frame
+							self.last_acquisition['cancelled'] = True
+							num_kept = -(-i//decimate)
+							break
+						grab_wait.record(time.perf_counter()-t_wait)
+						grabbed.inc()
+						self.last_acquisition['frames_grabbed'] += 1
+						if skip:
+							# Not kept; hand the buffer straight back to the camera
+							self.last_acquisition['frames_skipped'] += 1
+							if image_result.IsIncomplete():
+								self.last_acquisition['frames_incomplete'] += 1
+								incomplete.inc()
+							continue
+						capture_times[k] = time.time();
+						if chunk_data:
+							chunk = image_result.GetChunkData()
+							meta[k] = (capture_times[k],chunk.GetTimestamp(),chunk.GetFrameID(),chunk.GetExposureTime(),0.0)
+
+						if image_result.IsIncomplete():
+							self.last_acquisition['frames_incomplete'] += 1
+							incomplete.inc()
+							print('Image incomplete with image status %d...' % image_result.GetImageStatus())
 
-					else:
-						# Print image information
-						width = image_result.GetWidth()
-						height = image_result.GetHeight()
-						if self.verbose: 
-							print('Grabbed Image %d, width = %d, height = %d' % (i, width, height))
-							print(f'  in time {time.time()-t_start}')
-							t_start = time.time();
-						# Convert image to Mono8
-						image_converted = image_result.Convert(PySpin.PixelFormat_Mono8)
-
-						# Create a unique filename
-						if device_serial_number and save_images:
-							filename = 'ImageFormatControlQS-%s-%d.jpg' % (device_serial_number, i)
 						else:
-							filename = 'ImageFormatControlQS-%d.jpg' % i
-						if save_images:
-							# Save image
-							image_converted.Save(filename)
-							if self.verbose: print('Image saved at %s' % filename)
-					new_vid[i,:,:] = image_result.GetNDArray()
-					# Release image
-					image_result.Release()
+							# Print image information
+							width = image_result.GetWidth()
+							height = image_result.GetHeight()
+							if self.verbose: 
+								print('Grabbed Image %d, width = %d, height = %d' % (i, width, height))
+								print(f'  in time {time.time()-t_start}')
+								t_start = time.time();
+							if save_images:
+								# Create a unique filename
+								if device_serial_number:
+									filename = 'ImageFormatControlQS-%s-%d.jpg' % (device_serial_number, i)
+								else:
+									filename = 'ImageFormatControlQS-%d.jpg' % i
+								# Convert image to Mono8 and save it
+								image_converted = image_result.Convert(self.spin.PixelFormat_Mono8)
+								image_converted.Save(filename)
+								if self.verbose: print('Image saved at %s' % filename)
+						t_copy = time.perf_counter()
+						frame = image_result.GetNDArray()
+						if not sink is None:
+							sink.write(frame,capture_times[k])
+						elif not new_vid is None:
+							new_vid[k,:,:] = frame
+						copy_time.record(time.perf_counter()-t_copy)
+						if reducers:
+							t_reduce = time.perf_counter()
+							for reducer in reducers:
+								reducer.process(frame,capture_times[k],k)
+							reduce_time.record(time.perf_counter()-t_reduce)
+						del frame
+						self.last_acquisition['frames_kept'] += 1
+
+					except self.spin.SpinnakerException as ex:
+						print('Error: %s' % ex)
+						result = False
+						grab_errors.inc()
+						if sink is None and not skip and not new_vid is None:
+							new_vid[k,:,:] = 0 #pooled buffers aren't cleared
+					finally:
+						# Hand the buffer back to the camera, whatever happened to the frame
+						if not image_result is None:
+							image_result.Release()
+			finally:
+				# End acquisition, even if a sink or reducer failed
+				self.cam.EndAcquisition()
+
+		except self.spin.SpinnakerException as ex:
+			print('Error: %s' % ex)
+			result = False
 
-				except PySpin.SpinnakerException as ex:
-					print('Error: %s' % ex)
-					result = False
+		if self.last_acquisition['cancelled']:
+			capture_times = capture_times[:num_kept]
+			if sink is None and not new_vid is None:
+				new_vid = new_vid[:num_kept] #release_frames still finds the pooled buffer
+			if not meta is None:
+				meta = meta[:num_kept]
+		if sink is not None:
+			sink.flush()
+		if reducers:
+			self.last_acquisition['reductions'] = reductions(reducers)
+		if meta is None:
+			return new_vid, capture_times, None
+		self.last_acquisition.update(finish_meta(meta,decimate))
+		self.metrics.counter('frames_dropped').inc(self.last_acquisition['frames_dropped'])
+		if self.last_acquisition['frames_dropped']:
+			print('%d frames were dropped by the camera' % self.last_acquisition['frames_dropped'])
+		return new_vid, capture_times, meta
 
-			# End acquisition
+	@threaded
+	def acquire_stream(self,num_frames,stages=None,ring_size=64,overflow='block',decimate=1,reducers=None,keep_frames=True):
+		"""
+		Acquires num_frames frames with a dedicated grab thread that only copies
+		each frame into a ring buffer and releases it, while a consumer thread
+		runs the frames through stages (see acquisition_engine). With no stages,
+		the kept frames are collected in memory as in acquire_images (unless
+		keep_frames is False). Reducers are added after the stages, so the
+		reductions run on the consumer thread, off the grab path.
+
+		:param num_frames: Number of frames to grab from the camera.
+		:type num_frames: int
+		:param stages: Consumer stages, e.g. acquisition_engine.writer_stage(sink).
+		:type stages: list
+		:param ring_size: Frames buffered between the grab thread and the stages.
+		:type ring_size: int
+		:param overflow: 'block' (backpressure) or 'drop' when the ring is full.
+		:type overflow: str
+		:param decimate: Keep one frame out of every decimate.
+		:type decimate: int
+		:param reducers: Per-frame reductions (see QuickCapture.reducers), run as extra stages.
+		:type reducers: list
+		:param keep_frames: Without stages, store the kept frames in memory.
+		:type keep_frames: bool
+		:return: The stages and the engine statistics (frames grabbed, overflowed, backpressure waits, ...).
+		:rtype: tuple
+		"""
+		num_frames = int(num_frames)
+		decimate = max(1,int(decimate))
+		num_kept = -(-num_frames//decimate)
+		if stages is None:
+			stages = []
+			if keep_frames:
+				stages.append(memory_stage(self.pool.get((num_kept,self.wh[1],self.wh[0]),self.dtype),np.zeros(num_kept)))
+		reducers = [] if reducers is None else list(reducers)
+		for reducer in reducers:
+			reducer.reset()
+			reducer.reserve(num_kept)
+		stages = list(stages)+reducers
+		engine = acquisition_engine(self.cam,stages,(self.wh[1],self.wh[0]),self.dtype,
+			ring_size=ring_size,overflow=overflow,decimate=decimate,errors=(self.spin.SpinnakerException,),
+			cancel=cancel_event(),metrics=self.metrics)
+		self.cam.AcquisitionMode.SetValue(self.spin.AcquisitionMode_Continuous)
+		while time.time()<self.start_time and not cancelled():
+			time.sleep(0.001);
+		self.cam.BeginAcquisition()
+		self.armed.set()
+		try:
+			stats = engine.run(num_frames)
+		finally:
 			self.cam.EndAcquisition()
+		if self.verbose: print('Acquisition stats: %s' % stats)
+		return stages, stats
 
-		except PySpin.SpinnakerException as ex:
-			print('Error: %s' % ex)
-			result = False
+	async def acquire_images_async(self,*args,timeout=None,**kwargs):
+		"""
+		acquire_images for asyncio code: await it (e.g. in asyncio.gather)
+		instead of polling the future. Cancelling the task stops the
+		acquisition; with a timeout (seconds) it is stopped after that long and
+		TimeoutError is raised.
+		"""
+		return await wait_async(self.acquire_images(*args,**kwargs),timeout)
+
+	async def acquire_stream_async(self,*args,timeout=None,**kwargs):
+		"""
+		acquire_stream for asyncio code, see acquire_images_async.
+		"""
+		return await wait_async(self.acquire_stream(*args,**kwargs),timeout)
+
+	def get_framerate(self):
+		"""
+		The camera's acquisition frame rate, falling back to the requested
+		framerate (or 30 fps) if the node can't be read.
+		"""
+		try:
+			return self.cam.AcquisitionFrameRate.GetValue()
+		except self.spin.SpinnakerException:
+			return 30.0 if self.framerate is None else self.framerate
 
-		return new_vid, capture_times
+	def release_frames(self,frames):
+		"""
+		Returns a video from acquire_images (or a slice of one) to the buffer pool.
+		Don't touch the frames after this; the next collect will overwrite them.
+		"""
+		return self.pool.release(frames)
 
 if __name__ == "__main__":
     bc = blackfly_camera(verbose=True);
@@ -1 +1 @@
-from QuickCapture.Quick_capture import *
\ No newline at end of file
+from .Quick_capture import *
\ No newline at end of file
@@ -0,0 +1,312 @@
+"""
+Producer/consumer acquisition for the Blackfly.
+
+A grab thread does nothing but pull images off the camera, copy the pixels into
+a preallocated ring of frame slots and release the image straight back to the
+driver. A consumer thread takes filled slots off the ring and hands each one to
+a list of stages (a writer, a reducer, a preview, ...). A slow stage backs up
+the ring rather than the camera, and the engine counts how often that happened.
+
+Stages only need a process(frame,t,i) method and, optionally, close(). The frame
+passed to process() is a view into the ring and is overwritten once process()
+returns, so a stage that keeps it must copy it.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from LCpy.metrics import registry
+
+SPINNAKER_ERR_TIMEOUT = -1011; #errorcode of a GetNextImage that timed out
+
+class frame_ring:
+	def __init__(self,n_slots,shape,dtype=np.uint8):
+		"""
+		Bounded single-producer/single-consumer ring of frame slots.
+
+		:param n_slots: Number of frames the ring can hold.
+		:param shape: Shape of one frame (height,width).
+		:param dtype: Pixel dtype.
+		"""
+		self.n_slots = int(n_slots);
+		self.frames = np.empty((self.n_slots,)+tuple(shape),dtype=dtype)
+		self.times = np.zeros(self.n_slots)
+		self.index = np.zeros(self.n_slots,dtype=np.int64)
+		self._head = 0; #slots ever filled
+		self._tail = 0; #slots ever consumed
+		self._cond = threading.Condition()
+		self.max_fill = 0;
+
+	def fill(self):
+		return self._head - self._tail
+
+	def reserve(self,block=True,timeout=None):
+		"""
+		Returns the next free slot, or None if the ring is full and either block
+		is False or the timeout ran out.
+		"""
+		with self._cond:
+			if self._head - self._tail >= self.n_slots:
+				if not block:
+					return None
+				if not self._cond.wait_for(lambda: self._head - self._tail < self.n_slots,timeout):
+					return None
+			return self._head % self.n_slots
+
+	def commit(self,t,i):
+		"""
+		Marks the reserved slot as filled with frame number i grabbed at time t.
+		"""
+		with self._cond:
+			slot = self._head % self.n_slots
+			self.times[slot] = t
+			self.index[slot] = i
+			self._head += 1
+			self.max_fill = max(self.max_fill,self._head - self._tail)
+			self._cond.notify_all()
+
+	def take(self,timeout=None):
+		"""
+		Returns the oldest filled slot, or None if nothing arrived before the timeout.
+		"""
+		with self._cond:
+			if not self._cond.wait_for(lambda: self._head > self._tail,timeout):
+				return None
+			return self._tail % self.n_slots
+
+	def release(self):
+		"""
+		Frees the slot returned by the last take().
+		"""
+		with self._cond:
+			self._tail += 1
+			self._cond.notify_all()
+
+class acquisition_engine:
+	def __init__(self,cam,stages,shape,dtype=np.uint8,ring_size=64,overflow='block',
+	decimate=1,grab_timeout_ms=2000,errors=(Exception,),cancel=None,metrics=None):
+		"""
+		:param cam: Camera to grab from; anything with GetNextImage() returning PySpin-like images.
+		:param stages: List of consumer stages, called in order for every kept frame.
+		:param shape: Frame shape (height,width).
+		:param dtype: Pixel dtype of the frames.
+		:param ring_size: Number of frames buffered between the grab thread and the stages.
+		:param overflow: 'block' to make the grab thread wait for a free slot
+			(backpressure, the camera's own buffers absorb it) or 'drop' to throw
+			the frame away when the ring is full.
+		:param decimate: Only every decimate-th grabbed frame is copied into the ring.
+		:param grab_timeout_ms: Timeout passed to GetNextImage(). A grab that
+			times out (e.g. waiting for a trigger or a long exposure) is counted
+			in grab_timeouts and retried; it doesn't use up a frame.
+		:param errors: Exception types raised by the camera driver for a single bad grab.
+		:param cancel: Optional Event that stops the run like stop() when set,
+			e.g. ez_thread.cancel_event() from inside a @threaded call.
+		:param metrics: Optional LCpy.metrics registry to record grab counts and timings in.
+		"""
+		if overflow not in ('block','drop'):
+			raise ValueError("overflow must be 'block' or 'drop'")
+		self.cam = cam;
+		self.stages = list(stages);
+		self.ring = frame_ring(ring_size,shape,dtype)
+		self.overflow = overflow;
+		self.decimate = max(1,int(decimate));
+		self.grab_timeout_ms = grab_timeout_ms;
+		self.errors = errors;
+		self._stop = threading.Event()
+		self.cancel = threading.Event() if cancel is None else cancel;
+		self._grab_done = threading.Event()
+		self.stats = {};
+		self.metrics = registry('acquisition_engine') if metrics is None else metrics;
+
+	def stop(self):
+		"""
+		Asks the grab thread to stop after the current frame.
+		"""
+		self._stop.set()
+
+	def _stopping(self):
+		return self._stop.is_set() or self.cancel.is_set()
+
+	def _grab(self,num_frames):
+		stats = self.stats
+		ring = self.ring
+		block = self.overflow == 'block'
+		m = self.metrics
+		grabbed, incomplete, grab_errors = m.counter('frames_grabbed'), m.counter('frames_incomplete'), m.counter('grab_errors')
+		overflowed, grab_wait, copy_time = m.counter('frames_overflowed'), m.histogram('grab_wait_s'), m.histogram('copy_s')
+		grab_timeouts = m.counter('grab_timeouts')
+		i = -1
+		try:
+			while i+1 < num_frames:
+				if self._stopping():
+					stats['cancelled'] = self.cancel.is_set()
+					break
+				t_wait = time.perf_counter()
+				try:
+					image = self.cam.GetNextImage(self.grab_timeout_ms)
+				except self.errors as ex:
+					if getattr(ex,'errorcode',None) == SPINNAKER_ERR_TIMEOUT:
+						# Nothing arrived yet; wait for the same frame again
+						stats['grab_timeouts'] += 1
+						grab_timeouts.inc()
+					else:
+						i += 1
+						stats['grab_errors'] += 1
+						grab_errors.inc()
+					continue
+				i += 1
+				grab_wait.record(time.perf_counter()-t_wait)
+				t = time.time()
+				stats['frames_grabbed'] += 1
+				grabbed.inc()
+				if image.IsIncomplete():
+					stats['frames_incomplete'] += 1
+					incomplete.inc()
+				if i % self.decimate:
+					stats['frames_skipped'] += 1
+					image.Release()
+					continue
+				slot = ring.reserve(block=False)
+				if slot is None and block:
+					t_wait = time.perf_counter()
+					stats['backpressure_waits'] += 1
+					while slot is None and not self._stopping():
+						slot = ring.reserve(timeout=0.1)
+					stats['backpressure_s'] += time.perf_counter()-t_wait
+					m.histogram('backpressure_s').record(time.perf_counter()-t_wait)
+				if slot is None:
+					stats['frames_overflowed'] += 1
+					overflowed.inc()
+					image.Release()
+					continue
+				t_copy = time.perf_counter()
+				ring.frames[slot] = image.GetNDArray()
+				copy_time.record(time.perf_counter()-t_copy)
+				image.Release()
+				ring.commit(t,i)
+		finally:
+			self._grab_done.set()
+
+	def _consume(self):
+		ring = self.ring
+		consumed, stage_time = self.metrics.counter('frames_consumed'), self.metrics.histogram('stage_s')
+		while True:
+			slot = ring.take(timeout=0.05)
+			if slot is None:
+				if self._grab_done.is_set() and ring.fill() == 0:
+					break
+				continue
+			frame, t, i = ring.frames[slot], ring.times[slot], ring.index[slot]
+			t_stage = time.perf_counter()
+			try:
+				for stage in self.stages:
+					stage.process(frame,t,i)
+			except Exception as ex:
+				self.stats['stage_error'] = ex
+				self._stop.set()
+			stage_time.record(time.perf_counter()-t_stage)
+			ring.release()
+			self.stats['frames_consumed'] += 1
+			consumed.inc()
+
+	def run(self,num_frames):
+		"""
+		Grabs num_frames frames (acquisition must already have begun) and runs
+		every kept frame through the stages. Blocks until the stages have seen
+		every frame in the ring.
+
+		:return: Statistics for the run.
+		:rtype: dict
+		"""
+		self.stats = {'frames_grabbed':0,'frames_incomplete':0,'frames_skipped':0,
+			'frames_overflowed':0,'frames_consumed':0,'grab_errors':0,'grab_timeouts':0,
+			'backpressure_waits':0,'backpressure_s':0.0,'cancelled':False}
+		self._stop.clear()
+		self._grab_done.clear()
+		t0 = time.perf_counter()
+		consumer = threading.Thread(target=self._consume,name='frame-consumer')
+		consumer.start()
+		try:
+			self._grab(int(num_frames))
+		finally:
+			consumer.join()
+			for stage in self.stages:
+				if hasattr(stage,'close'):
+					stage.close()
+		self.stats['ring_size'] = self.ring.n_slots
+		self.stats['max_ring_fill'] = self.ring.max_fill
+		self.stats['elapsed_s'] = time.perf_counter()-t0
+		if 'stage_error' in self.stats:
+			raise self.stats['stage_error']
+		return self.stats
+
+class memory_stage:
+	def __init__(self,frames,times):
+		"""
+		Copies frames into a preallocated video (e.g. from a frame_pool).
+
+		:param frames: Array of shape (n,height,width) to fill.
+		:param times: Array of length n for the capture times.
+		"""
+		self.frames = frames;
+		self.times = times;
+		self.n = 0;
+
+	def process(self,frame,t,i):
+		if self.n < len(self.frames):
+			self.frames[self.n] = frame
+			self.times[self.n] = t
+		self.n += 1
+
+class writer_stage:
+	def __init__(self,sink):
+		"""
+		Hands every frame to a frame sink (anything with write(frame,t)).
+		"""
+		self.sink = sink;
+
+	def process(self,frame,t,i):
+		self.sink.write(frame,t)
+
+	def close(self):
+		if hasattr(self.sink,'flush'):
+			self.sink.flush()
+
+class reducer_stage:
+	def __init__(self,fn):
+		"""
+		Applies fn to every frame and keeps the results, e.g. fn=np.mean.
+		"""
+		self.fn = fn;
+		self.values = [];
+		self.times = [];
+
+	def process(self,frame,t,i):
+		self.values.append(self.fn(frame))
+		self.times.append(t)
+
+	def result(self):
+		return np.asarray(self.values), np.asarray(self.times)
+
+class preview_stage:
+	def __init__(self,interval=0.5,callback=None):
+		"""
+		Keeps a copy of the most recent frame at most every interval seconds,
+		and passes it to callback if one is given.
+		"""
+		self.interval = interval;
+		self.callback = callback;
+		self.latest = None;
+		self.latest_t = None;
+		self._last = -np.inf;
+
+	def process(self,frame,t,i):
+		if t - self._last < self.interval:
+			return
+		self._last = t
+		self.latest = frame.copy()
+		self.latest_t = t
+		if self.callback is not None:
+			self.callback(self.latest,t)
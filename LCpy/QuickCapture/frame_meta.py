@@ -0,0 +1,79 @@
+"""
+Per-frame metadata from Spinnaker chunk data.
+
+With chunk data enabled the camera stamps every frame with its own timestamp
+(ns, from the camera clock), a frame ID and the exposure time. The host time a
+frame reaches Python lags its exposure by a variable amount, so the camera
+timestamps are mapped onto host time with a fitted offset and drift, and gaps
+in the frame IDs show frames that never made it off the camera.
+"""
+
+import numpy as np
+
+FRAME_META_DTYPE = np.dtype([
+	('host_t','f8'), #time.time() when the frame was handed to Python
+	('device_ts','u8'), #camera timestamp (ns)
+	('frame_id','u8'),
+	('exposure_us','f4'),
+	('device_t','f8'), #device_ts mapped onto host time
+])
+
+def fit_clock(device_ts,host_t):
+	"""
+	Fits host_t ~ offset + scale*device_ts*1e-9. Host arrival times can only
+	be late, never early, so after a first least squares fit the line is refit
+	to the earliest-arriving fifth of the frames, and the offset is taken from
+	the lower envelope.
+
+	:return: offset (s), scale, and the drift of the camera clock in ppm.
+	:rtype: tuple
+	"""
+	dev_s = (np.asarray(device_ts,dtype=np.int64) - int(device_ts[0]))*1e-9
+	host_t = np.asarray(host_t,dtype=float)
+	if len(dev_s) < 2 or dev_s[-1] == 0:
+		scale = 1.0
+	else:
+		scale, icpt = np.polyfit(dev_s,host_t,1)
+		resid = host_t - (icpt + scale*dev_s)
+		early = resid <= np.percentile(resid,20)
+		if early.sum() >= 2:
+			scale = np.polyfit(dev_s[early],host_t[early],1)[0]
+	offset = np.min(host_t - scale*dev_s) - scale*int(device_ts[0])*1e-9
+	return offset, scale, (scale-1.0)*1e6
+
+def device_to_host(device_ts,offset,scale):
+	"""
+	Maps camera timestamps (ns) onto host time using a fit_clock result.
+	"""
+	return offset + scale*np.asarray(device_ts,dtype=float)*1e-9
+
+def find_gaps(frame_id,step=1):
+	"""
+	Finds frames the camera produced but that never arrived.
+
+	:param frame_id: Frame IDs of the frames received, in order.
+	:param step: Expected ID difference between consecutive frames (the decimation).
+	:return: Total number of missing frames, and the indices i where frames
+		went missing between frame i-1 and frame i.
+	:rtype: tuple
+	"""
+	d = np.diff(np.asarray(frame_id,dtype=np.int64))
+	missing = np.maximum(d-step,0)
+	return int(missing.sum()), np.flatnonzero(missing)+1
+
+def finish_meta(meta,step=1):
+	"""
+	Fills in device_t and summarises the clock fit and frame ID gaps for the
+	rows of meta that have a device timestamp.
+
+	:return: clock_offset, clock_scale, clock_drift_ppm, frames_dropped and gap_indices.
+	:rtype: dict
+	"""
+	valid = meta['device_ts'] > 0
+	if valid.sum() == 0:
+		return {'frames_dropped':0,'gap_indices':np.zeros(0,dtype=int)}
+	offset, scale, drift = fit_clock(meta['device_ts'][valid],meta['host_t'][valid])
+	meta['device_t'][valid] = device_to_host(meta['device_ts'][valid],offset,scale)
+	dropped, gaps = find_gaps(meta['frame_id'][valid],step)
+	return {'clock_offset':offset,'clock_scale':scale,'clock_drift_ppm':drift,
+		'frames_dropped':dropped,'gap_indices':np.flatnonzero(valid)[gaps]}
@@ -0,0 +1,76 @@
+"""
+A small pool of reusable frame buffers.
+
+Collects in the full_script loops are all the same shape, so rather than
+allocating (and zero filling) a multi-GB video for every collect, the camera
+takes a buffer from the pool and the caller hands it back once the data has
+been saved. Buffers are not cleared between uses.
+
+The pool only holds on to buffers that were handed back: one that is never
+released is freed as usual once the caller drops it.
+"""
+
+import threading
+import weakref
+
+import numpy as np
+
+class frame_pool:
+	def __init__(self,max_free=1):
+		"""
+		:param max_free: Number of released buffers of each shape/dtype kept for reuse.
+		:type max_free: int
+		"""
+		self.max_free = max_free;
+		self._free = {}; #(shape,dtype) -> list of free buffers
+		self._out = weakref.WeakValueDictionary(); #id(buffer) -> buffer, for everything handed out and still alive
+		self._lock = threading.Lock()
+		self.n_allocated = 0;
+		self.n_reused = 0;
+
+	def get(self,shape,dtype=np.uint8):
+		"""
+		Returns a buffer of the given shape and dtype, reusing a released one if
+		there is one. The contents are whatever was left in it.
+		"""
+		key = (tuple(shape),np.dtype(dtype))
+		with self._lock:
+			free = self._free.get(key)
+			if free:
+				buf = free.pop()
+				self.n_reused += 1
+			else:
+				buf = None
+		if buf is None:
+			buf = np.empty(key[0],dtype=key[1])
+			self.n_allocated += 1
+		with self._lock:
+			self._out[id(buf)] = buf
+		return buf
+
+	def release(self,arr):
+		"""
+		Gives a buffer back to the pool. Views (e.g. images[0::10]) are traced
+		back to the buffer they came from. Anything the pool didn't hand out is
+		ignored. The caller must not use the buffer (or views of it) afterwards.
+
+		:return: True if a pooled buffer was released.
+		:rtype: bool
+		"""
+		while isinstance(arr,np.ndarray) and arr.base is not None and id(arr) not in self._out:
+			arr = arr.base
+		with self._lock:
+			buf = self._out.pop(id(arr),None)
+			if buf is None:
+				return False
+			free = self._free.setdefault((buf.shape,buf.dtype),[])
+			if len(free) < self.max_free:
+				free.append(buf)
+		return True
+
+	def clear(self):
+		"""
+		Drops every free buffer. Buffers still handed out are unaffected.
+		"""
+		with self._lock:
+			self._free.clear()
@@ -0,0 +1,90 @@
+"""
+On-disk frame sinks for long collects.
+
+A sink takes frames one at a time as they come off the camera and writes them
+out in fixed-size chunks, so the memory held during a collect is one chunk no
+matter how long the collect runs. Chunks are plain .npy files, numbered in
+order, next to a frame_times.npy with the capture time of every frame.
+"""
+
+import os
+import glob
+from array import array
+
+import numpy as np
+
+class chunked_frame_sink:
+	def __init__(self,path,chunk_frames=300):
+		"""
+		:param path: Directory to write the chunks into. Created if missing.
+		:type path: str
+		:param chunk_frames: Number of frames held in memory before a chunk is written.
+		:type chunk_frames: int
+		"""
+		if chunk_frames < 1:
+			raise ValueError('chunk_frames must be at least 1')
+		self.path = path;
+		self.chunk_frames = int(chunk_frames);
+		os.makedirs(self.path,exist_ok=True)
+		self.n_frames = 0;
+		self.n_chunks = 0;
+		self._buf = None; #allocated on the first frame, once the shape and dtype are known
+		self._n_buf = 0;
+		self._times = array('d');
+		self.closed = False;
+
+	def write(self,frame,t=0.0):
+		"""
+		Copies one frame into the current chunk, writing the chunk out once it is full.
+		"""
+		if self.closed:
+			raise ValueError('write to a closed sink')
+		if self._buf is None:
+			self._buf = np.empty((self.chunk_frames,)+frame.shape,dtype=frame.dtype)
+		self._buf[self._n_buf] = frame
+		self._n_buf += 1
+		self._times.append(t)
+		self.n_frames += 1
+		if self._n_buf == self.chunk_frames:
+			self._write_chunk()
+
+	def _write_chunk(self):
+		if self._n_buf == 0:
+			return
+		np.save(os.path.join(self.path,'chunk_%06d.npy' % self.n_chunks),self._buf[:self._n_buf])
+		self.n_chunks += 1
+		self._n_buf = 0
+
+	def flush(self):
+		"""
+		Writes out any partially filled chunk and the frame times so far.
+		"""
+		self._write_chunk()
+		np.save(os.path.join(self.path,'frame_times.npy'),np.frombuffer(self._times,dtype=float))
+
+	def close(self):
+		if self.closed:
+			return
+		self.flush()
+		self._buf = None
+		self.closed = True
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+def load_frames(path,mmap=True):
+	"""
+	Reads back the frames written by a chunked_frame_sink.
+
+	:param path: Directory the sink wrote into.
+	:param mmap: Memory-map the chunks instead of reading them into memory.
+	:return: A list of per-chunk frame arrays and the array of frame times.
+	:rtype: tuple
+	"""
+	chunk_files = sorted(glob.glob(os.path.join(path,'chunk_*.npy')))
+	chunks = [np.load(f,mmap_mode='r' if mmap else None) for f in chunk_files]
+	times = np.load(os.path.join(path,'frame_times.npy'))
+	return chunks, times
@@ -0,0 +1,192 @@
+"""
+Several Blackflys acquiring together.
+
+multi_camera opens cameras from one shared Spinnaker System and configures
+them alike. Each blackfly_camera runs its acquisitions on its own worker
+thread, so acquire_images grabs from every camera at once, and all of them
+wait for the same start_time (or the same hardware trigger, with
+configure_trigger and sync.trigger_start). Adding a camera adds a grab thread
+rather than slowing the others down.
+
+The cameras aren't exposure-locked unless they share a trigger, so
+align_frames pairs up their frames by time into frame sets.
+"""
+
+import time
+
+import numpy as np
+
+from LCpy.ez_thread import gather, wait_async
+from LCpy.QuickCapture import Quick_capture
+from LCpy.QuickCapture.Quick_capture import blackfly_camera, acquire_system, release_system
+
+def align_frames(times,tolerance=None,reference=0):
+	"""
+	Groups frames from several cameras into time-aligned sets: for every frame
+	of the reference camera, the nearest-in-time frame of each other camera.
+
+	:param times: One array of capture times per camera.
+	:param tolerance: Largest allowed distance (s) from the reference frame;
+		sets with any camera further off are dropped. Defaults to half the
+		reference camera's median frame interval.
+	:param reference: Index of the camera whose frames define the sets.
+	:return: index, an (n_sets,n_cams) array of frame indices into each
+		camera's video; t, the mean time of each set; and spread, the largest
+		time difference within each set.
+	:rtype: dict
+	"""
+	times = [np.asarray(t,dtype=float) for t in times]
+	ref = times[reference]
+	if tolerance is None:
+		tolerance = 0.5*np.median(np.diff(ref)) if len(ref) > 1 else np.inf
+	index = np.empty((len(ref),len(times)),dtype=np.int64)
+	for c, t in enumerate(times):
+		if len(t) == 0:
+			index = index[:0]
+			break
+		right = np.clip(np.searchsorted(t,ref),1,len(t)-1) if len(t) > 1 else np.zeros(len(ref),dtype=np.int64)
+		left = np.maximum(right-1,0)
+		index[:,c] = np.where(np.abs(t[left]-ref) <= np.abs(t[right]-ref),left,right)
+	set_t = np.stack([times[c][index[:,c]] for c in range(len(times))],axis=1) if len(index) else np.zeros((0,len(times)))
+	keep = np.all(np.abs(set_t-set_t[:,[reference]]) <= tolerance,axis=1)
+	index, set_t = index[keep], set_t[keep]
+	return {'index':index,'t':set_t.mean(axis=1),'spread':np.ptp(set_t,axis=1) if len(set_t) else np.zeros(0)}
+
+class _all_armed:
+	# Looks like one threading.Event over every camera's armed event
+	def __init__(self,cams):
+		self.cams = cams;
+
+	def clear(self):
+		for cam in self.cams:
+			cam.armed.clear()
+
+	def is_set(self):
+		return all(cam.armed.is_set() for cam in self.cams)
+
+	def wait(self,timeout=None):
+		deadline = None if timeout is None else time.time()+timeout
+		for cam in self.cams:
+			if not cam.armed.wait(None if deadline is None else max(deadline-time.time(),0)):
+				return False
+		return True
+
+class multi_camera:
+	def __init__(self,cam_nums=None,serials=None,backend=None,verbose=False,**cam_args):
+		"""
+		:param cam_nums: Indices of the cameras to open (default: every camera found).
+		:param serials: Serial numbers to open instead of cam_nums.
+		:param backend: Stand-in for PySpin, as for blackfly_camera.
+		:param cam_args: Passed to every blackfly_camera (wh, offset, framerate, ...).
+		"""
+		self.verbose = verbose;
+		if serials is None and cam_nums is None:
+			spin = Quick_capture.PySpin if backend is None else backend
+			if spin is None:
+				raise ImportError('PySpin is not installed; pass backend=sim_spin() to run without a camera')
+			system = acquire_system(spin)
+			try:
+				cam_list = system.GetCameras()
+				cam_nums = list(range(cam_list.GetSize()))
+				cam_list.Clear()
+			finally:
+				release_system(spin)
+		self.cams = []
+		try:
+			if not serials is None:
+				for serial in serials:
+					self.cams.append(blackfly_camera(verbose=verbose,serial=serial,backend=backend,**cam_args))
+			else:
+				for cam_num in cam_nums:
+					self.cams.append(blackfly_camera(verbose=verbose,cam_num=cam_num,backend=backend,**cam_args))
+		except Exception:
+			self.close()
+			raise
+		if not self.cams:
+			raise RuntimeError('No cameras found!')
+		self.armed = _all_armed(self.cams)
+		self.last_alignment = None;
+
+	def __len__(self):
+		return len(self.cams)
+
+	def __getitem__(self,i):
+		return self.cams[i]
+
+	@property
+	def start_time(self):
+		return self.cams[0].start_time
+
+	@start_time.setter
+	def start_time(self,start_time):
+		for cam in self.cams:
+			cam.start_time = start_time;
+
+	@property
+	def triggered(self):
+		return all(cam.triggered for cam in self.cams)
+
+	def configure_trigger(self,**trigger_args):
+		"""
+		blackfly_camera.configure_trigger on every camera; wire them all to the same line.
+		"""
+		return all([cam.configure_trigger(**trigger_args) for cam in self.cams])
+
+	def trigger_off(self):
+		return all([cam.trigger_off() for cam in self.cams])
+
+	def configure_chunk_data(self,enable=True):
+		return all([cam.configure_chunk_data(enable) for cam in self.cams])
+
+	def get_framerate(self):
+		return min(cam.get_framerate() for cam in self.cams)
+
+	def acquire_images(self,**acquire_args):
+		"""
+		Starts acquire_images on every camera at once, each on its own thread.
+		They all wait for start_time (set it first, or leave it 0 to start now)
+		or, when triggered, for the trigger.
+
+		:return: One future for the list of every camera's result; cancelling
+			it stops them all.
+		"""
+		return gather([cam.acquire_images(**acquire_args) for cam in self.cams])
+
+	async def acquire_images_async(self,timeout=None,**acquire_args):
+		return await wait_async(self.acquire_images(**acquire_args),timeout)
+
+	def acquire_aligned(self,num_frames,tolerance=None,start_delay=0.5,**acquire_args):
+		"""
+		Acquires from every camera with a shared start and pairs the frames up
+		with align_frames.
+
+		:param start_delay: Seconds from now to the shared start (ignored when triggered).
+		:return: The list of every camera's acquire_images result and the alignment
+			(also kept in last_alignment). Pass the results to release_frames
+			once they're saved to reuse the videos' buffers in the next call.
+		:rtype: tuple
+		"""
+		if not self.triggered:
+			self.start_time = time.time()+start_delay;
+		results = self.acquire_images(num_frames=num_frames,**acquire_args).result()
+		self.last_alignment = align_frames([r[1] for r in results],tolerance)
+		return results, self.last_alignment
+
+	def frame_set(self,results,k,alignment=None):
+		"""
+		The k-th aligned frame set, as a list with one frame per camera.
+		"""
+		alignment = self.last_alignment if alignment is None else alignment
+		return [results[c][0][alignment['index'][k,c]] for c in range(len(self.cams))]
+
+	def release_frames(self,results):
+		"""
+		Hands every camera's video from acquire_images back to its pool.
+		"""
+		for cam, result in zip(self.cams,results):
+			cam.release_frames(result[0])
+
+	def close(self):
+		for cam in self.cams:
+			cam.close()
+		self.cams = []
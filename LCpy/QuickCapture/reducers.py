@@ -0,0 +1,200 @@
+"""
+Per-frame reductions, so a collect doesn't have to keep its raw video.
+
+Often only a few numbers per frame are used downstream: the mean intensity,
+the intensity in some regions of the cell, a histogram. A reducer turns every
+frame into those numbers as it is grabbed and keeps them as a time series, so
+a 300 s collect shrinks from gigabytes of frames to kilobytes. Pass reducers
+to blackfly_camera.acquire_images (with keep_frames=False to skip the video
+altogether), or use them as acquisition_engine stages with acquire_stream.
+
+Every reducer has process(frame,t,i), like any other stage, and result(),
+which returns (values, times) like acquisition_engine.reducer_stage. Their
+storage is preallocated and grows by doubling, so process() doesn't allocate.
+"""
+
+import numpy as np
+
+class frame_reducer:
+	# Subclasses set name and width and fill out[:] in reduce(frame,out)
+	name = 'values';
+	width = 1;
+	dtype = np.float64;
+
+	def __init__(self,capacity=1024):
+		"""
+		:param capacity: Frames to allocate room for up front; grows as needed.
+		"""
+		self._values = np.zeros((int(capacity),self.width),dtype=self.dtype)
+		self._times = np.zeros(int(capacity))
+		self.n = 0;
+
+	def reserve(self,n):
+		"""
+		Makes room for n frames, e.g. the number of frames about to be acquired.
+		"""
+		if n > len(self._times):
+			values = np.zeros((int(n),self.width),dtype=self.dtype)
+			values[:self.n] = self._values[:self.n]
+			times = np.zeros(int(n))
+			times[:self.n] = self._times[:self.n]
+			self._values, self._times = values, times
+
+	def process(self,frame,t,i):
+		if self.n == len(self._times):
+			self.reserve(2*max(self.n,1))
+		self.reduce(frame,self._values[self.n])
+		self._times[self.n] = t
+		self.n += 1
+
+	def result(self):
+		"""
+		:return: The per-frame values, shape (n_frames,width) (or (n_frames,)
+			for a width of 1), and their capture times.
+		:rtype: tuple
+		"""
+		values = self._values[:self.n]
+		if self.width == 1:
+			values = values[:,0]
+		return values, self._times[:self.n]
+
+	def reset(self):
+		self.n = 0;
+
+class mean_reducer(frame_reducer):
+	name = 'frame_mean';
+
+	def reduce(self,frame,out):
+		out[0] = frame.mean(dtype=np.float64)
+
+class roi_reducer(frame_reducer):
+	name = 'roi_mean';
+
+	def __init__(self,rois,capacity=1024,name=None):
+		"""
+		Mean intensity in each of several rectangles, from an integral image
+		taken only on the grid of the rectangles' edges: np.add.reduceat sums
+		the frame into the cells between the edges in one pass over the
+		bounding box of the ROIs, and every rectangle's sum is then four
+		lookups into the cumulative sum of that small grid. Many ROIs cost
+		little more than one, and about as much as a frame mean.
+
+		:param rois: Rectangles as [[x, y, width, height], ...] in frame pixels.
+		:param name: Key for the results, default 'roi_mean'.
+		"""
+		rois = np.atleast_2d(np.asarray(rois,dtype=np.int64))
+		if rois.shape[1] != 4 or np.any(rois[:,2:] <= 0) or np.any(rois[:,:2] < 0):
+			raise ValueError('rois must be [[x, y, width, height], ...] with positive sizes')
+		self.rois = rois;
+		self.width = len(rois);
+		if not name is None:
+			self.name = name;
+		x0, y0 = rois[:,0], rois[:,1]
+		x1, y1 = x0+rois[:,2], y0+rois[:,3]
+		self._cols = np.unique(np.concatenate([x0,x1]))
+		self._rows = np.unique(np.concatenate([y0,y1]))
+		# Cell boundaries relative to the bounding box, for reduceat (which
+		# takes the start of every cell, so the last edge is left off)
+		self._col_starts = self._cols[:-1]-self._cols[0]
+		self._row_starts = self._rows[:-1]-self._rows[0]
+		# Corners of each ROI on the grid of edges
+		self._corners = (np.searchsorted(self._rows,y0),np.searchsorted(self._cols,x0),
+			np.searchsorted(self._rows,y1),np.searchsorted(self._cols,x1))
+		self._area = (rois[:,2]*rois[:,3]).astype(np.float64)
+		self._integral = np.zeros((len(self._rows),len(self._cols)),dtype=np.int64)
+		frame_reducer.__init__(self,capacity)
+
+	def reduce(self,frame,out):
+		if frame.shape[0] < self._rows[-1] or frame.shape[1] < self._cols[-1]:
+			raise ValueError('ROIs reach (%d, %d), outside the %dx%d frame' % (self._cols[-1],self._rows[-1],frame.shape[1],frame.shape[0]))
+		box = frame[self._rows[0]:self._rows[-1],self._cols[0]:self._cols[-1]]
+		cells = np.add.reduceat(np.add.reduceat(box,self._col_starts,axis=1,dtype=np.int64),self._row_starts,axis=0)
+		ii = self._integral
+		np.cumsum(cells,axis=0,out=ii[1:,1:])
+		np.cumsum(ii[1:,1:],axis=1,out=ii[1:,1:])
+		i0, j0, i1, j1 = self._corners
+		out[:] = (ii[i1,j1]-ii[i0,j1]-ii[i1,j0]+ii[i0,j0])/self._area
+
+class histogram_reducer(frame_reducer):
+	name = 'frame_hist';
+	dtype = np.uint32;
+
+	def __init__(self,bins=64,max_value=None,capacity=1024,per_frame=True):
+		"""
+		Intensity histogram of every frame, in bins equal-width bins from 0 to
+		max_value, counted with np.bincount.
+
+		:param max_value: Largest pixel value, e.g. 255 for Mono8 or 4095 for
+			Mono12; defaults to the largest value of the frame dtype.
+		:param per_frame: Keep a histogram per frame; otherwise only their sum
+			(in total) is kept, in a single (bins,) accumulator.
+		"""
+		self.bins = int(bins);
+		self.width = self.bins;
+		self.max_value = max_value;
+		self.per_frame = per_frame;
+		self.total = np.zeros(self.bins,dtype=np.uint64)
+		if per_frame:
+			frame_reducer.__init__(self,capacity)
+		else:
+			self._counts = np.zeros(self.bins,dtype=self.dtype) #the current frame's
+			self.n = 0;
+
+	def _levels(self,frame):
+		if self.max_value is None:
+			self.max_value = np.iinfo(frame.dtype).max if frame.dtype.kind in 'ui' else 1.0
+		levels = int(self.max_value)+1
+		if frame.dtype.kind in 'ui' and levels % self.bins == 0 and (levels//self.bins) & (levels//self.bins-1) == 0:
+			shift = (levels//self.bins).bit_length()-1
+			return (frame >> shift if shift else frame).ravel()
+		return np.clip((frame.astype(np.float64)*(self.bins/(float(self.max_value)+1))).astype(np.int64),0,self.bins-1).ravel()
+
+	def reduce(self,frame,out):
+		out[:] = np.bincount(self._levels(frame),minlength=self.bins)[:self.bins]
+		self.total += out
+
+	def reserve(self,n):
+		if self.per_frame:
+			frame_reducer.reserve(self,n)
+
+	def process(self,frame,t,i):
+		if self.per_frame:
+			return frame_reducer.process(self,frame,t,i)
+		self.reduce(frame,self._counts)
+		self.n += 1
+
+	def result(self):
+		if self.per_frame:
+			return frame_reducer.result(self)
+		return self.total, np.zeros(0)
+
+	def reset(self):
+		frame_reducer.reset(self)
+		self.total[:] = 0
+
+def build_reducers(mean=False,rois=None,histogram_bins=None,max_value=None):
+	"""
+	The usual set of reducers, e.g. from a run spec's 'reductions' entry.
+
+	:param mean: Add a mean_reducer.
+	:param rois: Add a roi_reducer for these [[x, y, width, height], ...].
+	:param histogram_bins: Add a histogram_reducer with this many bins.
+	:param max_value: Largest pixel value, for the histogram.
+	:rtype: list
+	"""
+	reducers = []
+	if mean:
+		reducers.append(mean_reducer())
+	if not rois is None and len(rois):
+		reducers.append(roi_reducer(rois))
+	if histogram_bins:
+		reducers.append(histogram_reducer(histogram_bins,max_value))
+	return reducers
+
+def reductions(reducers):
+	"""
+	Every reducer's values, keyed by its name, e.g. for saving with a collect.
+
+	:rtype: dict
+	"""
+	return {reducer.name: reducer.result()[0] for reducer in reducers}
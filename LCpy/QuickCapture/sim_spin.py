@@ -0,0 +1,569 @@
+"""
+A simulated PySpin, for running blackfly_camera without a camera.
+
+sim_spin stands in for the PySpin module: pass one as the backend of a
+blackfly_camera and the camera code runs unchanged against simulated cameras,
+
+	cam = blackfly_camera(backend=sim_spin(framerate=200))
+
+The simulated cameras have the QuickSpin nodes the package uses (image format
+with increments and limits, binning/decimation, frame rate, exposure, trigger
+and chunk data), deliver frames at the configured rate through a stream
+buffer of buffer_count frames (frames arriving while it is full are dropped,
+as with Spinnaker's default OldestFirst handling), and can randomly lose or
+deliver incomplete frames. With speed=None frames are ready as fast as they
+are asked for, for measuring the throughput of the acquisition code itself.
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+EVENT_TIMEOUT_INFINITE = 0xFFFFFFFFFFFFFFFF
+
+class SpinnakerException(Exception):
+	def __init__(self,message,errorcode=-1001):
+		Exception.__init__(self,message)
+		self.message = message;
+		self.errorcode = errorcode;
+
+# Access modes, numbered as in Spinnaker
+NI, NA, WO, RO, RW = 0, 1, 2, 3, 4
+
+ENUMS = {
+	'AcquisitionMode':('Continuous','SingleFrame','MultiFrame'),
+	'PixelFormat':('Mono8','Mono12p','Mono16'),
+	'ExposureAuto':('Off','Once','Continuous'),
+	'TriggerMode':('Off','On'),
+	'TriggerSelector':('AcquisitionStart','FrameStart'),
+	'TriggerSource':('Software','Line0','Line1','Line2','Line3'),
+	'TriggerActivation':('RisingEdge','FallingEdge'),
+	'ChunkSelector':('Image','FrameID','Timestamp','ExposureTime','Gain'),
+	'BinningSelector':('All','Sensor','ISP'),
+	'BinningHorizontalMode':('Sum','Average'),
+	'BinningVerticalMode':('Sum','Average'),
+	'DecimationSelector':('All','Sensor'),
+}
+
+class sim_entry:
+	def __init__(self,symbolic,value):
+		self.symbolic = symbolic;
+		self.value = value;
+
+	def GetSymbolic(self):
+		return self.symbolic
+
+	def GetValue(self):
+		return self.value
+
+class sim_node:
+	def __init__(self,cam,name,value,min=None,max=None,inc=None,access=RW,streaming_access=None,on_set=None):
+		"""
+		One QuickSpin node. min, max and inc may be callables so that limits can
+		follow other nodes (e.g. Width's max follows binning).
+
+		:param streaming_access: Access mode while the camera is streaming, if different.
+		:param on_set: Called with the camera after a successful SetValue.
+		"""
+		self.cam = cam;
+		self.name = name;
+		self.value = value;
+		self._min = min;
+		self._max = max;
+		self._inc = inc;
+		self.access = access;
+		self.streaming_access = streaming_access;
+		self.on_set = on_set;
+
+	def _limit(self,limit):
+		return limit() if callable(limit) else limit
+
+	def GetAccessMode(self):
+		if self.cam.streaming and not self.streaming_access is None:
+			return self.streaming_access
+		return self.access
+
+	def GetValue(self):
+		if self.GetAccessMode() not in (RO,RW):
+			raise SpinnakerException('%s is not readable' % self.name,-1006)
+		return self.value
+
+	def GetMin(self):
+		return self._limit(self._min)
+
+	def GetMax(self):
+		return self._limit(self._max)
+
+	def GetInc(self):
+		inc = self._limit(self._inc)
+		return 0 if inc is None else inc
+
+	def HasInc(self):
+		return not self._inc is None
+
+	def _check(self,value):
+		lo, hi = self.GetMin(), self.GetMax()
+		if (not lo is None and value < lo) or (not hi is None and value > hi):
+			raise SpinnakerException('%s = %s is out of range [%s, %s]' % (self.name,value,lo,hi),-1005)
+		inc = self._limit(self._inc)
+		if inc and (value-(lo or 0)) % inc:
+			raise SpinnakerException('%s = %s is not a multiple of its increment %s' % (self.name,value,inc),-1005)
+
+	def SetValue(self,value,verify=True):
+		if self.GetAccessMode() not in (WO,RW):
+			raise SpinnakerException('%s is not writable' % self.name,-1006)
+		self._check(value)
+		self.value = value;
+		if not self.on_set is None:
+			self.on_set(self.cam)
+
+	def ToString(self):
+		return str(self.value)
+
+class sim_enum_node(sim_node):
+	def __init__(self,cam,name,spin,value,**kwargs):
+		self.spin = spin;
+		sim_node.__init__(self,cam,name,spin.enum_value(name,value),**kwargs)
+
+	def _check(self,value):
+		if not value in self.spin.enum_names[self.name]:
+			raise SpinnakerException('%s has no entry %s' % (self.name,value),-1005)
+
+	def GetCurrentEntry(self):
+		return sim_entry(self.spin.enum_names[self.name][self.value],self.value)
+
+	def GetEntryByName(self,symbolic):
+		return sim_entry(symbolic,self.spin.enum_value(self.name,symbolic))
+
+	def symbolic(self):
+		return self.spin.enum_names[self.name][self.value]
+
+	def ToString(self):
+		return self.symbolic()
+
+class sim_chunk_data:
+	def __init__(self,timestamp,frame_id,exposure):
+		self.timestamp = timestamp;
+		self.frame_id = frame_id;
+		self.exposure = exposure;
+
+	def GetTimestamp(self):
+		return self.timestamp
+
+	def GetFrameID(self):
+		return self.frame_id
+
+	def GetExposureTime(self):
+		return self.exposure
+
+class sim_image:
+	def __init__(self,cam,data,frame_id,timestamp,incomplete):
+		self.cam = cam;
+		self.data = data;
+		self.frame_id = frame_id;
+		self.timestamp = timestamp;
+		self.incomplete = incomplete;
+		self.released = False;
+
+	def IsIncomplete(self):
+		return self.incomplete
+
+	def GetImageStatus(self):
+		return 3 if self.incomplete else 0 #3 = missing packets
+
+	def GetWidth(self):
+		return self.data.shape[1]
+
+	def GetHeight(self):
+		return self.data.shape[0]
+
+	def GetFrameID(self):
+		return self.frame_id
+
+	def GetTimeStamp(self):
+		return self.timestamp
+
+	def GetNDArray(self):
+		if self.released:
+			raise SpinnakerException('Image has been released',-1002)
+		return self.data
+
+	def GetChunkData(self):
+		if not self.cam.node('ChunkModeActive').value:
+			raise SpinnakerException('Chunk mode is not active',-1010)
+		return sim_chunk_data(self.timestamp,self.frame_id,self.cam.node('ExposureTime').value)
+
+	def Convert(self,pixel_format,*args):
+		data = self.data
+		if data.dtype != np.uint8:
+			data = (data >> (8*data.dtype.itemsize-8)).astype(np.uint8)
+		return sim_image(self.cam,data,self.frame_id,self.timestamp,self.incomplete)
+
+	def Save(self,filename):
+		# Written as a binary PGM whatever the extension
+		with open(filename,'wb') as f:
+			f.write(b'P5\n%d %d\n255\n' % (self.data.shape[1],self.data.shape[0]))
+			f.write(np.ascontiguousarray(self.data,dtype=np.uint8).tobytes())
+
+	def Release(self):
+		if self.released:
+			raise SpinnakerException('Image has already been released',-1002)
+		self.released = True;
+		self.cam.n_outstanding -= 1
+
+class sim_node_holder:
+	pass
+
+class sim_camera:
+	def __init__(self,spin,index):
+		"""
+		One simulated camera. Its nodes are attributes, as in QuickSpin.
+		"""
+		self.spin = spin;
+		self.index = index;
+		self.initialised = False;
+		self.streaming = False;
+		self.n_outstanding = 0;
+		self.stats = {};
+		self._lock = threading.Lock()
+		sw, sh = spin.sensor_wh
+		enum = lambda name, value, **kw: sim_enum_node(self,name,spin,value,**kw)
+		fmt = {'streaming_access':RO}
+		nodes = [
+			sim_node(self,'SensorWidth',sw,access=RO),
+			sim_node(self,'SensorHeight',sh,access=RO),
+			sim_node(self,'WidthMax',sw,access=RO),
+			sim_node(self,'HeightMax',sh,access=RO),
+			sim_node(self,'Width',sw,min=16,max=lambda: self._max_w()-self.OffsetX.value,inc=16,**fmt),
+			sim_node(self,'Height',sh,min=8,max=lambda: self._max_h()-self.OffsetY.value,inc=2,**fmt),
+			sim_node(self,'OffsetX',0,min=0,max=lambda: self._max_w()-self.Width.value,inc=4,**fmt),
+			sim_node(self,'OffsetY',0,min=0,max=lambda: self._max_h()-self.Height.value,inc=2,**fmt),
+			enum('PixelFormat','Mono8',**fmt),
+			enum('AcquisitionMode','Continuous',**fmt),
+			sim_node(self,'BinningHorizontal',1,min=1,max=4,inc=1,on_set=sim_camera._fit_roi,**fmt),
+			sim_node(self,'BinningVertical',1,min=1,max=4,inc=1,on_set=sim_camera._fit_roi,**fmt),
+			enum('BinningSelector','All'),
+			enum('BinningHorizontalMode','Sum'),
+			enum('BinningVerticalMode','Sum'),
+			sim_node(self,'DecimationHorizontal',1,min=1,max=4,inc=1,on_set=sim_camera._fit_roi,**fmt),
+			sim_node(self,'DecimationVertical',1,min=1,max=4,inc=1,on_set=sim_camera._fit_roi,**fmt),
+			enum('DecimationSelector','All'),
+			sim_node(self,'AcquisitionFrameRateEnable',spin.framerate_enable),
+			sim_node(self,'AcquisitionFrameRate',float(spin.framerate),min=1.0,max=self._max_rate,
+				access=RW if spin.framerate_enable else RO),
+			sim_node(self,'AcquisitionResultingFrameRate',0.0,access=RO),
+			enum('ExposureAuto','Continuous'),
+			sim_node(self,'ExposureTime',5000.0,min=10.0,max=lambda: 1e6/self._rate()-5.0,
+				access=RO),
+			sim_node(self,'Gain',0.0,min=0.0,max=47.0),
+			enum('TriggerMode','Off'),
+			enum('TriggerSelector','AcquisitionStart',access=RW),
+			enum('TriggerSource','Software'),
+			enum('TriggerActivation','RisingEdge'),
+			sim_node(self,'ChunkModeActive',False),
+			enum('ChunkSelector','Image'),
+			sim_node(self,'ChunkEnable',True),
+			sim_node(self,'DeviceLinkThroughputLimit',int(spin.link_Bps),min=int(1e6),max=int(spin.link_Bps),access=RO),
+		]
+		self._nodes = {}
+		for node in nodes:
+			self._nodes[node.name] = node;
+			setattr(self,node.name,node)
+		self.AcquisitionFrameRateEnable.on_set = sim_camera._rate_enable_changed
+		self.ExposureAuto.on_set = sim_camera._exposure_auto_changed
+		self.TLDevice = sim_node_holder()
+		self.TLDevice.DeviceSerialNumber = sim_node(self,'DeviceSerialNumber','SIM%05d' % index,access=RO)
+		self.TLDevice.DeviceModelName = sim_node(self,'DeviceModelName','Simulated Blackfly S',access=RO)
+		self._patterns = None;
+
+	def node(self,name):
+		return self._nodes[name]
+
+	def _max_w(self):
+		return self.spin.sensor_wh[0]//(self.BinningHorizontal.value*self.DecimationHorizontal.value)
+
+	def _max_h(self):
+		return self.spin.sensor_wh[1]//(self.BinningVertical.value*self.DecimationVertical.value)
+
+	def _fit_roi(self):
+		# Binning/decimation shrink the image; keep the ROI inside it
+		self.WidthMax.value = self._max_w()
+		self.HeightMax.value = self._max_h()
+		self.OffsetX.value = min(self.OffsetX.value,self._max_w()-16)//4*4
+		self.OffsetY.value = min(self.OffsetY.value,self._max_h()-8)//2*2
+		self.Width.value = min(self.Width.value,self._max_w()-self.OffsetX.value)//16*16
+		self.Height.value = min(self.Height.value,self._max_h()-self.OffsetY.value)//2*2
+
+	def _rate_enable_changed(self):
+		self.AcquisitionFrameRate.access = RW if self.AcquisitionFrameRateEnable.value else RO
+
+	def _exposure_auto_changed(self):
+		self.ExposureTime.access = RW if self.ExposureAuto.symbolic() == 'Off' else RO
+
+	def _bytes_per_pixel(self):
+		return 1 if self.PixelFormat.symbolic() == 'Mono8' else (1.5 if self.PixelFormat.symbolic() == 'Mono12p' else 2)
+
+	def _max_rate(self):
+		# Limited by the link and the sensor readout, which only reads the rows it has to
+		link = self.spin.link_Bps/(self.Width.value*self.Height.value*self._bytes_per_pixel())
+		readout = self.spin.max_framerate*self.spin.sensor_wh[1]/(self.Height.value*self.BinningVertical.value*self.DecimationVertical.value)
+		return float(min(link,readout))
+
+	def _rate(self):
+		if self.AcquisitionFrameRateEnable.value:
+			return min(self.AcquisitionFrameRate.value,self._max_rate())
+		return self._max_rate()
+
+	def Init(self):
+		self.initialised = True;
+
+	def DeInit(self):
+		if self.streaming:
+			self.EndAcquisition()
+		self.initialised = False;
+
+	def IsInitialized(self):
+		return self.initialised
+
+	def IsStreaming(self):
+		return self.streaming
+
+	def GetTLDeviceNodeMap(self):
+		return self.spin.nodemap
+
+	def _make_patterns(self):
+		h, w = self.Height.value, self.Width.value
+		dtype = np.uint8 if self.PixelFormat.symbolic() == 'Mono8' else np.uint16
+		top = np.iinfo(dtype).max
+		rng = np.random.default_rng(self.spin.seed)
+		ramp = np.add.outer(np.arange(h),np.arange(w)) * (top/(h+w))
+		noise = rng.integers(0,max(int(top*0.05),1),(h,w))
+		patterns = np.empty((self.spin.n_patterns,h,w),dtype=dtype)
+		for k in range(self.spin.n_patterns):
+			patterns[k] = ramp*(0.45+0.45*np.cos(2*np.pi*k/self.spin.n_patterns)) + np.roll(noise,37*k,axis=1)
+		patterns.flags.writeable = False
+		return patterns
+
+	def BeginAcquisition(self):
+		if not self.initialised:
+			raise SpinnakerException('Camera is not initialised',-1002)
+		if self.streaming:
+			raise SpinnakerException('Camera is already streaming',-1002)
+		key = (self.Height.value,self.Width.value,self.PixelFormat.value)
+		if self._patterns is None or self._patterns_key != key:
+			self._patterns = self._make_patterns()
+			self._patterns_key = key;
+		self.AcquisitionResultingFrameRate.value = self._rate()
+		self._period = 1.0/self._rate()
+		self._armed_at = time.time()
+		self._t0 = None;
+		self._queue = collections.deque()
+		self._n_arrived = 0;
+		self.stats = {'frames_produced':0,'frames_dropped_buffer':0,'frames_dropped_link':0,'frames_incomplete':0}
+		self.streaming = True;
+		if self.TriggerMode.symbolic() == 'Off':
+			self._start(time.time())
+
+	def EndAcquisition(self):
+		if not self.streaming:
+			raise SpinnakerException('Camera is not streaming',-1002)
+		self.streaming = False;
+		self._queue = None;
+
+	def _start(self,t0):
+		self._t0 = t0;
+		self._device_t0 = int(self.spin.rng.integers(1e9,1e12))
+
+	def _trigger_time(self):
+		line = self.spin.lines.get(self.TriggerSource.symbolic())
+		if line is None or line.fire_time is None or line.fire_time < self._armed_at:
+			return None
+		return line.fire_time + self.spin.trigger_latency
+
+	def _arrive(self,now):
+		"""
+		Moves the frames that have been exposed by now into the stream buffer,
+		dropping those that find it full or are lost on the link.
+		"""
+		speed = self.spin.speed
+		if speed is None:
+			# As fast as they are asked for: keep one frame waiting
+			n = self._n_arrived+1 if not self._queue else self._n_arrived
+		else:
+			n = int((now-self._t0)*speed/self._period)+1
+		arrivals = n-self._n_arrived
+		if arrivals <= 0:
+			return
+		space = self.spin.buffer_count-len(self._queue)
+		accept = min(space,arrivals)
+		rng = self.spin.rng
+		for frame_id in range(self._n_arrived,self._n_arrived+accept):
+			if self.spin.drop_prob and rng.random() < self.spin.drop_prob:
+				self.stats['frames_dropped_link'] += 1
+				continue
+			self._queue.append(frame_id)
+		self.stats['frames_dropped_buffer'] += arrivals-accept
+		self.stats['frames_produced'] += arrivals
+		self._n_arrived = n;
+
+	def GetNextImage(self,timeout=EVENT_TIMEOUT_INFINITE):
+		if not self.streaming:
+			raise SpinnakerException('Camera is not streaming',-1002)
+		if self.n_outstanding >= self.spin.buffer_count:
+			raise SpinnakerException('All stream buffers are held; release some images',-1012)
+		deadline = None if timeout == EVENT_TIMEOUT_INFINITE else time.time()+timeout/1000.0
+		while self._t0 is None:
+			t0 = self._trigger_time()
+			if not t0 is None:
+				self._start(t0)
+				break
+			if not deadline is None and time.time() > deadline:
+				raise SpinnakerException('Failed waiting for EventData on NEW_BUFFER_DATA event.',-1011)
+			time.sleep(0.0005)
+		with self._lock:
+			while True:
+				now = time.time()
+				if now >= self._t0:
+					self._arrive(now)
+				if self._queue:
+					frame_id = self._queue.popleft()
+					break
+				if self.spin.speed is None:
+					continue
+				next_t = self._t0+self._n_arrived*self._period/self.spin.speed
+				if not deadline is None and next_t > deadline:
+					time.sleep(max(deadline-now,0))
+					raise SpinnakerException('Failed waiting for EventData on NEW_BUFFER_DATA event.',-1011)
+				time.sleep(max(next_t-now,0))
+		incomplete = bool(self.spin.incomplete_prob) and self.spin.rng.random() < self.spin.incomplete_prob
+		self.stats['frames_incomplete'] += incomplete
+		scale = 1.0+self.spin.clock_drift_ppm*1e-6
+		timestamp = self._device_t0+int(frame_id*self._period*1e9*scale)
+		self.n_outstanding += 1
+		return sim_image(self,self._patterns[frame_id % len(self._patterns)],frame_id,timestamp,incomplete)
+
+class sim_camera_list:
+	def __init__(self,cams):
+		self.cams = list(cams);
+
+	def GetSize(self):
+		return len(self.cams)
+
+	def __len__(self):
+		return len(self.cams)
+
+	def __getitem__(self,i):
+		return self.cams[i]
+
+	def __iter__(self):
+		return iter(self.cams)
+
+	def GetByIndex(self,i):
+		return self.cams[i]
+
+	def GetBySerial(self,serial):
+		for cam in self.cams:
+			if cam.TLDevice.DeviceSerialNumber.value == serial:
+				return cam
+		raise SpinnakerException('No camera with serial %s' % serial,-1015)
+
+	def Clear(self):
+		self.cams = [];
+
+class sim_system:
+	def __init__(self,spin):
+		self.spin = spin;
+		self.refs = 0;
+		self.cameras = [sim_camera(spin,i) for i in range(spin.n_cameras)]
+
+	def GetInstance(self):
+		self.refs += 1
+		return self
+
+	def GetCameras(self):
+		return sim_camera_list(self.cameras)
+
+	def IsInUse(self):
+		return self.refs > 0
+
+	def ReleaseInstance(self):
+		if self.refs <= 0:
+			raise SpinnakerException('System has already been released',-1002)
+		self.refs -= 1
+		if self.refs == 0 and any(cam.initialised for cam in self.cameras):
+			raise SpinnakerException("Can't release the system while cameras are still initialised",-1004)
+
+class sim_nodemap:
+	def GetNode(self,name):
+		return None
+
+class sim_spin:
+	def __init__(self,n_cameras=1,framerate=30.0,sensor_wh=(1440,1080),max_framerate=226.0,
+	link_Bps=380e6,framerate_enable=True,buffer_count=10,drop_prob=0.0,incomplete_prob=0.0,
+	clock_drift_ppm=0.0,speed=1.0,lines=None,trigger_latency=0.0005,n_patterns=8,seed=None):
+		"""
+		:param n_cameras: Number of cameras the System finds.
+		:param framerate: Starting AcquisitionFrameRate (Hz).
+		:param sensor_wh: Sensor size (width,height).
+		:param max_framerate: Full-sensor readout limit (Hz); smaller ROIs read out faster.
+		:param link_Bps: USB/GigE throughput limit (bytes/s).
+		:param framerate_enable: Starting value of AcquisitionFrameRateEnable.
+		:param buffer_count: Stream buffers between the camera and the host.
+		:param drop_prob: Probability a frame is lost on the link.
+		:param incomplete_prob: Probability a delivered frame is incomplete.
+		:param clock_drift_ppm: How fast the camera clock runs relative to the host.
+		:param speed: Simulated time runs this many times faster than real time,
+			or None for frames to be ready whenever they are asked for.
+		:param lines: Trigger inputs, {'Line0': sync.sim_trigger_line(), ...}.
+		:param trigger_latency: Seconds from a trigger edge to the first exposure.
+		:param n_patterns: Number of distinct precomputed frames cycled through.
+		:param seed: Seed for the frame noise and the drops.
+		"""
+		self.n_cameras = n_cameras;
+		self.framerate = framerate;
+		self.sensor_wh = tuple(sensor_wh);
+		self.max_framerate = max_framerate;
+		self.link_Bps = link_Bps;
+		self.framerate_enable = framerate_enable;
+		self.buffer_count = buffer_count;
+		self.drop_prob = drop_prob;
+		self.incomplete_prob = incomplete_prob;
+		self.clock_drift_ppm = clock_drift_ppm;
+		self.speed = speed;
+		self.lines = {} if lines is None else dict(lines);
+		self.trigger_latency = trigger_latency;
+		self.n_patterns = n_patterns;
+		self.seed = seed;
+		self.rng = np.random.default_rng(seed)
+		self.SpinnakerException = SpinnakerException
+		self.EVENT_TIMEOUT_INFINITE = EVENT_TIMEOUT_INFINITE
+		self.NI, self.NA, self.WO, self.RO, self.RW = NI, NA, WO, RO, RW
+		# Enumeration entries become <Node>_<Entry> constants, as in PySpin
+		self.enum_names = {}
+		self._enum_values = {}
+		for node, entries in ENUMS.items():
+			self.enum_names[node] = {}
+			for k, entry in enumerate(entries):
+				setattr(self,'%s_%s' % (node,entry),k)
+				self.enum_names[node][k] = entry
+				self._enum_values[(node,entry)] = k
+		self.nodemap = sim_nodemap()
+		self.System = sim_system(self)
+
+	def enum_value(self,node,entry):
+		return self._enum_values[(node,entry)]
+
+	# Just enough of the generic node API for print_device_info
+	def CCategoryPtr(self,node):
+		return node
+
+	def CValuePtr(self,node):
+		return node
+
+	def IsAvailable(self,node):
+		return not node is None
+
+	def IsReadable(self,node):
+		return not node is None
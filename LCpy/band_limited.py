@@ -3,7 +3,8 @@
 """
 Routines for Manipulating Band-Limited Signals
 ==============================================
-- gen_band_limited    Generate band-limited signal
+- gen_band_limited          Generate band-limited signal
+- gen_band_limited_batch    Generate many band-limited signals at once
 """
 
 # Copyright (c) 2009-2015, Lev Givon
@@ -11,84 +12,139 @@ Routines for Manipulating Band-Limited Signals
 # Distributed under the terms of the BSD license:
 # http://www.opensource.org/licenses/bsd-license
 
-__all__ = ['gen_band_limited']
+__all__ = ['gen_band_limited', 'gen_band_limited_batch']
 
-from numpy import array, ceil, complex, exp, pi, zeros
-from numpy.random import rand, randint, randn
+from functools import lru_cache
+
+from numpy import argpartition, ceil, complex128, exp, pi, put_along_axis, sort, zeros
+from numpy.random import default_rng
 from numpy.fft import irfft
 from scipy.signal import firwin, lfilter
 
-def gen_band_limited(dur, dt, fmax, np=None, nc=3):
+@lru_cache(maxsize=64)
+def _lowpass(fmax, dt, numtaps=40):
+    # Since a cutoff of 1 corresponds to the Nyquist frequency 1/(2*dt),
+    # the cutoff corresponding to the frequency fmax is fmax/(1/2*dt). The
+    # taps are shared between calls, so they're made read-only.
+    b = firwin(numtaps, 2*fmax*dt)
+    b.flags.writeable = False
+    return b
+
+def _distinct_bins(rng, batch, nc, fmaxi):
+    # nc distinct integers in [1, fmaxi] for every row. When nc is small
+    # next to fmaxi, draw them all and redraw only the rows with repeats;
+    # otherwise pick the nc smallest of fmaxi random keys per row.
+    if 4*nc > fmaxi:
+        return argpartition(rng.random((batch, fmaxi)), nc-1, axis=1)[:, :nc]+1
+    ci = rng.integers(1, fmaxi+1, (batch, nc))
+    while True:
+        s = sort(ci, axis=1)
+        redo = (s[:, 1:] == s[:, :-1]).any(axis=1)
+        if not redo.any():
+            return ci
+        ci[redo] = rng.integers(1, fmaxi+1, (int(redo.sum()), nc))
+
+def gen_band_limited_batch(batch, dur, dt, fmax, np=None, nc=3, rng=None):
     """
-    Generate a uniformly sampled, band-limited signal.
+    Generate many uniformly sampled, band-limited signals in one call.
+
+    Every row is independent and distributed as one gen_band_limited signal;
+    the frequency components, phases, noise, inverse FFT and filtering are
+    all done on the whole batch at once.
 
     Parameters
     ----------
+    batch : int
+        Number of signals.
     dur : float
-        Duration of signal (s).
+        Duration of each signal (s).
     dt : float
         Sampling resolution; the sampling frequency is 1/dt Hz.
     fmax : float
         Maximum frequency (Hz).
     np : float
-        Noise power. If `np != None`, Gaussian white noise is added to the
-        generated signal before the latter is filtered.
+        Noise power. If `np` is not None, Gaussian white noise is added to
+        the generated signals before they are filtered.
     nc : int
-        Number of discrete frequency components in generated signal.
+        Number of discrete frequency components in each signal.
+    rng : numpy.random.Generator or int
+        Random number generator, or a seed for one; None for a fresh,
+        unseeded generator.
 
     Returns
     -------
     u : ndarray of floats
-        Generated signal.
+        Generated signals, shape (batch, ceil(dur/dt)).
 
     """
 
-    # Since the signal generated by this function must be real, the
-    # frequency components on one side of its fft representation are
-    # complex conjugates of those on the other side; this allows for
-    # the use of the inverse real fft (irfft), which only requires the
-    # frequency components on one side of the full fft as input (and
-    # hence allows this function to consume less memory when run).
+    rng = default_rng(rng)
 
     # The maximum frequency may not exceed the Nyquist frequency:
     fs = 1.0/dt
     if fmax > fs/2:
         raise ValueError("maximum frequency may not exceed the Nyquist frequency")
 
-    # Determine number of entries in generated signal. This
+    # Determine number of entries in each generated signal. This
     # corresponds to the length of arange(0, dur, dt):
     n = int(ceil(dur/dt))
+    batch = int(batch)
 
-    # Randomly set nc distinct frequency components:    
-    f = zeros(int(n/2)+1, complex) # only one side of the spectrum is needed
+    # Randomly set nc distinct frequency components per signal:
+    f = zeros((batch, int(n/2)+1), complex128) # only one side of the spectrum is needed
     fmaxi = int(n*fmax/fs)
     if fmaxi < nc:
         raise ValueError("maximum frequency %f is too low to provide %i frequency components" % (fmax, nc))
 
     # The first element in the fft corresponds to the DC component;
     # hence, it is not set:
-    ci = set()
-    while len(ci) < nc:
-        temp = randint(1, fmaxi+1)
-        while temp in ci:
-            temp = randint(1, fmaxi+1)
-        ci.add(temp)
-    ci = array(list(ci))
-    p = -2*pi*rand(nc)
-    f[ci] = (n/2)*exp(1j*p)
-
-    # Create the signal by transforming the constructed frequency
-    # representation into the time domain and adding white noise if so
+    ci = _distinct_bins(rng, batch, nc, fmaxi)
+    p = -2*pi*rng.random((batch, nc))
+    put_along_axis(f, ci, (n/2)*exp(1j*p), axis=1)
+
+    # Since the signals generated by this function must be real, the
+    # frequency components on one side of their fft representation are
+    # complex conjugates of those on the other side; this allows for
+    # the use of the inverse real fft (irfft), which only requires the
+    # frequency components on one side of the full fft as input (and
+    # hence allows this function to consume less memory when run).
+    # Create the signals by transforming the constructed frequency
+    # representations into the time domain and adding white noise if so
     # specified:
-    u = irfft(f,n)
-    if np != None:
-        u += randn(len(u))*10**(np/20)
+    u = irfft(f, n, axis=1)
+    if np is not None:
+        u += rng.standard_normal(u.shape)*10**(np/20)
 
     # Filter the result to get rid of high frequency components
-    # introduced by the noise. Since a cutoff of 1 corresponds to the
-    # Nyquist frequency 1/(2*dt), the cutoff corresponding to the
-    # frequency fmax must be fmax/(1/2*dt):
-    b = firwin(40, 2*fmax*dt)
-    u = lfilter(b, 1, u)
+    # introduced by the noise; the filter design is cached per (fmax, dt):
+    return lfilter(_lowpass(fmax, dt), 1, u, axis=1)
+
+def gen_band_limited(dur, dt, fmax, np=None, nc=3, rng=None):
+    """
+    Generate a uniformly sampled, band-limited signal.
+
+    Parameters
+    ----------
+    dur : float
+        Duration of signal (s).
+    dt : float
+        Sampling resolution; the sampling frequency is 1/dt Hz.
+    fmax : float
+        Maximum frequency (Hz).
+    np : float
+        Noise power. If `np` is not None, Gaussian white noise is added to
+        the generated signal before the latter is filtered.
+    nc : int
+        Number of discrete frequency components in generated signal.
+    rng : numpy.random.Generator or int
+        Random number generator, or a seed for one; None for a fresh,
+        unseeded generator.
+
+    Returns
+    -------
+    u : ndarray of floats
+        Generated signal.
+
+    """
 
-    return u
+    return gen_band_limited_batch(1, dur, dt, fmax, np, nc, rng)[0]
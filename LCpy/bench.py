@@ -0,0 +1,292 @@
+"""
+Acquisition benchmarks.
+
+Drives the real acquisition code (blackfly_camera, the acquisition engine,
+Analog_Discovery.take_data and the savers) against the simulated devices in
+sim_spin and sim_dwf, and reports, for each case:
+
+	frames_per_s / samples_per_s	sustained throughput
+	frames_dropped / samples_lost	what didn't make it
+	latency_ms_p50/p90/p99/max	per-frame processing latency, from the grab
+					returning to the frame being stored
+	frame_interval_ms_p50/...	time between kept frames (acquire_images)
+	peak_mem_mb			peak Python/numpy allocation (tracemalloc)
+	save_MB_per_s			for the save cases
+
+plus the process's peak RSS. Results are written as JSON so runs can be
+compared over time:
+
+	python -m LCpy.bench quick --out before.json
+	python -m LCpy.bench quick --out after.json --compare before.json
+
+The suites are 'quick' (a few seconds each) and 'full'; --scale multiplies
+every case's frame count and duration.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+try:
+	import resource
+except ImportError:
+	resource = None #not on Windows
+
+from LCpy.QuickCapture.Quick_capture import blackfly_camera
+from LCpy.QuickCapture.sim_spin import sim_spin
+from LCpy.QuickCapture.acquisition_engine import memory_stage
+from LCpy.QuickCapture.reducers import frame_reducer
+from LCpy.AnalogDiscovery.AD_2 import Analog_Discovery
+from LCpy.AnalogDiscovery.sim_dwf import sim_dwf
+
+def _percentiles(x,prefix='latency_ms'):
+	x = np.asarray(x,dtype=float)*1e3
+	if len(x) == 0:
+		return {}
+	p50, p90, p99 = np.percentile(x,[50,90,99])
+	return {prefix+'_p50':p50,prefix+'_p90':p90,prefix+'_p99':p99,prefix+'_max':float(x.max())}
+
+def _measure(fn):
+	"""
+	Runs fn() and returns its result, the wall time it took and its peak
+	traced allocation in MB.
+	"""
+	tracemalloc.start()
+	t0 = time.perf_counter()
+	try:
+		result = fn()
+		wall = time.perf_counter()-t0
+		peak = tracemalloc.get_traced_memory()[1]/1e6
+	finally:
+		tracemalloc.stop()
+	return result, wall, peak
+
+def _peak_rss_mb():
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss/1e6 if sys.platform == 'darwin' else rss/1e3 #bytes on macOS, kB elsewhere
+
+def _open_camera(wh,**sim_args):
+	sim_args.setdefault('seed',0)
+	sim_args.setdefault('sensor_wh',(max(wh[0],1440),max(wh[1],1080)))
+	return blackfly_camera(wh=list(wh),backend=sim_spin(**sim_args))
+
+class _latency_reducer(frame_reducer):
+	# acquire_images runs its reducers on a frame right after copying it out,
+	# so the time since its capture time is its grab-to-stored latency
+	name = 'latency_s';
+
+	def process(self,frame,t,i):
+		self._t = t;
+		frame_reducer.process(self,frame,t,i)
+
+	def reduce(self,frame,out):
+		out[0] = time.time()-self._t
+
+def bench_acquire_images(wh=(640,480),num_frames=1000,decimate=1,chunk_data=True,framerate=None,speed=None):
+	"""
+	acquire_images into memory. With speed=None frames are always waiting, so
+	frames_per_s is what the grab loop can sustain; with a framerate and
+	speed, frames_dropped shows whether it keeps up with a real-time camera.
+	"""
+	sim_args = {'speed':speed}
+	if not framerate is None:
+		sim_args['framerate'] = framerate
+	cam = _open_camera(wh,**sim_args)
+	lat = _latency_reducer()
+	result, wall, peak = _measure(lambda: cam.acquire_images(num_frames=num_frames,decimate=decimate,
+		chunk_data=chunk_data,reducers=[lat]).result())
+	images, images_t = result[:2]
+	stats = cam.last_acquisition
+	metrics = {'frames_per_s':stats['frames_grabbed']/wall,'frames_kept':stats['frames_kept'],
+		'frames_incomplete':stats['frames_incomplete'],
+		'frames_dropped':stats.get('frames_dropped',cam.cam.stats['frames_dropped_buffer']+cam.cam.stats['frames_dropped_link']),
+		'peak_mem_mb':peak,'wall_s':wall}
+	metrics.update(_percentiles(lat.result()[0]))
+	metrics.update(_percentiles(np.diff(images_t),'frame_interval_ms'))
+	cam.release_frames(images)
+	return metrics
+
+class _latency_stage:
+	def __init__(self):
+		self.latency = [];
+
+	def process(self,frame,t,i):
+		self.latency.append(time.time()-t)
+
+def bench_acquire_stream(wh=(640,480),num_frames=1000,ring_size=64,overflow='block',decimate=1):
+	"""
+	acquire_stream with a memory stage; latency is from grab to the consumer.
+	"""
+	cam = _open_camera(wh,speed=None)
+	num_kept = -(-num_frames//decimate)
+	frames = cam.pool.get((num_kept,wh[1],wh[0]),cam.dtype)
+	lat = _latency_stage()
+	stages = [memory_stage(frames,np.zeros(num_kept)),lat]
+	(stages, stats), wall, peak = _measure(lambda: cam.acquire_stream(num_frames,stages=stages,
+		ring_size=ring_size,overflow=overflow,decimate=decimate).result())
+	metrics = {'frames_per_s':stats['frames_grabbed']/wall,'frames_consumed':stats['frames_consumed'],
+		'frames_dropped':stats['frames_overflowed'],'backpressure_waits':stats['backpressure_waits'],
+		'max_ring_fill':stats['max_ring_fill'],'peak_mem_mb':peak,'wall_s':wall}
+	metrics.update(_percentiles(lat.latency))
+	cam.release_frames(frames)
+	return metrics
+
+def bench_take_data(acq_samp_Hz=10e3,seconds=2.0,fifo_samples=8192,speed=1.0):
+	"""
+	take_data against a real-time (or, with speed=None, always full) FIFO.
+	Latency is the mean time per FIFO read.
+	"""
+	ad = Analog_Discovery(acq_samp_Hz=acq_samp_Hz,acq_n_samp=int(acq_samp_Hz*seconds),
+		backend=sim_dwf(fifo_samples=fifo_samples,speed=speed,seed=0))
+	ad.output_start_time -= 2 #nothing to settle on a simulated output
+	samples, wall, peak = _measure(lambda: ad.take_data().result())
+	stats = ad.last_take_stats
+	return {'samples_per_s':samples.shape[1]/wall,'samples_lost':stats['samples_lost'],
+		'samples_corrupted':stats['samples_corrupted'],'polls':stats['polls'],'reads':stats['reads'],
+		'read_ms_mean':1e3*stats['wall_s']/max(stats['reads'],1),'cpu_fraction':stats['cpu_fraction'],
+		'peak_mem_mb':peak,'wall_s':wall}
+
+def bench_save(wh=(640,480),num_frames=300,save_format='lcc'):
+	"""
+	Writes one collect (frames plus a power record) with the runner's save
+	function for save_format.
+	"""
+	cam = _open_camera(wh,speed=None)
+	images, images_t = cam.acquire_images(num_frames=num_frames).result()[:2]
+	outdic = {'images':images,'images_t':images_t,'power_data':np.random.default_rng(0).normal(size=(2,100000)),
+		'out_freq':50,'collect_time':10}
+	if save_format == 'lcc':
+		from LCpy.collect_file import save_collect as save_fn
+	else:
+		from scipy.io import savemat as save_fn
+	with tempfile.TemporaryDirectory() as tmp:
+		path = os.path.join(tmp,'collect.'+save_format)
+		_, wall, peak = _measure(lambda: save_fn(path,outdic))
+		size = os.path.getsize(path)
+	nbytes = images.nbytes+images_t.nbytes+outdic['power_data'].nbytes
+	cam.release_frames(images)
+	return {'save_MB_per_s':nbytes/1e6/wall,'file_MB':size/1e6,'ratio':size/nbytes,'peak_mem_mb':peak,'wall_s':wall}
+
+SUITES = {
+	'quick':[
+		('acquire_images',bench_acquire_images,{'wh':(640,480),'num_frames':500}),
+		('acquire_images_decimated',bench_acquire_images,{'wh':(640,480),'num_frames':1000,'decimate':10}),
+		('acquire_images_realtime',bench_acquire_images,{'wh':(640,480),'num_frames':200,'framerate':200,'speed':1.0}),
+		('acquire_stream',bench_acquire_stream,{'wh':(640,480),'num_frames':500}),
+		('take_data',bench_take_data,{'acq_samp_Hz':10e3,'seconds':1.0}),
+		('save_lcc',bench_save,{'num_frames':100,'save_format':'lcc'}),
+		('save_mat',bench_save,{'num_frames':100,'save_format':'mat'}),
+	],
+	'full':[
+		('acquire_images',bench_acquire_images,{'wh':(640,480),'num_frames':3000}),
+		('acquire_images_full_sensor',bench_acquire_images,{'wh':(1440,1080),'num_frames':1000}),
+		('acquire_images_decimated',bench_acquire_images,{'wh':(640,480),'num_frames':3000,'decimate':30}),
+		('acquire_images_realtime',bench_acquire_images,{'wh':(640,480),'num_frames':2000,'framerate':200,'speed':1.0}),
+		('acquire_stream',bench_acquire_stream,{'wh':(640,480),'num_frames':3000}),
+		('acquire_stream_full_sensor',bench_acquire_stream,{'wh':(1440,1080),'num_frames':1000}),
+		('take_data',bench_take_data,{'acq_samp_Hz':10e3,'seconds':5.0}),
+		('take_data_fast',bench_take_data,{'acq_samp_Hz':1e6,'seconds':2.0}),
+		('save_lcc',bench_save,{'num_frames':600,'save_format':'lcc'}),
+		('save_mat',bench_save,{'num_frames':600,'save_format':'mat'}),
+	],
+}
+
+def _scaled(params,scale):
+	params = dict(params)
+	for key in ('num_frames','seconds'):
+		if key in params:
+			params[key] = type(params[key])(max(params[key]*scale,1))
+	return params
+
+def _environment():
+	try:
+		commit = subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,
+			cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+	except OSError:
+		commit = None
+	return {'time':time.strftime('%Y-%m-%dT%H:%M:%S'),'platform':platform.platform(),
+		'python':platform.python_version(),'numpy':np.__version__,'cpu_count':os.cpu_count(),'commit':commit}
+
+def run_suite(suite='quick',scale=1.0,only=None,verbose=True):
+	"""
+	Runs every case in a suite.
+
+	:param suite: 'quick' or 'full'.
+	:param scale: Multiplies each case's num_frames/seconds.
+	:param only: Optional list of case names to run.
+	:return: The environment and, per case, its parameters and metrics.
+	:rtype: dict
+	"""
+	results = {'suite':suite,'scale':scale,'environment':_environment(),'cases':{}}
+	for name, fn, params in SUITES[suite]:
+		if only and not name in only:
+			continue
+		params = _scaled(params,scale)
+		if verbose: print('%-28s' % name,end='',flush=True)
+		metrics = fn(**params)
+		results['cases'][name] = {'params':params,'metrics':metrics}
+		if verbose: print(_summary(metrics))
+	results['peak_rss_mb'] = _peak_rss_mb()
+	return results
+
+def _summary(metrics):
+	keys = ('frames_per_s','samples_per_s','save_MB_per_s','frames_dropped','samples_lost','latency_ms_p99','peak_mem_mb')
+	return '  '.join('%s=%.4g' % (k,metrics[k]) for k in keys if k in metrics)
+
+def save_results(results,path):
+	folder = os.path.dirname(path)
+	if folder and not os.path.exists(folder):
+		os.makedirs(folder)
+	with open(path,'w') as f:
+		json.dump(results,f,indent=1,default=lambda x: x.item() if hasattr(x,'item') else list(x))
+
+def load_results(path):
+	with open(path) as f:
+		return json.load(f)
+
+def compare(old,new):
+	"""
+	Ratio new/old for every metric the two result sets share.
+
+	:return: {case: {metric: ratio}}
+	:rtype: dict
+	"""
+	ratios = {}
+	for name, case in new['cases'].items():
+		if not name in old['cases']:
+			continue
+		before = old['cases'][name]['metrics']
+		ratios[name] = {k: (v/before[k] if before[k] else float('nan'))
+			for k, v in case['metrics'].items() if k in before and isinstance(v,(int,float))}
+	return ratios
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='python -m LCpy.bench',description='Acquisition benchmarks against simulated devices.')
+	parser.add_argument('suite',nargs='?',default='quick',choices=sorted(SUITES))
+	parser.add_argument('--scale',type=float,default=1.0,help='multiply frame counts and durations')
+	parser.add_argument('--only',nargs='*',help='case names to run')
+	parser.add_argument('--out',help='JSON file to write (default bench_results/<suite>_<time>.json)')
+	parser.add_argument('--compare',help='earlier results JSON to compare against')
+	args = parser.parse_args(argv)
+	results = run_suite(args.suite,args.scale,args.only)
+	out = args.out or os.path.join('bench_results','%s_%s.json' % (args.suite,time.strftime('%Y%m%d_%H%M%S')))
+	save_results(results,out)
+	print('peak RSS %.1f MB; results written to %s' % (results['peak_rss_mb'] or float('nan'),out))
+	if args.compare:
+		for name, ratios in compare(load_results(args.compare),results).items():
+			print('%-28s' % name+'  '.join('%s x%.2f' % (k,r) for k, r in ratios.items()
+				if k.endswith('_per_s') or k.startswith('latency') or k == 'peak_mem_mb'))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+LCpy collect files (.lcc).
+
+A chunked, optionally compressed container for one collect: the frames, their
+capture times, the power data and the run parameters. Unlike a .mat file it has
+no 2 GB limit, frames can be appended while the acquisition is still running,
+and any single frame can be read without loading the rest.
+
+Layout: an 8 byte magic, then a sequence of records, then (once the file is
+closed) an index record and a 16 byte trailer pointing at it. Each record is a
+16 byte header (4 byte kind, uint32 length of a JSON description, uint64
+payload length), the JSON description and the payload. Record kinds are
+
+	FRMS  a chunk of frames (and their capture times)
+	ARRY  a named array, e.g. power_data
+	PARM  the run parameters
+	INDX  the index written on close
+
+A file that was never closed (e.g. the run crashed) is still readable; the
+reader rebuilds the index by walking the records.
+
+collect_writer also works as a frame sink for blackfly_camera.acquire_images.
+"""
+
+import json
+import os
+import bisect
+import struct
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MAGIC = b'LCPYCOL1'
+TRAILER_MAGIC = b'LCPYIDX1'
+_REC = struct.Struct('<4sIQ')
+_TRAILER = struct.Struct('<8sQ')
+
+def _jsonable(value):
+	if isinstance(value,np.ndarray):
+		return value.tolist()
+	if isinstance(value,np.generic):
+		return value.item()
+	if isinstance(value,(list,tuple)):
+		return [_jsonable(v) for v in value]
+	if isinstance(value,dict):
+		return {k:_jsonable(v) for k,v in value.items()}
+	return value
+
+def _dtype_desc(dtype):
+	# Structured dtypes (e.g. frame metadata) need their fields, not just '|V40'
+	return dtype.descr if dtype.names else dtype.str
+
+def _dtype(desc):
+	if isinstance(desc,list):
+		return np.dtype([tuple(field) for field in desc])
+	return np.dtype(desc)
+
+def _encode(raw,codec,level):
+	if codec == 'zlib':
+		return zlib.compress(raw,level)
+	return raw
+
+def _decode(payload,codec):
+	if codec == 'zlib':
+		return zlib.decompress(payload)
+	return payload
+
+class collect_writer:
+	def __init__(self,path,params=None,chunk_frames=64,codec='zlib',level=1,threads=2):
+		"""
+		:param path: File to create. An existing file is overwritten.
+		:param params: Run parameters (out_freq, out_amp, mod_freq, acq_samp_Hz, ...).
+		:type params: dict
+		:param chunk_frames: Frames per chunk; the unit of compression and of random access.
+		:type chunk_frames: int
+		:param codec: 'zlib' or None.
+		:param level: zlib compression level. 1 is fast and does well on mostly-flat frames.
+		:param threads: Threads compressing chunks in the background (0 to compress inline).
+		"""
+		if codec not in ('zlib',None):
+			raise ValueError("codec must be 'zlib' or None")
+		self.path = path;
+		self.chunk_frames = int(chunk_frames);
+		self.codec = codec;
+		self.level = level;
+		self._f = open(path,'wb')
+		self._f.write(MAGIC)
+		self._pool = ThreadPoolExecutor(threads) if threads and codec else None
+		self._pending = deque() #chunks still being compressed, in order
+		self._buf = None;
+		self._times = [];
+		self._first = 0; #frame number of the first frame in _buf
+		self.n_frames = 0;
+		self.frame_shape = None;
+		self.dtype = None;
+		self.index = {'chunk_frames':self.chunk_frames,'chunks':[],'arrays':{},'params':None};
+		self.params = {};
+		self.closed = False;
+		if params:
+			self.set_params(**params)
+
+	def _write_record(self,kind,desc,payload):
+		offset = self._f.tell()
+		desc = json.dumps(desc).encode()
+		self._f.write(_REC.pack(kind,len(desc),len(payload)))
+		self._f.write(desc)
+		self._f.write(payload)
+		return offset
+
+	def write(self,frame,t=0.0):
+		"""
+		Appends one frame (and its capture time) to the collect.
+		"""
+		if self.closed:
+			raise ValueError('write to a closed collect')
+		if self._buf is None:
+			self.frame_shape = tuple(frame.shape)
+			self.dtype = np.dtype(frame.dtype)
+			self._buf = np.empty((self.chunk_frames,)+self.frame_shape,dtype=self.dtype)
+		n = self.n_frames - self._first
+		self._buf[n] = frame
+		self._times.append(float(t))
+		self.n_frames += 1
+		if n+1 == self.chunk_frames:
+			self._end_chunk()
+
+	def write_frames(self,frames,times=None):
+		"""
+		Appends a whole block of frames, e.g. an in-memory video.
+		"""
+		times = np.zeros(len(frames)) if times is None else times
+		for frame, t in zip(frames,times):
+			self.write(frame,t)
+
+	def _end_chunk(self):
+		n = self.n_frames - self._first
+		if n == 0:
+			return
+		raw = self._buf[:n].tobytes()
+		desc = {'first':self._first,'n':n,'dtype':self.dtype.str,'shape':list(self.frame_shape),
+			'codec':self.codec,'t':self._times}
+		if self._pool is None:
+			self._pending.append((desc,_encode(raw,self.codec,self.level)))
+		else:
+			self._pending.append((desc,self._pool.submit(_encode,raw,self.codec,self.level)))
+		self._first = self.n_frames
+		self._times = []
+		self._drain(block=len(self._pending) > 4)
+
+	def _drain(self,block=False):
+		# Write compressed chunks out in order, as far as they're ready
+		while self._pending:
+			desc, payload = self._pending[0]
+			if not isinstance(payload,bytes):
+				if not block and not payload.done():
+					return
+				payload = payload.result()
+			self._pending.popleft()
+			offset = self._write_record(b'FRMS',desc,payload)
+			self.index['chunks'].append([offset,desc['first'],desc['n']])
+
+	def write_array(self,name,arr,codec='default'):
+		"""
+		Stores a named array, e.g. power_data. Writing the same name again replaces it.
+		"""
+		arr = np.ascontiguousarray(arr)
+		codec = self.codec if codec == 'default' else codec
+		desc = {'name':name,'dtype':_dtype_desc(arr.dtype),'shape':list(arr.shape),'codec':codec}
+		self.index['arrays'][name] = self._write_record(b'ARRY',desc,_encode(arr.tobytes(),codec,self.level))
+
+	def set_params(self,**params):
+		"""
+		Adds to (or overrides) the run parameters stored with the collect.
+		"""
+		self.params.update(_jsonable(params))
+		self.index['params'] = self._write_record(b'PARM',self.params,b'')
+
+	def flush(self):
+		"""
+		Writes out the partially filled chunk so everything so far is on disk.
+		"""
+		self._end_chunk()
+		self._drain(block=True)
+		self._f.flush()
+
+	def close(self):
+		if self.closed:
+			return
+		self.flush()
+		if self._pool is not None:
+			self._pool.shutdown()
+		self.index['n_frames'] = self.n_frames
+		self.index['frame_shape'] = None if self.frame_shape is None else list(self.frame_shape)
+		self.index['dtype'] = None if self.dtype is None else self.dtype.str
+		offset = self._write_record(b'INDX',self.index,b'')
+		self._f.write(_TRAILER.pack(TRAILER_MAGIC,offset))
+		self._f.close()
+		self.closed = True
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+class collect_reader:
+	def __init__(self,path):
+		"""
+		Opens a .lcc file for reading. Frames are read (and decompressed) a chunk
+		at a time, and the most recent chunk is cached.
+		"""
+		self.path = path;
+		self._f = open(path,'rb')
+		if self._f.read(len(MAGIC)) != MAGIC:
+			raise ValueError('%s is not an LCpy collect file' % path)
+		self.index = self._read_index()
+		self._chunks = sorted(self.index['chunks'],key=lambda c: c[1])
+		self._firsts = [c[1] for c in self._chunks]
+		self.chunk_frames = self.index['chunk_frames']
+		self.n_frames = sum(c[2] for c in self._chunks)
+		self._cache = (None,None,None)
+		self.frame_shape = None
+		self.dtype = None
+		if self._chunks:
+			desc, _ = self._read_record(self._chunks[0][0],payload=False)
+			self.frame_shape = tuple(desc['shape'])
+			self.dtype = np.dtype(desc['dtype'])
+		self.params = {}
+		if self.index['params'] is not None:
+			self.params, _ = self._read_record(self.index['params'],payload=False)
+
+	def _read_index(self):
+		self._f.seek(0,os.SEEK_END)
+		size = self._f.tell()
+		if size >= len(MAGIC)+_TRAILER.size:
+			self._f.seek(size-_TRAILER.size)
+			magic, offset = _TRAILER.unpack(self._f.read(_TRAILER.size))
+			if magic == TRAILER_MAGIC:
+				desc, _ = self._read_record(offset,payload=False)
+				return desc
+		return self._scan(size)
+
+	def _scan(self,size):
+		# No trailer: the file wasn't closed. Walk the records to rebuild the index.
+		index = {'chunk_frames':None,'chunks':[],'arrays':{},'params':None}
+		offset = len(MAGIC)
+		while offset + _REC.size <= size:
+			self._f.seek(offset)
+			kind, n_desc, n_payload = _REC.unpack(self._f.read(_REC.size))
+			end = offset + _REC.size + n_desc + n_payload
+			if end > size:
+				break #a record cut short by the crash
+			desc = json.loads(self._f.read(n_desc))
+			if kind == b'FRMS':
+				index['chunks'].append([offset,desc['first'],desc['n']])
+				if index['chunk_frames'] is None or desc['n'] > index['chunk_frames']:
+					index['chunk_frames'] = desc['n']
+			elif kind == b'ARRY':
+				index['arrays'][desc['name']] = offset
+			elif kind == b'PARM':
+				index['params'] = offset
+			offset = end
+		return index
+
+	def _read_record(self,offset,payload=True):
+		self._f.seek(offset)
+		kind, n_desc, n_payload = _REC.unpack(self._f.read(_REC.size))
+		desc = json.loads(self._f.read(n_desc))
+		return desc, (self._f.read(n_payload) if payload else None)
+
+	def _chunk(self,k):
+		if self._cache[0] != k:
+			desc, payload = self._read_record(self._chunks[k][0])
+			frames = np.frombuffer(_decode(payload,desc['codec']),dtype=desc['dtype'])
+			frames = frames.reshape((desc['n'],)+tuple(desc['shape']))
+			self._cache = (k,frames,np.array(desc['t']))
+		return self._cache[1], self._cache[2]
+
+	def _locate(self,i):
+		if i < 0:
+			i += self.n_frames
+		if not 0 <= i < self.n_frames:
+			raise IndexError('frame %d out of range' % i)
+		k = i // self.chunk_frames #every chunk but the last is full, unless flush() was called mid-collect
+		if k >= len(self._chunks) or not 0 <= i - self._chunks[k][1] < self._chunks[k][2]:
+			k = bisect.bisect_right(self._firsts,i) - 1
+		return k, i - self._chunks[k][1]
+
+	def frame(self,i):
+		"""
+		Reads frame i, decompressing only the chunk that holds it.
+		"""
+		k, j = self._locate(i)
+		return self._chunk(k)[0][j]
+
+	def frames(self,start=0,stop=None,step=1):
+		"""
+		Reads frames[start:stop:step] into one array.
+		"""
+		idx = range(*slice(start,stop,step).indices(self.n_frames))
+		out = np.empty((len(idx),)+self.frame_shape,dtype=self.dtype)
+		for n, i in enumerate(idx):
+			out[n] = self.frame(i)
+		return out
+
+	def __len__(self):
+		return self.n_frames
+
+	def __getitem__(self,i):
+		if isinstance(i,slice):
+			return self.frames(i.start,i.stop,i.step or 1)
+		return self.frame(i)
+
+	@property
+	def images_t(self):
+		if not self._chunks:
+			return np.zeros(0)
+		return np.concatenate([np.asarray(self._read_record(c[0],payload=False)[0]['t']) for c in self._chunks])
+
+	@property
+	def arrays(self):
+		return list(self.index['arrays'])
+
+	def array(self,name):
+		desc, payload = self._read_record(self.index['arrays'][name])
+		return np.frombuffer(_decode(payload,desc['codec']),dtype=_dtype(desc['dtype'])).reshape(desc['shape'])
+
+	def close(self):
+		self._f.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
+
+def save_collect(path,outdic,**writer_args):
+	"""
+	Writes a collect dict (as built by the runner) to a .lcc file. Arrays become
+	named arrays, everything else a run parameter. 'images' may be an in-memory
+	video or a collect_writer that frames were already streamed into, in which
+	case the rest of the collect is appended to it and it is closed.
+
+	Has the same signature as scipy.io.savemat, so it can be a background_saver save_fn.
+	"""
+	images = outdic.get('images')
+	if isinstance(images,collect_writer):
+		writer = images
+	else:
+		writer = collect_writer(path,**writer_args)
+		if images is not None:
+			writer.write_frames(images,outdic.get('images_t'))
+	params = {}
+	for key, value in outdic.items():
+		if key == 'images' or (key == 'images_t' and writer.n_frames):
+			continue #the frame times are stored with the frames
+		if isinstance(value,np.ndarray):
+			writer.write_array(key,value)
+		else:
+			params[key] = value
+	writer.set_params(**params)
+	writer.close()
+
+def to_mat(path,mat_path=None):
+	"""
+	Converts a .lcc collect to a .mat file with the same variables the runner
+	used to write (images, images_t, power_data, out_freq, ...). The whole
+	collect is loaded into memory, and MAT v5 variables are still limited to 2 GB.
+	"""
+	import scipy.io as sio
+	if mat_path is None:
+		mat_path = os.path.splitext(path)[0]+'.mat'
+	with collect_reader(path) as reader:
+		outdic = dict(reader.params)
+		if reader.n_frames:
+			outdic['images'] = reader.frames()
+		outdic['images_t'] = reader.images_t
+		for name in reader.arrays:
+			outdic[name] = reader.array(name)
+	sio.savemat(mat_path,outdic)
+	return mat_path
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print('usage: python -m LCpy.collect_file collect.lcc [collect.mat]')
+		sys.exit(2)
+	print(to_mat(*sys.argv[1:3]))
@@ -1,16 +1,272 @@
-from threading import Thread
-from concurrent.futures import Future
+"""
+Running device calls in the background.
+
+@threaded makes a method return a future instead of blocking. Every device
+object gets one long-lived worker thread, named after the device, that runs
+its @threaded calls one at a time, so there is no thread start-up per call
+and two calls can never drive the same device at once.
+
+That also means a call waits behind every call made before it on the same
+object (before, each call had a thread of its own): if one hangs, the rest
+queue up behind it until it is cancelled or times out. Methods that must
+not wait can be decorated with @threaded(serial=False) to get a thread of
+their own per call again.
+
+The futures are timed_futures: they record when the call was submitted,
+started and finished, and cancel() on a running call asks it to stop. A long
+running call checks cancelled() (or waits on cancel_event()) and winds the
+device down cleanly. A timeout, given to the decorator or set on the future,
+cancels the call the same way and the future then raises TimeoutError.
+
+wait_async awaits one of these futures from asyncio code.
+"""
+
+from threading import Thread, Event, Lock, Timer, local
+from concurrent.futures import Future, CancelledError
+import asyncio
+import itertools
+import queue
+import time
+import weakref
+
+_current = local()
+_worker_lock = Lock()
+_worker_ids = itertools.count()
+
+class timed_future(Future):
+    def __init__(self):
+        Future.__init__(self)
+        self.submit_time = time.time()
+        self.start_time = None
+        self.finish_time = None
+        self.timeout = None
+        self.timed_out = False
+        self.cancel_event = Event()
+        self._timer = None
+
+    def cancel(self):
+        """
+        Cancels a call that hasn't started. A running call is asked to stop
+        instead; it finishes with whatever it had (and this returns False).
+        """
+        if Future.cancel(self):
+            return True
+        if not self.done():
+            self.cancel_event.set()
+        return False
+
+    def set_timeout(self,seconds):
+        """
+        Cancels the call if it runs for longer than seconds from its start.
+        """
+        self.timeout = seconds
+        if self.start_time is not None:
+            self._arm_timer(seconds-(time.time()-self.start_time))
+
+    def _arm_timer(self,seconds):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = Timer(max(seconds,0),self._on_timeout)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _on_timeout(self):
+        if not self.done():
+            self.timed_out = True
+            self.cancel_event.set()
+
+    @property
+    def elapsed(self):
+        """
+        Seconds the call has been running (or ran for).
+        """
+        if self.start_time is None:
+            return 0.0
+        return (self.finish_time or time.time())-self.start_time
 
 def call_with_future(fn, future, args, kwargs):
+    if isinstance(future,timed_future):
+        future.start_time = time.time()
+        if future.timeout is not None:
+            future._arm_timer(future.timeout)
+    _current.future = future
     try:
         result = fn(*args, **kwargs)
+        if getattr(future,'timed_out',False):
+            exc = TimeoutError('%s timed out after %.1f s' % (getattr(fn,'__name__','call'),future.timeout))
+            exc.partial_result = result
+            raise exc
+        future.finish_time = time.time()
         future.set_result(result)
     except Exception as exc:
+        future.finish_time = time.time()
         future.set_exception(exc)
+    finally:
+        _current.future = None
+        if getattr(future,'_timer',None) is not None:
+            future._timer.cancel()
+
+def current_future():
+    """
+    The future of the @threaded call running on this thread, if any.
+    """
+    return getattr(_current,'future',None)
+
+def cancel_event():
+    """
+    An Event that is set when the current @threaded call is cancelled or times
+    out (a fresh, never-set Event outside of one).
+    """
+    future = current_future()
+    return future.cancel_event if isinstance(future,timed_future) else Event()
+
+def cancelled():
+    """
+    True if the current @threaded call has been asked to stop.
+    """
+    future = current_future()
+    return isinstance(future,timed_future) and future.cancel_event.is_set()
+
+async def wait_async(future, timeout=None):
+    """
+    Awaits a @threaded call's future. Cancelling the awaiting task cancels the
+    call (a running one is asked to stop), and with a timeout the call is
+    cancelled after timeout seconds of running and this raises TimeoutError
+    once it has wound down. The TimeoutError is the call's own, with the
+    partial_result it finished with.
+    """
+    if timeout is not None:
+        future.set_timeout(timeout)
+    try:
+        return await asyncio.wrap_future(future)
+    except TimeoutError:
+        # wrap_future copies a TimeoutError into a new one, losing partial_result
+        if future.done() and not future.cancelled() and future.exception() is not None:
+            raise future.exception() from None
+        raise
+
+class gathered_future(timed_future):
+    def __init__(self, futures):
+        """
+        A future for the results of several futures, in order. It fails with
+        the first of their exceptions, and cancelling it cancels all of them.
+        """
+        timed_future.__init__(self)
+        self.parts = list(futures)
+        self.start_time = time.time()
+        self.set_running_or_notify_cancel()
+        self._remaining = len(self.parts)
+        self._lock = Lock()
+        if not self.parts:
+            self.finish_time = time.time()
+            self.set_result([])
+        for part in self.parts:
+            part.add_done_callback(self._part_done)
+
+    def _part_done(self, part):
+        if not part.cancelled() and part.exception() is not None:
+            for other in self.parts:
+                other.cancel() #no point letting the rest run on
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining:
+                return
+        self.finish_time = time.time()
+        for part in self.parts:
+            if part.cancelled():
+                self.set_exception(CancelledError())
+                return
+            if part.exception() is not None:
+                self.set_exception(part.exception())
+                return
+        self.set_result([part.result() for part in self.parts])
+
+    def cancel(self):
+        for part in self.parts:
+            part.cancel()
+        return timed_future.cancel(self)
+
+    def set_timeout(self, seconds):
+        for part in self.parts:
+            part.set_timeout(seconds)
+
+def gather(futures):
+    """
+    Combines several @threaded calls (e.g. one per camera) into one future.
+    """
+    return gathered_future(futures)
+
+class device_worker:
+    def __init__(self,name):
+        """
+        A long-lived thread that runs the calls for one device, in order.
+        """
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = Thread(target=self._run,name=name,daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            fn, future, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                call_with_future(fn,future,args,kwargs)
+            # don't keep the device (args[0]) alive while idle
+            del job, fn, future, args, kwargs
+
+    def submit(self,fn,*args,**kwargs):
+        future = timed_future()
+        self._queue.put((fn,future,args,kwargs))
+        return future
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def shutdown(self,wait=True):
+        self._queue.put(None)
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+def worker_for(obj):
+    """
+    The device_worker pinned to obj, started the first time it is needed.
+    """
+    worker = obj.__dict__.get('_ez_worker')
+    if worker is None:
+        with _worker_lock:
+            worker = obj.__dict__.get('_ez_worker')
+            if worker is None:
+                worker = device_worker('%s-%d' % (type(obj).__name__,next(_worker_ids)))
+                obj._ez_worker = worker
+                weakref.finalize(obj,worker.shutdown,False) #the thread goes with its device
+    return worker
 
-def threaded(fn):
+def threaded(fn=None, timeout=None, serial=True):
+    """
+    Decorator: the method runs on its object's worker thread and the call
+    returns a timed_future. Use as @threaded or @threaded(timeout=seconds).
+    Calls on one object run one after the other; cancel (or time out) a
+    call that is stuck before expecting the next to start. With
+    serial=False every call gets a thread of its own instead, as plain
+    functions (no object to pin to) always do.
+    """
+    if fn is None:
+        return lambda fn: threaded(fn, timeout=timeout, serial=serial)
     def wrapper(*args, **kwargs):
-        future = Future()
+        if serial and args and hasattr(args[0], '__dict__'):
+            future = worker_for(args[0]).submit(fn, *args, **kwargs)
+            if timeout is not None:
+                future.set_timeout(timeout)
+            return future
+        future = timed_future()
+        future.timeout = timeout
+        future.set_running_or_notify_cancel()
         Thread(target=call_with_future, args=(fn, future, args, kwargs)).start()
         return future
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    wrapper.__wrapped__ = fn
     return wrapper
@@ -0,0 +1,146 @@
+"""
+Counters and histograms for long unattended runs.
+
+Each device (and the saver) keeps a metrics registry. The acquisition loops
+bump its counters and record timings into its histograms as they go, and
+snapshot() can be called from any thread at any time, e.g. by the runner
+after every collect or by someone watching a 24-hour run. Recording is cheap
+enough for the per-frame path: a counter is an attribute increment and a
+histogram a bisect into fixed, log-spaced buckets. Each metric expects a
+single writer thread.
+"""
+
+import bisect
+import threading
+import time
+
+import numpy as np
+
+class counter:
+	def __init__(self,name):
+		self.name = name;
+		self.value = 0;
+
+	def inc(self,n=1):
+		self.value += n
+
+	def snapshot(self):
+		return self.value
+
+	def reset(self):
+		self.value = 0;
+
+def log_buckets(lo=1e-6,hi=100.0,per_decade=10):
+	"""
+	Bucket edges spaced per_decade to a decade from lo to hi.
+	"""
+	n = int(round(np.log10(hi/lo)*per_decade))+1
+	return list(np.logspace(np.log10(lo),np.log10(hi),n))
+
+class histogram:
+	def __init__(self,name,edges=None):
+		"""
+		:param edges: Increasing bucket edges; values below the first edge and
+			above the last go to the end buckets. Defaults to log_buckets() (1 us
+			to 100 s), which suits timings in seconds.
+		"""
+		self.name = name;
+		self.edges = log_buckets() if edges is None else list(edges);
+		self.reset()
+
+	def reset(self):
+		self.counts = [0]*(len(self.edges)+1)
+		self.count = 0;
+		self.total = 0.0;
+		self.min = float('inf');
+		self.max = float('-inf');
+
+	def record(self,value):
+		self.counts[bisect.bisect_left(self.edges,value)] += 1
+		self.count += 1
+		self.total += value
+		if value < self.min:
+			self.min = value
+		if value > self.max:
+			self.max = value
+
+	def time(self):
+		"""
+		Context manager that records how long its block took, in seconds.
+		"""
+		return _timer(self)
+
+	def quantile(self,q):
+		"""
+		Approximate quantile: the upper edge of the bucket it falls in.
+		"""
+		if self.count == 0:
+			return float('nan')
+		target = q*self.count
+		seen = 0
+		for k, n in enumerate(self.counts):
+			seen += n
+			if seen >= target and n:
+				return min(self.edges[k] if k < len(self.edges) else self.max,self.max)
+		return self.max
+
+	def snapshot(self):
+		if self.count == 0:
+			return {'count':0}
+		return {'count':self.count,'sum':self.total,'mean':self.total/self.count,'min':self.min,'max':self.max,
+			'p50':self.quantile(0.5),'p90':self.quantile(0.9),'p99':self.quantile(0.99)}
+
+class _timer:
+	def __init__(self,hist):
+		self.hist = hist;
+
+	def __enter__(self):
+		self.t0 = time.perf_counter()
+		return self
+
+	def __exit__(self,*exc):
+		self.hist.record(time.perf_counter()-self.t0)
+
+class registry:
+	def __init__(self,name):
+		"""
+		A named set of counters and histograms, created on first use.
+		"""
+		self.name = name;
+		self.started = time.time();
+		self._metrics = {};
+		self._lock = threading.Lock()
+
+	def _get(self,name,cls,*args):
+		metric = self._metrics.get(name)
+		if metric is None:
+			with self._lock:
+				metric = self._metrics.setdefault(name,cls(name,*args))
+		return metric
+
+	def counter(self,name):
+		return self._get(name,counter)
+
+	def histogram(self,name,edges=None):
+		return self._get(name,histogram,edges)
+
+	def snapshot(self):
+		"""
+		Every metric's current value, plus when the registry was started (or
+		last reset). Safe to call while the device is running.
+		"""
+		snap = {'since':self.started}
+		for name, metric in list(self._metrics.items()):
+			snap[name] = metric.snapshot()
+		return snap
+
+	def reset(self):
+		for metric in list(self._metrics.values()):
+			metric.reset()
+		self.started = time.time();
+
+def snapshot_all(**registries):
+	"""
+	Snapshots several registries at once, keyed as given, skipping any that are None.
+	"""
+	return {key: reg.snapshot() for key, reg in registries.items() if not reg is None}
@@ -0,0 +1,336 @@
+"""
+Config-driven experiment runner.
+
+Every full_script*.py is the same loop with different constants, so the loop
+lives here once and the scripts are just run specs. A spec is a dict (or a
+JSON file holding one) with any of the keys in DEFAULT_SPEC; anything left out
+takes the default. Run one from the command line with
+
+	python -m LCpy.runner my_run.json
+
+or from Python with run(spec) (or await run_async(spec) inside an event loop).
+
+If mod_freqs is given the output is driven by Analog_Discovery_Sweep and every
+collect steps through each mod_freq; otherwise a plain Analog_Discovery carrier
+is used.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from LCpy.ez_thread import wait_async
+from LCpy.metrics import snapshot_all
+from LCpy.QuickCapture.reducers import build_reducers, reductions
+from LCpy.AnalogDiscovery.lockin import lockin
+from LCpy.AnalogDiscovery.decimator import decimator
+from LCpy.save_pipeline import background_saver
+from LCpy.sync import trigger_start, start_skew
+
+DEFAULT_SPEC = {
+	'collect_name':'trial',
+	'output_fold':'.',
+	'num_collects':1,
+	'collect_time':20, #in seconds
+	'framerate':30, #camera frame rate
+	'exposure':None, #camera exposure time in us, or None for auto exposure
+	'roi':None, #ROI preset name (see Quick_capture.ROI_PRESETS), or None for wh/offset/binning/decimation
+	'wh':None, #[width, height] of the ROI, None for 640x480
+	'offset':None, #[x, y] of the ROI, or 'center'
+	'binning':1, #sensor binning factor, or [horizontal, vertical]
+	'decimation':1, #sensor decimation factor, or [horizontal, vertical]
+	'desired_framerate':1, #frames kept per second
+	'acq_samp_Hz':10e3,
+	'acq_range':15.0,
+	'out_freq':50,
+	'out_amp':1.0, #for now, this has a gain of 22, and a limit of 40V.
+	'out_wv':1,
+	'mod_freqs':None, #list of AM frequencies to sweep, or None for no modulation
+	'stream_frames':False, #write frames to disk as they arrive instead of holding them
+	'save_format':'mat', #'mat', or 'lcc' for LCpy.collect_file
+	'stop_file':None, #removed at the start of the run and created at the end
+	'max_pending_saves':1,
+	'chunk_data':False, #record camera timestamps/frame IDs per frame (saved as frame_meta)
+	'start_mode':'software', #'software' (shared start_time) or 'trigger' (see LCpy.sync)
+	'trigger_source':'Line0', #camera input wired to the Analog Discovery trigger pin
+	'trigger_pin':0, #Analog Discovery trigger pin, 0 for T1
+	'timeout_margin':60, #seconds a collect may overrun collect_time before it's cancelled, or None
+	'simulate':False, #use the simulated camera and Analog Discovery (sim_spin/sim_dwf)
+	'metrics_file':None, #JSON file rewritten with the device/saver metrics after every collect
+	'reductions':None, #per-frame reductions to save, e.g. {'mean':true,'rois':[[x,y,w,h],...],'histogram_bins':64}
+	'keep_frames':True, #save the frames themselves; false saves only the reductions and images_t
+	'lockin':None, #streaming lock-in of the inputs at out_freq, e.g. {'output_rate':10} (see AnalogDiscovery.lockin)
+	'input_decimate':None, #also save power_data anti-alias filtered and decimated by this factor (power_data_decimated)
+	'keep_raw':True, #save power_data; false saves only the lock-in/decimated outputs
+}
+
+def load_spec(spec):
+	"""
+	Fills in the defaults for a run spec.
+
+	:param spec: A dict, or the path of a JSON file holding one.
+	:return: The full spec.
+	:rtype: dict
+	"""
+	if isinstance(spec,str):
+		with open(spec) as f:
+			spec = json.load(f)
+	unknown = set(spec) - set(DEFAULT_SPEC)
+	if unknown:
+		raise ValueError('Unknown run spec keys: %s' % ', '.join(sorted(unknown)))
+	full = dict(DEFAULT_SPEC)
+	full.update(spec)
+	if full['save_format'] not in ('mat','lcc'):
+		raise ValueError("save_format must be 'mat' or 'lcc'")
+	if full['start_mode'] not in ('software','trigger'):
+		raise ValueError("start_mode must be 'software' or 'trigger'")
+	return full
+
+def open_devices(spec,cam=None,ad=None):
+	"""
+	Opens whichever of the camera and Analog Discovery described by a (full)
+	spec isn't already given.
+	"""
+	from LCpy.QuickCapture.Quick_capture import blackfly_camera
+	from LCpy.AnalogDiscovery.AD_2 import Analog_Discovery, Analog_Discovery_Sweep
+	cam_backend = ad_backend = None
+	if spec['simulate']:
+		from LCpy.QuickCapture.sim_spin import sim_spin
+		from LCpy.AnalogDiscovery.sim_dwf import sim_dwf
+		from LCpy.sync import sim_trigger_line
+		line = sim_trigger_line() #the trigger wire, for start_mode 'trigger'
+		cam_backend = sim_spin(framerate=spec['framerate'],lines={spec['trigger_source']:line})
+		ad_backend = sim_dwf(trigger_lines={spec['trigger_pin']:line})
+	if cam is None:
+		cam = blackfly_camera(backend=cam_backend,framerate=spec['framerate'],exposure=spec['exposure'],
+			roi=spec['roi'],wh=spec['wh'],offset=spec['offset'],binning=spec['binning'],decimation=spec['decimation'])
+	if not ad is None:
+		return cam, ad
+	acq_n_samp = int(spec['collect_time']*spec['acq_samp_Hz'])
+	if spec['mod_freqs']:
+		ad = Analog_Discovery_Sweep(acq_samp_Hz=spec['acq_samp_Hz'],acq_n_samp=acq_n_samp,
+			waveform=spec['out_wv'],out_freq=spec['out_freq'],out_amp=spec['out_amp'],
+			acq_range=spec['acq_range'],mod_freq=spec['mod_freqs'][0],backend=ad_backend)
+	else:
+		ad = Analog_Discovery(acq_samp_Hz=spec['acq_samp_Hz'],acq_n_samp=acq_n_samp,
+			waveform=spec['out_wv'],out_freq=spec['out_freq'],out_amp=spec['out_amp'],
+			acq_range=spec['acq_range'],backend=ad_backend)
+	return cam, ad
+
+def _write_metrics(path,metrics):
+	# Written to a temporary file and moved into place, so a reader never sees half a file
+	tmp = path+'.tmp'
+	with open(tmp,'w') as f:
+		json.dump(metrics,f,indent=1)
+	os.replace(tmp,path)
+
+def _data_name(spec,used):
+	name = spec['collect_name']+time.strftime('%m_%d_%H_%M',time.localtime())
+	if name in used:
+		n = 1
+		while '%s_%d' % (name,n) in used:
+			n += 1
+		name = '%s_%d' % (name,n)
+	used.add(name)
+	return name
+
+async def _acquire(cam,ad,trigger,timeout,take_args=None,**acquire_args):
+	"""
+	Starts one collect on both devices and waits for both of them. If either
+	fails or times out, the other one is stopped too.
+
+	:param take_args: Passed on to ad.take_data.
+	:param acquire_args: Passed on to cam.acquire_images.
+	:return: The camera's and the Analog Discovery's results, and whether
+		the collect timed out, in which case the results are the partial ones
+		the devices stopped with.
+	:rtype: tuple
+	"""
+	take_args = take_args or {}
+	if trigger is None:
+		start_time = max(time.time()+1,ad.output_start_time+2); #let the output offset settle
+		cam.start_time = start_time;
+		ad.start_time = start_time;
+		im_holder = cam.acquire_images(**acquire_args)
+		dat_holder = ad.take_data(**take_args);
+	else:
+		# start() waits (up to arm_timeout) for both to arm; keep the loop free meanwhile
+		im_holder, dat_holder = await asyncio.get_running_loop().run_in_executor(None,
+			lambda: trigger.start(take_args,**acquire_args))
+	tasks = [asyncio.ensure_future(wait_async(holder,timeout)) for holder in (im_holder,dat_holder)]
+	try:
+		done, pending = await asyncio.wait(tasks,return_when=asyncio.FIRST_EXCEPTION)
+		if pending:
+			# One of them failed or timed out; stop the other with what it has
+			im_holder.cancel()
+			dat_holder.cancel()
+			await asyncio.wait(pending)
+	except BaseException:
+		im_holder.cancel()
+		dat_holder.cancel()
+		for task in tasks:
+			task.cancel()
+		raise
+	results = []
+	timed_out = False
+	for task in tasks:
+		exc = task.exception()
+		if exc is None:
+			results.append(task.result())
+		elif isinstance(exc,TimeoutError) and hasattr(exc,'partial_result'):
+			results.append(exc.partial_result)
+			timed_out = True
+		else:
+			raise exc
+	return results[0], results[1], timed_out
+
+def run(spec,cam=None,ad=None):
+	"""
+	Runs every collect in a spec, saving each one to output_fold as
+	<collect_name><timestamp>.mat (or .lcc) while the next collect acquires.
+
+	:param spec: Run spec, see DEFAULT_SPEC.
+	:param cam: An open blackfly_camera, or None to open one.
+	:param ad: An open Analog_Discovery(_Sweep), or None to open one.
+	:return: The names of the collects saved.
+	:rtype: list
+	"""
+	return asyncio.run(run_async(spec,cam,ad))
+
+async def run_async(spec,cam=None,ad=None):
+	"""
+	run() for code that already has an event loop. Each collect waits on the
+	camera and the Analog Discovery together, and a collect that overruns
+	collect_time by more than timeout_margin is stopped and whatever it had
+	acquired is saved, with timed_out set, before the run carries on.
+	"""
+	spec = load_spec(spec)
+	output_fold = spec['output_fold']
+	if not os.path.exists(output_fold):
+		os.makedirs(output_fold)
+	cam, ad = open_devices(spec,cam,ad)
+	stop_file = spec['stop_file']
+	if stop_file and os.path.exists(stop_file):
+		os.remove(stop_file)
+
+	framerate = cam.get_framerate() #what the camera settled on, within its limits for the ROI
+	framerate_ds = max(1,int(framerate/spec['desired_framerate']))
+	num_frames = int(spec['collect_time']*framerate)
+	mod_freqs = spec['mod_freqs'] or [None]
+	timeout = None
+	if not spec['timeout_margin'] is None:
+		timeout = spec['collect_time']+spec['timeout_margin']
+	trigger = None
+	if spec['start_mode'] == 'trigger':
+		trigger = trigger_start(cam,ad,source=spec['trigger_source'],pin=spec['trigger_pin'])
+	names = []
+	used = set()
+	if spec['save_format'] == 'lcc':
+		from LCpy.collect_file import collect_writer, save_collect
+		save_fn, ext = save_collect, '.lcc'
+	else:
+		import scipy.io as sio
+		save_fn, ext = sio.savemat, '.mat'
+	with background_saver(max_pending=spec['max_pending_saves'],save_fn=save_fn) as saver:
+		for collect in range(spec['num_collects']):
+			print(f"Taking data for collect {collect}");
+			for mod_freq in mod_freqs:
+				if not mod_freq is None:
+					print(f"Taking data for mod frequency {mod_freq}");
+					ad.output_setup(waveform=spec['out_wv'],out_freq=spec['out_freq'],out_amp=spec['out_amp'],mod_freq=mod_freq)
+				data_name = _data_name(spec,used)
+				reducers = build_reducers(**spec['reductions']) if spec['reductions'] else None
+				lock = None
+				if not spec['lockin'] is None:
+					lock_args = dict(spec['lockin'])
+					lock = lockin(lock_args.pop('freq',spec['out_freq']),spec['acq_samp_Hz'],**lock_args)
+				decim = None if not spec['input_decimate'] else decimator(spec['input_decimate'])
+				take_stages = [stage for stage in (lock,decim) if not stage is None]
+				sink = None
+				if spec['stream_frames'] and spec['keep_frames']:
+					if ext == '.lcc':
+						sink = collect_writer(os.path.join(output_fold,data_name+ext))
+					else:
+						from LCpy.QuickCapture.frame_sink import chunked_frame_sink
+						sink = chunked_frame_sink(os.path.join(output_fold,data_name+'_frames'))
+				im_result, power_data, timed_out = await _acquire(cam,ad,trigger,timeout,
+					num_frames=num_frames,decimate=framerate_ds,sink=sink,chunk_data=spec['chunk_data'],
+					reducers=reducers,keep_frames=spec['keep_frames'],
+					take_args={'stages':take_stages,'keep_raw':spec['keep_raw']})
+				images, images_t, frame_meta = im_result;
+				if trigger is None:
+					skew = start_skew(images_t,ad.input_start_time,frame_meta=frame_meta)
+				else:
+					skew = trigger.skew(images_t,frame_meta)
+				print("  Done (start skew %.1f ms). Saving data out." % (1e3*skew['skew_s']))
+				if timed_out:
+					print("  Collect timed out after %.1f s; saving what was acquired." % timeout)
+				outdic = {};
+				if images is None:
+					pass #only the reductions were kept
+				elif sink is None or ext == '.lcc':
+					outdic['images']=images #a streamed .lcc is finished off by save_collect
+				else:
+					sink.close()
+					outdic['images_path']=sink.path
+				outdic['images_t']=images_t
+				if reducers:
+					outdic.update(reductions(reducers))
+				if spec['chunk_data']:
+					outdic['frame_meta']=frame_meta
+					outdic['frames_dropped']=cam.last_acquisition['frames_dropped']
+				if not power_data is None:
+					outdic['power_data']=power_data
+				gaps = getattr(ad,'last_take_stats',{}).get('gaps')
+				if gaps:
+					outdic['power_gaps']=np.array(gaps) #(start, stop) of the samples lost from power_data
+				if not lock is None:
+					for key, value in lock.result().items():
+						outdic['lockin_'+key]=value
+					outdic['lockin_freq']=lock.freq
+				if not decim is None:
+					outdic['power_data_decimated']=decim.result()['data']
+					outdic['power_decimate']=decim.q
+				outdic['power_start_time']=ad.input_start_time
+				outdic['start_skew']=skew['skew_s']
+				outdic['start_skew_clock']=skew['cam_clock']
+				outdic['out_freq']=spec['out_freq']
+				if not mod_freq is None:
+					outdic['mod_freq']=mod_freq
+				outdic['out_wv']=spec['out_wv']
+				outdic['acq_samp_Hz']=spec['acq_samp_Hz']
+				outdic['out_amp']=spec['out_amp']
+				outdic['collect_time']=spec['collect_time']
+				outdic['timed_out']=timed_out
+				outdic['metrics']=snapshot_all(camera=getattr(cam,'metrics',None),
+					analog_discovery=getattr(ad,'metrics',None),saver=saver.metrics)
+				if spec['metrics_file']:
+					_write_metrics(spec['metrics_file'],outdic['metrics'])
+				on_done = None
+				if sink is None and not images is None:
+					on_done = lambda images=images: cam.release_frames(images)
+				# submit() blocks while the save queue is full
+				path = os.path.join(output_fold,data_name+ext)
+				await asyncio.get_running_loop().run_in_executor(None,
+					lambda: saver.submit(path,outdic,on_done=on_done))
+				names.append(data_name)
+				del outdic, images, im_result, power_data
+
+	if stop_file:
+		open(stop_file,'w').close()
+	return names
+
+def main(argv=None):
+	argv = sys.argv[1:] if argv is None else argv
+	if len(argv) != 1:
+		print('usage: python -m LCpy.runner spec.json')
+		return 2
+	run(argv[0])
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
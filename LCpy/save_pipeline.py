@@ -0,0 +1,104 @@
+"""
+Background saving of finished collects.
+
+The full_script loops used to sit in sio.savemat for every collect before
+starting the next one. background_saver takes ownership of a collect's output
+dictionary and writes it on its own thread while the next acquisition runs. The
+queue of collects waiting to be written is bounded, so at most max_pending
+collects (plus the one being written) are held in memory; submit() blocks when
+it is full. A failed write is printed as it happens and raised again from the
+run loop on the next submit(), check() or close(). Save durations and bytes
+written are kept in the saver's metrics registry.
+"""
+
+import os
+import threading
+import queue
+import time
+
+import scipy.io as sio
+
+from LCpy.metrics import registry
+
+class background_saver:
+	def __init__(self,max_pending=1,save_fn=sio.savemat,verbose=False):
+		"""
+		:param max_pending: Collects allowed to wait behind the one being written.
+		:type max_pending: int
+		:param save_fn: Called as save_fn(path,outdic) on the saver thread.
+		:param verbose: Print when each save finishes.
+		"""
+		self.save_fn = save_fn;
+		self.verbose = verbose;
+		self._queue = queue.Queue(maxsize=max(1,int(max_pending)))
+		self._errors = [];
+		self.n_saved = 0;
+		self.metrics = registry('saver');
+		self._thread = threading.Thread(target=self._run,name='collect-saver',daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			job = self._queue.get()
+			if job is None:
+				self._queue.task_done()
+				return
+			path, outdic, on_done = job
+			try:
+				t0 = time.time()
+				self.save_fn(path,outdic)
+				self.n_saved += 1
+				self.metrics.histogram('save_s').record(time.time()-t0)
+				self.metrics.counter('saves').inc()
+				if os.path.exists(path):
+					self.metrics.counter('bytes_written').inc(os.path.getsize(path))
+				if self.verbose: print(f'  Saved {path} in {time.time()-t0:.1f} s')
+			except Exception as ex:
+				print(f'Saving {path} failed: {ex}')
+				self._errors.append(ex)
+				self.metrics.counter('save_errors').inc()
+			finally:
+				if on_done is not None:
+					on_done()
+				del outdic
+				self._queue.task_done()
+
+	def check(self):
+		"""
+		Raises the first save error that hasn't been raised yet.
+		"""
+		if self._errors:
+			raise self._errors.pop(0)
+
+	def submit(self,path,outdic,on_done=None):
+		"""
+		Queues outdic to be written to path. The saver owns outdic (and the
+		arrays in it) from here on; don't modify them. Blocks while the queue is
+		full.
+
+		:param on_done: Called on the saver thread once the write has finished
+			(or failed), e.g. to hand the frames back to the camera's pool.
+		"""
+		self.check()
+		t0 = time.time()
+		self._queue.put((path,outdic,on_done))
+		self.metrics.histogram('submit_wait_s').record(time.time()-t0)
+
+	def join(self):
+		"""
+		Waits for every queued collect to be written, then raises any save error.
+		"""
+		self._queue.join()
+		self.check()
+
+	def close(self):
+		if self._thread.is_alive():
+			self._queue.put(None)
+			self._thread.join()
+		self.check()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self,*exc):
+		self.close()
@@ -0,0 +1,205 @@
+"""
+Starting the camera and the Analog Discovery together.
+
+By default both devices wait for a shared start_time and then start
+themselves, so the skew between them depends on thread scheduling and driver
+latency. trigger_start instead arms both and starts them off one hardware edge:
+the Analog Discovery record waits on a PC trigger that is also routed out of
+its trigger pin, which is wired to the camera's trigger input. start_skew
+reports how far apart the two starts were, for either mode: from the camera's
+own frame timestamps (mapped onto host time) when chunk data was recorded,
+otherwise from when the frames reached the host, which adds the USB and
+driver latency.
+
+The sim_* classes stand in for the two devices (and the wire between them) so
+the arming and firing logic can be exercised without hardware.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from LCpy.ez_thread import threaded
+from LCpy.QuickCapture.frame_meta import fit_clock, device_to_host
+
+def start_skew(images_t,ad_start_time,trigger_time=None,frame_meta=None):
+	"""
+	Summarises how well a collect's camera and Analog Discovery starts lined up.
+
+	:param images_t: Capture times returned by acquire_images.
+	:param ad_start_time: The Analog Discovery's input_start_time.
+	:param trigger_time: Host time the trigger was fired, for triggered starts.
+	:param frame_meta: The FRAME_META_DTYPE array acquire_images returns with
+		chunk_data. The camera start is then its first frame's own timestamp,
+		mapped onto host time with fit_clock, rather than its arrival time.
+	:return: cam_start, ad_start and skew_s (camera minus Analog Discovery, in
+		seconds), cam_clock ('device' or 'host', which cam_start came from), plus
+		each device's latency from the trigger when there was one.
+	:rtype: dict
+	"""
+	cam_start = float(images_t[0]) if len(images_t) else float('nan')
+	cam_clock = 'host'
+	if not frame_meta is None:
+		valid = frame_meta['device_ts'] > 0
+		if valid.any():
+			offset, scale, _ = fit_clock(frame_meta['device_ts'][valid],frame_meta['host_t'][valid])
+			cam_start = float(device_to_host(frame_meta['device_ts'][valid][0],offset,scale))
+			cam_clock = 'device'
+	report = {'cam_start':cam_start,'ad_start':ad_start_time,'skew_s':cam_start-ad_start_time,'cam_clock':cam_clock}
+	if not trigger_time is None:
+		report['trigger_time'] = trigger_time
+		report['cam_latency_s'] = cam_start-trigger_time
+		report['ad_latency_s'] = ad_start_time-trigger_time
+	return report
+
+class trigger_start:
+	def __init__(self,cam,ad,source='Line0',selector='AcquisitionStart',pin=0,arm_timeout=10.0):
+		"""
+		:param cam: A blackfly_camera (or anything with configure_trigger/armed/acquire_images).
+		:param ad: An Analog_Discovery (or anything with configure_trigger/armed/fire_trigger/take_data).
+		:param source: Camera trigger input the Analog Discovery pin is wired to.
+		:param selector: Camera trigger selector, see blackfly_camera.configure_trigger.
+		:param pin: Analog Discovery trigger pin (0 for T1, 1 for T2).
+		:param arm_timeout: Seconds to wait for both devices to arm before giving up.
+		"""
+		self.cam = cam;
+		self.ad = ad;
+		self.arm_timeout = arm_timeout;
+		self.trigger_time = None;
+		if cam.configure_trigger(source=source,selector=selector) is False:
+			raise RuntimeError('Could not put the camera in trigger mode')
+		ad.configure_trigger(pin=pin)
+
+	def start(self,take_args=None,**acquire_args):
+		"""
+		Arms both devices, waits until both are ready and fires the trigger.
+
+		:param take_args: Passed on to ad.take_data, e.g. stages.
+		:param acquire_args: Passed on to cam.acquire_images.
+		:return: The camera and Analog Discovery futures.
+		:rtype: tuple
+		"""
+		self.cam.start_time = 0;
+		self.ad.start_time = 0;
+		self.cam.armed.clear()
+		self.ad.armed.clear()
+		im_holder = self.cam.acquire_images(**acquire_args)
+		dat_holder = self.ad.take_data(**(take_args or {}))
+		try:
+			deadline = time.time()+self.arm_timeout
+			for dev in (self.cam,self.ad):
+				if not dev.armed.wait(max(deadline-time.time(),0)):
+					raise RuntimeError('%s did not arm within %.1f s' % (type(dev).__name__,self.arm_timeout))
+			self.trigger_time = time.time()
+			self.ad.fire_trigger()
+		except BaseException:
+			# Don't leave the armed device waiting for a trigger that won't come
+			im_holder.cancel()
+			dat_holder.cancel()
+			raise
+		return im_holder, dat_holder
+
+	def skew(self,images_t,frame_meta=None):
+		"""
+		start_skew for the last collect started.
+		"""
+		return start_skew(images_t,self.ad.input_start_time,self.trigger_time,frame_meta)
+
+class sim_trigger_line:
+	def __init__(self):
+		"""
+		The wire from the Analog Discovery trigger pin to the camera trigger input.
+		"""
+		self.event = threading.Event()
+		self.fire_time = None;
+
+	def fire(self):
+		self.fire_time = time.time()
+		self.event.set()
+
+	def reset(self):
+		self.event.clear()
+		self.fire_time = None
+
+class sim_triggered_camera:
+	def __init__(self,line,framerate=30.0,wh=(64,48),latency=0.002,jitter=0.0005,seed=None):
+		"""
+		A camera that, once armed, starts delivering frames latency (+/- jitter)
+		seconds after the trigger line fires, or straight away if not triggered.
+		"""
+		self.line = line;
+		self.framerate = framerate;
+		self.wh = wh;
+		self.latency = latency;
+		self.jitter = jitter;
+		self.rng = np.random.default_rng(seed)
+		self.start_time = 0;
+		self.triggered = False;
+		self.armed = threading.Event()
+
+	def configure_trigger(self,source='Line0',selector='AcquisitionStart',activation='RisingEdge'):
+		self.triggered = True;
+		return True
+
+	def trigger_off(self):
+		self.triggered = False;
+		return True
+
+	@threaded
+	def acquire_images(self,num_frames=10,**kwargs):
+		while time.time()<self.start_time:
+			time.sleep(0.001);
+		self.line.reset() #nothing fires before both devices are armed
+		self.armed.set()
+		if self.triggered:
+			if not self.line.event.wait(10.0):
+				raise RuntimeError('Trigger never arrived')
+			t0 = self.line.fire_time
+		else:
+			t0 = time.time()
+		t0 += self.latency + self.jitter*self.rng.standard_normal()
+		capture_times = t0 + np.arange(int(num_frames))/self.framerate
+		return np.zeros((int(num_frames),self.wh[1],self.wh[0]),dtype=np.uint8), capture_times, None
+
+class sim_triggered_ad:
+	def __init__(self,line,acq_n_samp=1000,latency=0.0001):
+		"""
+		An Analog Discovery whose record starts when its PC trigger fires, and
+		which drives the trigger line at the same moment.
+		"""
+		self.line = line;
+		self.acq_n_samp = acq_n_samp;
+		self.latency = latency;
+		self.start_time = 0;
+		self.input_start_time = None;
+		self.triggered = False;
+		self.armed = threading.Event()
+		self._fired = threading.Event()
+
+	def configure_trigger(self,pin=0):
+		self.triggered = True;
+
+	def trigger_off(self):
+		self.triggered = False;
+
+	def fire_trigger(self):
+		self.line.fire()
+		self.input_start_time = self.line.fire_time + self.latency;
+		self._fired.set()
+
+	@threaded
+	def take_data(self,stages=None,keep_raw=True,pad_lost=False):
+		while time.time()<self.start_time:
+			time.sleep(0.001);
+		self._fired.clear()
+		self.armed.set()
+		if self.triggered:
+			if not self._fired.wait(10.0):
+				raise RuntimeError('Trigger never arrived')
+		else:
+			self.input_start_time = time.time();
+		samples = np.zeros((2,int(self.acq_n_samp)))
+		for stage in stages or []:
+			stage.process(samples,0)
+		return samples if keep_raw else None